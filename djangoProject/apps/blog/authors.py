@@ -0,0 +1,141 @@
+import json
+
+from blog.cache import author_key, author_name_key, normalize_keywords
+from blog.clients import LazyClient
+from blog.compiled_serializers import AUTHOR_MARKER_PATTERN
+from blog.constants import AUTHOR_TIMEOUT, AUTHOR_LOOKUP_MAX
+from blog.encoders import encode_response
+from blog.models import User
+
+
+class AuthorStore:
+    """
+    作者信息缓存: 搜索文档、文章卡片与评论页缓存只保存 user_id, 用户名与头像在读取时由此补全
+    用户改名只需删除一个键, 与其文章及评论数量无关
+    """
+    redis = LazyClient('raw_redis')
+
+    @staticmethod
+    def build(user_ids):
+        """
+        从数据库读取作者信息, 字段顺序与文章卡片中的 user_info 一致
+        :param user_ids:
+        :return: {用户id: 作者信息}
+        """
+        return {
+            user_id: {"icon": icon, "username": username}
+            for user_id, icon, username in User.objects.filter(
+                id__in=user_ids
+            ).values_list('id', 'icon', 'username')
+        }
+
+    def get_many(self, user_ids):
+        """
+        批量获得作者信息, 缺失的回源数据库后写入缓存
+        :param user_ids:
+        :return: {用户id: 作者信息}
+        """
+        user_ids = list(set(user_ids))
+        if not user_ids:
+            return {}
+        authors = {
+            user_id: json.loads(author)
+            for user_id, author in zip(user_ids, self.redis.mget([author_key(user_id) for user_id in user_ids]))
+            if author is not None
+        }
+        missing = [user_id for user_id in user_ids if user_id not in authors]
+        if missing:
+            built = self.build(missing)
+            if built:
+                pipe = self.redis.pipeline(transaction=False)
+                for user_id, author in built.items():
+                    pipe.set(author_key(user_id), json.dumps(author), ex=AUTHOR_TIMEOUT)
+                pipe.execute()
+            authors.update(built)
+        return authors
+
+    def fill(self, contents):
+        """
+        将已编码内容中的作者占位替换为作者信息, 一批内容共用一次 MGET
+        :param contents: 字节列表, 可包含 None
+        :return:
+        """
+        user_ids = {
+            int(match.group(2))
+            for content in contents if content is not None
+            for match in AUTHOR_MARKER_PATTERN.finditer(content)
+        }
+        authors = self.get_many(user_ids)
+        encoded = {}
+
+        def replace(match):
+            field, user_id = match.group(1), int(match.group(2))
+            value = encoded.get((field, user_id))
+            if value is None:
+                author = authors.get(user_id) or {"icon": None, "username": None}
+                if field == b'n':
+                    value = encode_response(author['username'])
+                elif field == b'i':
+                    value = encode_response(author['icon'])
+                else:
+                    value = encode_response(author)
+                encoded[(field, user_id)] = value
+            return value
+
+        return [None if content is None else AUTHOR_MARKER_PATTERN.sub(replace, content) for content in contents]
+
+    def find_ids(self, keywords):
+        """
+        查找用户名与搜索词或其中某个词完全一致的作者, 用于按作者名搜索
+        每个候选词的结果(包括没有该作者)缓存在 redis, 搜索时通常不访问数据库
+        改名后旧名字的缓存按作者信息中的当前用户名校验, 不一致时回源
+        :param keywords: 规范化后的搜索词
+        :return:
+        """
+        candidates = [keywords] + keywords.split()
+        candidates = list(dict.fromkeys(candidate for candidate in candidates if candidate))[:AUTHOR_LOOKUP_MAX]
+        if not candidates:
+            return []
+        cached = {
+            candidate: json.loads(user_ids)
+            for candidate, user_ids in zip(
+                candidates, self.redis.mget([author_name_key(candidate) for candidate in candidates])
+            )
+            if user_ids is not None
+        }
+        authors = self.get_many(user_id for user_ids in cached.values() for user_id in user_ids)
+        for candidate, user_ids in list(cached.items()):
+            if any(normalize_keywords(authors.get(user_id, {}).get('username', '')) != candidate
+                   for user_id in user_ids):
+                del cached[candidate]
+
+        missing = [candidate for candidate in candidates if candidate not in cached]
+        found = []
+        if missing:
+            built = {candidate: [] for candidate in missing}
+            for user_id, username in User.objects.filter(username__in=missing).values_list('id', 'username'):
+                # 数据库排序规则可能认为不同写法相等, 无法对应到候选词的结果只用于本次查询
+                built.get(normalize_keywords(username), found).append(user_id)
+            pipe = self.redis.pipeline(transaction=False)
+            for candidate, user_ids in built.items():
+                pipe.set(author_name_key(candidate), json.dumps(user_ids), ex=AUTHOR_TIMEOUT)
+            pipe.execute()
+            cached.update(built)
+        return list(dict.fromkeys(
+            [user_id for user_ids in cached.values() for user_id in user_ids] + found
+        ))
+
+    @staticmethod
+    def suggest(prefix, size):
+        """
+        按前缀提示作者名
+        :param prefix:
+        :param size:
+        :return:
+        """
+        return list(User.objects.filter(
+            username__istartswith=prefix
+        ).order_by('username').values_list('username', flat=True)[:size])
+
+
+author_store = AuthorStore()
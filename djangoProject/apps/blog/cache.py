@@ -0,0 +1,302 @@
+import hashlib
+import time
+import unicodedata
+import uuid
+
+from django_redis import get_redis_connection
+from blog.clients import LazyClient, LazyScript
+from blog.constants import REDIS_KEY, RESPONSE_CACHE_TIMEOUT, RESPONSE_CACHE_LOCK_TIMEOUT, \
+    RESPONSE_CACHE_LOCK_WAIT, ARTICLE_CARD_VERSION, ARTICLE_CARD_TIMEOUT
+from django.db import transaction
+from django.utils import timezone
+from blog.models import Article, Comment
+from blog.outbox import publish
+
+
+def get_raw_redis_connection():
+    """
+    获得不解码返回值的 redis 连接, 用于存取预编码的字节
+    :return:
+    """
+    connection = get_redis_connection()
+    pool = connection.connection_pool
+    connection_kwargs = dict(pool.connection_kwargs, decode_responses=False)
+    return connection.__class__(
+        connection_pool=pool.__class__(
+            connection_class=pool.connection_class,
+            max_connections=pool.max_connections,
+            **connection_kwargs
+        )
+    )
+
+
+class ResponseCache:
+    """
+    响应缓存: 按范围(scope)维护版本号, 写入时递增版本使旧缓存全部失效
+    缓存内容为编码后的响应字节, 重建时加短锁防止同一页面并发回源
+    """
+    RELEASE_SCRIPT = """
+    if redis.call('get', KEYS[1]) == ARGV[1] then
+        return redis.call('del', KEYS[1])
+    end
+    return 0
+    """
+    redis = LazyClient('raw_redis')
+    release_script = LazyScript('raw_redis', RELEASE_SCRIPT)
+
+    def __init__(self, timeout=RESPONSE_CACHE_TIMEOUT, lock_timeout=RESPONSE_CACHE_LOCK_TIMEOUT):
+        self.timeout = timeout
+        self.lock_timeout = lock_timeout
+
+    def get_version(self, scope):
+        """
+        获得范围当前版本号
+        :param scope:
+        :return:
+        """
+        version = self.redis.get(REDIS_KEY['response_version_key'].format(scope))
+        return int(version) if version is not None else 0
+
+    def get_version_info(self, *scopes):
+        """
+        一次读取多个范围的版本号与最后修改时间
+        :param scopes:
+        :return: [(版本号, 修改时间戳或 None), ...]
+        """
+        keys = []
+        for scope in scopes:
+            keys.append(REDIS_KEY['response_version_key'].format(scope))
+            keys.append(REDIS_KEY['response_modified_key'].format(scope))
+        values = self.redis.mget(keys)
+        return [
+            (int(version) if version is not None else 0, float(modified) if modified is not None else None)
+            for version, modified in zip(values[::2], values[1::2])
+        ]
+
+    def bump(self, *scopes, delete_keys=()):
+        """
+        递增版本号使范围内缓存失效, 并记录修改时间
+        :param scopes:
+        :param delete_keys: 同时删除的键
+        :return:
+        """
+        now = time.time()
+        pipe = self.redis.pipeline(transaction=False)
+        for scope in scopes:
+            pipe.incr(REDIS_KEY['response_version_key'].format(scope))
+            pipe.set(REDIS_KEY['response_modified_key'].format(scope), now)
+        if delete_keys:
+            pipe.delete(*delete_keys)
+        pipe.execute()
+
+    def bump_on_commit(self, *scopes, delete_keys=()):
+        """
+        事务提交后再递增版本号, 避免并发读取按未提交前的数据以新版本号重建缓存
+        不在事务中时立即执行, 回滚时不执行
+        :param scopes:
+        :param delete_keys:
+        :return:
+        """
+        transaction.on_commit(lambda: self.bump(*scopes, delete_keys=delete_keys))
+
+    def get_key(self, scope, request):
+        """
+        按完整请求地址生成缓存键
+        :param scope:
+        :param request:
+        :return:
+        """
+        digest = hashlib.md5(request.build_absolute_uri().encode('utf-8')).hexdigest()
+        return REDIS_KEY['response_key'].format(scope, self.get_version(scope), digest)
+
+    def get_or_build(self, key, builder, timeout=None, metrics_key=None):
+        """
+        读取缓存, 未命中时由持有锁的请求重建, 其余请求等待结果
+        :param key:
+        :param builder: 返回响应字节的函数
+        :param timeout: 缓存时间, 默认使用实例设置
+        :param metrics_key: 记录命中与未命中次数的哈希键
+        :return:
+        """
+        content = self.redis.get(key)
+        if metrics_key is not None:
+            self.redis.hincrby(metrics_key, 'miss' if content is None else 'hit')
+        if content is not None:
+            return content
+
+        lock_key = key + '_lock'
+        token = uuid.uuid4().hex
+        if self.redis.set(lock_key, token, nx=True, px=self.lock_timeout):
+            try:
+                content = builder()
+                self.redis.set(key, content, ex=timeout or self.timeout)
+            finally:
+                self.release_script(keys=[lock_key], args=[token])
+            return content
+
+        deadline = time.monotonic() + self.lock_timeout / 1000
+        while time.monotonic() < deadline:
+            time.sleep(RESPONSE_CACHE_LOCK_WAIT)
+            content = self.redis.get(key)
+            if content is not None:
+                return content
+        return builder()
+
+
+response_cache = ResponseCache()
+
+
+def article_scope(article_id):
+    return 'article_{}'.format(article_id)
+
+
+def comment_scope(article_id):
+    return 'comment_{}'.format(article_id)
+
+
+def normalize_keywords(keywords):
+    """
+    统一全半角、大小写与空白, 使等价的搜索词共用缓存
+    :param keywords:
+    :return:
+    """
+    return ' '.join(unicodedata.normalize('NFKC', keywords).lower().split())
+
+
+def search_key(keywords, page):
+    """
+    按规范化后的搜索词与页码生成搜索结果缓存键
+    :param keywords:
+    :param page:
+    :return:
+    """
+    digest = hashlib.md5('{}|{}'.format(normalize_keywords(keywords), page).encode('utf-8')).hexdigest()
+    return REDIS_KEY['response_key'].format('search', response_cache.get_version('search'), digest)
+
+
+def get_search_metrics():
+    """
+    获得搜索结果缓存命中指标
+    :return:
+    """
+    metrics = response_cache.redis.hgetall(REDIS_KEY['search_cache_metrics_key'])
+    hit = int(metrics.get(b'hit', 0))
+    miss = int(metrics.get(b'miss', 0))
+    return {
+        "hit": hit,
+        "miss": miss,
+        "hit_ratio": hit / (hit + miss) if hit + miss else 0,
+    }
+
+
+def article_card_key(article_id):
+    return REDIS_KEY['article_card_key'].format(ARTICLE_CARD_VERSION, article_id)
+
+
+def article_card_generation_key(article_id):
+    return REDIS_KEY['article_card_generation_key'].format(article_id)
+
+
+def expire_article_cards(article_ids):
+    """
+    提交后递增文章卡片生成序号并删除卡片, 提交前读取数据库的请求不能再写回旧卡片
+    :param article_ids:
+    :return:
+    """
+    def expire():
+        pipe = response_cache.redis.pipeline(transaction=False)
+        for article_id in article_ids:
+            generation_key = article_card_generation_key(article_id)
+            pipe.incr(generation_key)
+            pipe.expire(generation_key, ARTICLE_CARD_TIMEOUT)
+            pipe.delete(article_card_key(article_id))
+        pipe.execute()
+
+    if article_ids:
+        transaction.on_commit(expire)
+
+
+def author_key(user_id):
+    return REDIS_KEY['author_key'].format(user_id)
+
+
+def comment_thread_key(article_id):
+    return REDIS_KEY['comment_thread_key'].format(article_id)
+
+
+def author_name_key(username):
+    return REDIS_KEY['author_name_key'].format(normalize_keywords(username))
+
+
+def invalidate_article(article_id):
+    """
+    文章及其图片、标签变化时使公开列表、文章详情与文章卡片缓存失效
+    :param article_id:
+    :return:
+    """
+    response_cache.bump_on_commit('feed', article_scope(article_id))
+    expire_article_cards([article_id])
+    # 搜索文档中附带卡片, 经发件箱与数据同一事务提交后重新索引
+    publish('search_index', article_ids=[article_id])
+
+
+def touch_article(article_id):
+    """
+    图片、标签变化时更新文章修改时间, 使文章详情的 Last-Modified/ETag 随之变化
+    :param article_id:
+    :return:
+    """
+    Article.objects.filter(id=article_id).update(datetime_update=timezone.now())
+
+
+def invalidate_comments(article_id=None, comment_id=None):
+    """
+    评论或回复变化时递增文章评论版本号
+    :param article_id:
+    :param comment_id: 未提供文章 id 时由评论 id 查询
+    :return: 文章 id, 评论已不存在时为 None
+    """
+    if article_id is None:
+        article_id = Comment.objects.filter(id=comment_id).values_list('article_id', flat=True).first()
+        if article_id is None:
+            return None
+    response_cache.bump_on_commit(comment_scope(article_id))
+    return article_id
+
+
+def invalidate_author(user_id, username=None):
+    """
+    作者用户名或头像变化时删除作者信息缓存, 并使含作者信息的整页响应缓存与评论 ETag 失效
+    搜索文档、文章卡片与评论页缓存只保存 user_id, 读取时补全, 无需删除或重新索引
+    开销固定, 与作者的文章及评论数量无关
+    :param user_id:
+    :param username: 当前用户名, 删除该名字可能存在的"无此作者"缓存
+    :return:
+    """
+    delete_keys = [author_key(user_id)]
+    if username is not None:
+        delete_keys.append(author_name_key(username))
+    response_cache.bump_on_commit('feed', 'search', 'author', delete_keys=delete_keys)
+
+
+def invalidate_author_name(username):
+    """
+    新用户注册后删除该名字的"无此作者"缓存
+    :param username:
+    :return:
+    """
+    transaction.on_commit(lambda: response_cache.redis.delete(author_name_key(username)))
+
+
+def invalidate_articles(article_filter, reindex=True):
+    """
+    作者或目录变化时使相关文章卡片与公开列表缓存失效
+    :param article_filter:
+    :param reindex: 是否重新索引搜索文档中的卡片
+    :return:
+    """
+    article_ids = list(Article.objects.filter(**article_filter).values_list('id', flat=True))
+    response_cache.bump_on_commit('feed')
+    expire_article_cards(article_ids)
+    if reindex and article_ids:
+        publish('search_index', article_ids=article_ids)
@@ -0,0 +1,121 @@
+from blog.authors import author_store
+from blog.cache import article_card_key, article_card_generation_key
+from blog.clients import LazyClient, LazyScript
+from blog.constants import ARTICLE_CARD_TIMEOUT, SEARCH_CARD_VERSION
+from blog.compiled_serializers import article_card_serializer
+from blog.encoders import encode_response, RawJSON
+
+
+class ArticleCardStore:
+    """
+    文章卡片缓存: 每篇文章的列表展示数据只序列化一次, 以字节形式存入 Redis
+    列表页先取 id, 再一次 MGET 取卡片, 仅缺失的卡片回源数据库
+    回源前读取生成序号, 写入时序号已被失效操作递增则放弃, 旧卡片不会在失效后写回
+    卡片中的作者信息为占位, 读取时由 author_store 补全, 作者改名不需要删除卡片
+    """
+    WRITE_SCRIPT = """
+    local current = redis.call('get', KEYS[2]) or '0'
+    if current ~= ARGV[1] then
+        return 0
+    end
+    redis.call('set', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    return 1
+    """
+    redis = LazyClient('raw_redis')
+    write_script = LazyScript('raw_redis', WRITE_SCRIPT)
+
+    @staticmethod
+    def build(article_ids):
+        """
+        从数据库序列化卡片, 作者信息为占位
+        :param article_ids:
+        :return: {文章id: 卡片字节}
+        """
+        return {
+            data['id']: encode_response(data)
+            for data in article_card_serializer.serialize_ids(article_ids)
+        }
+
+    def get_many(self, article_ids):
+        """
+        按顺序获得补全作者信息的卡片, 不存在的文章返回 None
+        :param article_ids:
+        :return:
+        """
+        if not article_ids:
+            return []
+        cards = self.redis.mget([article_card_key(article_id) for article_id in article_ids])
+        missing = [article_id for article_id, card in zip(article_ids, cards) if card is None]
+        if missing:
+            generations = dict(zip(missing, self.redis.mget(
+                [article_card_generation_key(article_id) for article_id in missing]
+            )))
+            built = self.build(missing)
+            if built:
+                pipe = self.redis.pipeline(transaction=False)
+                for article_id, card in built.items():
+                    generation = generations.get(article_id)
+                    self.write_script(
+                        keys=[article_card_key(article_id), article_card_generation_key(article_id)],
+                        args=[generation.decode() if generation is not None else '0', card, ARTICLE_CARD_TIMEOUT],
+                        client=pipe
+                    )
+                pipe.execute()
+            cards = [
+                card if card is not None else built.get(article_id)
+                for article_id, card in zip(article_ids, cards)
+            ]
+        return author_store.fill(cards)
+
+    def get_page(self, article_ids):
+        """
+        拼接一页卡片列表, 跳过不存在的文章
+        :param article_ids:
+        :return:
+        """
+        cards = [card for card in self.get_many(article_ids) if card is not None]
+        return RawJSON(b'[' + b','.join(cards) + b']')
+
+    @staticmethod
+    def with_author(card, author):
+        """
+        索引中的卡片补全作者信息, 字段顺序与数据库生成的卡片一致
+        :param card:
+        :param author:
+        :return:
+        """
+        data = {}
+        for name, value in card.items():
+            data[name] = value
+            if name == 'id':
+                data['user_info'] = author
+        return data
+
+    def get_search_page(self, hits):
+        """
+        按搜索排序拼接卡片, 优先使用索引文档中的卡片并按 user_id 补全作者信息
+        卡片缺失、版本过期或作者不存在时回退到卡片缓存
+        :param hits:
+        :return:
+        """
+        sources = [hit.get('_source') or {} for hit in hits]
+        authors = author_store.get_many([
+            source['user_id'] for source in sources
+            if source.get('card_version') == SEARCH_CARD_VERSION and source.get('user_id')
+        ])
+        cards = []
+        stale = []
+        for hit, source in zip(hits, sources):
+            author = authors.get(source.get('user_id'))
+            if source.get('card') and source.get('card_version') == SEARCH_CARD_VERSION and author is not None:
+                cards.append(encode_response(self.with_author(source['card'], author)))
+            else:
+                cards.append(None)
+                stale.append(int(hit['_id']))
+        if stale:
+            filled = iter(self.get_many(stale))
+            cards = [next(filled) if card is None else card for card in cards]
+        return RawJSON(b'[' + b','.join(card for card in cards if card is not None) + b']')
+
+
+article_card_store = ArticleCardStore()
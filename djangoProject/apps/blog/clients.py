@@ -0,0 +1,117 @@
+import os
+import threading
+
+from django.utils.module_loading import import_string
+
+DEFAULT_CLIENTS = {
+    'redis': 'django_redis.get_redis_connection',
+    'raw_redis': 'blog.cache.get_raw_redis_connection',
+    'es': 'blog.search.elastic.create_es_connection',
+    'sms': 'blog.utils.create_acs_client',
+}
+
+
+class ClientRegistry:
+    """
+    外部服务客户端注册表: 导入时只记录创建函数, 每个进程首次使用时才创建
+    fork 后子进程丢弃父进程创建的客户端, 不共享连接池与套接字
+    """
+
+    def __init__(self, factories=None):
+        self.factories = dict(DEFAULT_CLIENTS, **(factories or {}))
+        self.clients = {}
+        self.created = []
+        self.pid = os.getpid()
+        self.lock = threading.RLock()
+
+    def register(self, name, factory):
+        """
+        注册或替换创建函数, 已创建的同名客户端被丢弃
+        :param name:
+        :param factory: 可调用对象或其导入路径
+        :return:
+        """
+        with self.lock:
+            self.factories[name] = factory
+            self.clients.pop(name, None)
+
+    def reset(self):
+        """
+        丢弃当前进程的全部客户端, fork 后在子进程中调用
+        :return:
+        """
+        self.clients = {}
+        self.created = []
+        self.pid = os.getpid()
+        self.lock = threading.RLock()
+
+    def cached(self, key, factory):
+        """
+        获得当前进程的客户端或由客户端派生的对象(如 lua 脚本), 不存在时创建
+        :param key:
+        :param factory:
+        :return:
+        """
+        if self.pid != os.getpid():
+            self.reset()
+        try:
+            return self.clients[key]
+        except KeyError:
+            pass
+        with self.lock:
+            if key not in self.clients:
+                self.clients[key] = factory()
+                self.created.append(key)
+            return self.clients[key]
+
+    def get(self, name):
+        """
+        获得客户端
+        :param name:
+        :return:
+        """
+        def create():
+            factory = self.factories[name]
+            if isinstance(factory, str):
+                factory = import_string(factory)
+            return factory()
+
+        return self.cached(name, create)
+
+
+clients = ClientRegistry()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=clients.reset)
+
+
+class LazyClient:
+    """
+    类属性: 读取时从注册表获得当前进程的客户端, 实例可以直接赋值覆盖
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return clients.get(self.name)
+
+
+class LazyScript:
+    """
+    类属性: 在当前进程的 redis 客户端上注册 lua 脚本
+    """
+
+    def __init__(self, client_name, script):
+        self.client_name = client_name
+        self.script = script
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return clients.cached(
+            ('script', self.client_name, self.script),
+            lambda: clients.get(self.client_name).register_script(self.script)
+        )
@@ -0,0 +1,373 @@
+import hashlib
+import re
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from blog.constants import REPLY_PREVIEW_SIZE
+from blog.models import Article, ArticleImages, Tag, Comment, Reply
+
+
+def format_datetime(value):
+    """
+    与 '%Y年%m月%d日 %H时:%M分:%S秒' 的 strftime 输出一致
+    :param value:
+    :return:
+    """
+    if value is None:
+        return None
+    return '%d年%02d月%02d日 %02d时:%02d分:%02d秒' % (
+        value.year, value.month, value.day, value.hour, value.minute, value.second
+    )
+
+
+class Value:
+    """
+    取 values_list 行中的一列
+    """
+
+    def __init__(self, column, to_representation=None):
+        self.column = column
+        self.to_representation = to_representation
+
+    def compile(self, index):
+        position = index[self.column]
+        to_representation = self.to_representation
+        if to_representation is None:
+            return lambda row, related: row[position]
+        return lambda row, related: to_representation(row[position])
+
+
+class DateTime(Value):
+
+    def __init__(self, column):
+        super().__init__(column, format_datetime)
+
+
+# 作者信息占位: 缓存中的卡片与评论页不含用户名与头像, 读取时由 author_store 按 user_id 填充
+# 占位为含控制字符与密钥摘要的字符串, 编码后为 "\u0000<摘要><字段><user_id>\u0000", 用户内容无法伪造
+AUTHOR_MARKER_TOKEN = hashlib.md5(('author_marker' + settings.SECRET_KEY).encode('utf-8')).hexdigest()[:12]
+AUTHOR_MARKER_PATTERN = re.compile(
+    rb'"\\u0000' + AUTHOR_MARKER_TOKEN.encode('ascii') + rb'([uni])(\d+)\\u0000"'
+)
+
+
+def author_marker(user_id, field='u'):
+    """
+    作者信息占位
+    :param user_id:
+    :param field: u 完整作者信息, n 用户名, i 头像
+    :return:
+    """
+    return '\0{}{}{}\0'.format(AUTHOR_MARKER_TOKEN, field, user_id)
+
+
+class Author(Value):
+    """
+    作者信息占位, 取 user_id 列
+    """
+
+    def __init__(self, column, field='u'):
+        super().__init__(column, lambda user_id: author_marker(user_id, field))
+
+
+class Nested:
+    """
+    由多列组成的字典, 如 user_info
+    """
+
+    def __init__(self, *fields):
+        self.fields = fields
+
+    def compile(self, index):
+        positions = [(name, index[column]) for name, column in self.fields]
+        return lambda row, related: {name: row[position] for name, position in positions}
+
+
+class Related:
+    """
+    取预先按主键分组的关联数据
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def compile(self, index):
+        name = self.name
+        position = index['id']
+        return lambda row, related: related[name].get(row[position], [])
+
+
+def group_rows(rows, to_representation):
+    """
+    按首列分组关联数据
+    :param rows:
+    :param to_representation:
+    :return:
+    """
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row[0], []).append(to_representation(row))
+    return grouped
+
+
+def fetch_article_images(article_ids):
+    return group_rows(
+        ArticleImages.objects.filter(article_id__in=article_ids).values_list('article_id', 'id', 'image'),
+        lambda row: {"id": row[1], "image": row[2]}
+    )
+
+
+def fetch_article_tags(article_ids):
+    return group_rows(
+        Tag.objects.filter(article__in=article_ids).values_list('article', 'content'),
+        lambda row: row[1]
+    )
+
+
+def fetch_top_rows(queryset, partition_by, order_by, limit):
+    """
+    每个分组只取排序后的前 limit 行, 一次窗口函数查询
+    Django 3.1 不能直接按窗口函数过滤, 因此包一层子查询
+    :param queryset: values_list 查询集, 首列为分组列
+    :param partition_by:
+    :param order_by:
+    :param limit:
+    :return: 按分组内名次排序的行, 不含名次列
+    """
+    ranked = queryset.annotate(
+        group_rank=Window(RowNumber(), partition_by=[F(partition_by)], order_by=order_by)
+    )
+    sql, params = ranked.query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(
+            'SELECT * FROM ({}) ranked WHERE ranked.group_rank <= %s ORDER BY ranked.group_rank'.format(sql),
+            params + (limit,)
+        )
+        return [row[:-1] for row in cursor.fetchall()]
+
+
+def fetch_comment_reply_templates(comment_ids):
+    """
+    回复预览, 被回复用户的用户名与头像为占位
+    :param comment_ids:
+    :return:
+    """
+    return group_rows(
+        fetch_top_rows(
+            Reply.objects.filter(comment_id__in=comment_ids).values_list('comment_id', 'to_user_id'),
+            'comment_id',
+            [F('datetime_created').desc(), F('id').desc()],
+            REPLY_PREVIEW_SIZE
+        ),
+        lambda row: {"to_user_id": author_marker(row[1], 'n'), "to_user_icon": author_marker(row[1], 'i')}
+    )
+
+
+def fetch_comment_replies(comment_ids):
+    return group_rows(
+        fetch_top_rows(
+            Reply.objects.filter(comment_id__in=comment_ids).values_list(
+                'comment_id', 'to_user__username', 'to_user__icon'
+            ),
+            'comment_id',
+            [F('datetime_created').desc(), F('id').desc()],
+            REPLY_PREVIEW_SIZE
+        ),
+        lambda row: {"to_user_id": row[1], "to_user_icon": row[2]}
+    )
+
+
+class CompiledSerializer:
+    """
+    只读序列化: 字段列表编译为作用于 values_list 行与预取字典的函数
+    输出与对应的 DRF 序列化器逐字节一致
+    """
+    model = None
+    columns = ()
+    fields = ()
+    related = {}
+
+    def __init__(self):
+        index = {column: position for position, column in enumerate(self.columns)}
+        self.pk_position = index['id']
+        self.getters = [(name, spec.compile(index)) for name, spec in self.fields]
+
+    def get_related(self, rows):
+        """
+        一次查询预取每种关联数据
+        :param rows:
+        :return:
+        """
+        pks = [row[self.pk_position] for row in rows]
+        if not pks:
+            return {name: {} for name in self.related}
+        return {name: fetch(pks) for name, fetch in self.related.items()}
+
+    def serialize_rows(self, rows):
+        related = self.get_related(rows)
+        getters = self.getters
+        return [{name: getter(row, related) for name, getter in getters} for row in rows]
+
+    def serialize_queryset(self, queryset):
+        """
+        序列化查询集, 保持查询集顺序
+        :param queryset:
+        :return:
+        """
+        return self.serialize_rows(list(queryset.values_list(*self.columns)))
+
+    def serialize_ids(self, pks):
+        """
+        按给定主键顺序序列化, 不存在的主键被跳过
+        :param pks:
+        :return:
+        """
+        rows = {
+            row[self.pk_position]: row
+            for row in self.model.objects.filter(id__in=pks).values_list(*self.columns)
+        }
+        return self.serialize_rows([rows[pk] for pk in pks if pk in rows])
+
+
+class CompiledSimpleArticleSerializer(CompiledSerializer):
+    model = Article
+    columns = ('id', 'title', 'datetime_created', 'category__category', 'content', 'datetime_update')
+    fields = (
+        ('id', Value('id')),
+        ('title', Value('title')),
+        ('attached_pictures', Related('images')),
+        ('datetime_created', DateTime('datetime_created')),
+        ('category_name', Value('category__category')),
+        ('content', Value('content')),
+        ('tags', Related('tags')),
+        ('datetime_update', DateTime('datetime_update')),
+    )
+    related = {
+        'images': fetch_article_images,
+        'tags': fetch_article_tags,
+    }
+
+
+class CompiledArticleExcerptSerializer(CompiledSerializer):
+    model = Article
+    columns = (
+        'id', 'title', 'datetime_created', 'category__category', 'excerpt', 'content_length', 'datetime_update'
+    )
+    fields = (
+        ('id', Value('id')),
+        ('title', Value('title')),
+        ('attached_pictures', Related('images')),
+        ('datetime_created', DateTime('datetime_created')),
+        ('category_name', Value('category__category')),
+        ('excerpt', Value('excerpt')),
+        ('content_length', Value('content_length')),
+        ('tags', Related('tags')),
+        ('datetime_update', DateTime('datetime_update')),
+    )
+    related = {
+        'images': fetch_article_images,
+        'tags': fetch_article_tags,
+    }
+
+
+class CompiledSimpleArticleUserSerializer(CompiledSerializer):
+    model = Article
+    columns = ('id', 'user__icon', 'user__username', 'title', 'category__category', 'datetime_created')
+    fields = (
+        ('id', Value('id')),
+        ('user_info', Nested(('icon', 'user__icon'), ('username', 'user__username'))),
+        ('title', Value('title')),
+        ('category_name', Value('category__category')),
+        ('attached_pictures', Related('images')),
+        ('datetime_created', DateTime('datetime_created')),
+        ('tags', Related('tags')),
+    )
+    related = {
+        'images': fetch_article_images,
+        'tags': fetch_article_tags,
+    }
+
+
+class CompiledArticleCardSerializer(CompiledSerializer):
+    """
+    缓存的文章卡片, 与 CompiledSimpleArticleUserSerializer 相同, user_info 为占位
+    """
+    model = Article
+    columns = ('id', 'user_id', 'title', 'category__category', 'datetime_created')
+    fields = (
+        ('id', Value('id')),
+        ('user_info', Author('user_id')),
+        ('title', Value('title')),
+        ('category_name', Value('category__category')),
+        ('attached_pictures', Related('images')),
+        ('datetime_created', DateTime('datetime_created')),
+        ('tags', Related('tags')),
+    )
+    related = {
+        'images': fetch_article_images,
+        'tags': fetch_article_tags,
+    }
+
+
+class CompiledCommentSerializer(CompiledSerializer):
+    model = Comment
+    columns = ('id', 'user_id', 'user__icon', 'user__username', 'content', 'reply_count', 'datetime_created')
+    fields = (
+        ('id', Value('id')),
+        ('user_id', Value('user_id')),
+        ('user_info', Nested(('icon', 'user__icon'), ('username', 'user__username'))),
+        ('content', Value('content')),
+        ('reply_count', Value('reply_count')),
+        ('reply', Related('replies')),
+        ('datetime_created', DateTime('datetime_created')),
+    )
+    related = {
+        'replies': fetch_comment_replies,
+    }
+
+
+class CompiledCommentThreadSerializer(CompiledSerializer):
+    """
+    缓存的评论页, 与 CompiledCommentSerializer 相同, 评论者与被回复用户信息为占位
+    """
+    model = Comment
+    columns = ('id', 'user_id', 'content', 'reply_count', 'datetime_created')
+    fields = (
+        ('id', Value('id')),
+        ('user_id', Value('user_id')),
+        ('user_info', Author('user_id')),
+        ('content', Value('content')),
+        ('reply_count', Value('reply_count')),
+        ('reply', Related('replies')),
+        ('datetime_created', DateTime('datetime_created')),
+    )
+    related = {
+        'replies': fetch_comment_reply_templates,
+    }
+
+
+class CompiledReplySerializer(CompiledSerializer):
+    model = Reply
+    columns = (
+        'id', 'user_id', 'user__icon', 'user__username', 'to_user_id', 'to_user__username', 'to_user__icon',
+        'content', 'datetime_created'
+    )
+    fields = (
+        ('user_id', Value('user_id')),
+        ('user_info', Nested(('icon', 'user__icon'), ('username', 'user__username'))),
+        ('to_user_id', Value('to_user_id')),
+        ('to_user_info', Nested(('name', 'to_user__username'), ('icon', 'to_user__icon'))),
+        ('content', Value('content')),
+        ('datetime_created', DateTime('datetime_created')),
+    )
+
+
+simple_article_serializer = CompiledSimpleArticleSerializer()
+article_excerpt_serializer = CompiledArticleExcerptSerializer()
+simple_article_user_serializer = CompiledSimpleArticleUserSerializer()
+article_card_serializer = CompiledArticleCardSerializer()
+comment_serializer = CompiledCommentSerializer()
+comment_thread_serializer = CompiledCommentThreadSerializer()
+reply_serializer = CompiledReplySerializer()
@@ -0,0 +1,119 @@
+import datetime
+import hashlib
+
+from django.utils import timezone
+from blog.cache import response_cache, comment_scope
+from blog.models import Article
+
+
+def is_safe(request):
+    return request.method in ('GET', 'HEAD')
+
+
+def make_etag(*parts):
+    """
+    由版本号等组成部分生成 ETag
+    :param parts:
+    :return:
+    """
+    return hashlib.md5('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+def from_timestamp(timestamps):
+    """
+    取多个修改时间戳中最新的一个, 均不存在时返回 None
+    :param timestamps:
+    :return:
+    """
+    timestamps = [timestamp for timestamp in timestamps if timestamp is not None]
+    if not timestamps:
+        return None
+    return datetime.datetime.fromtimestamp(max(timestamps), tz=timezone.utc)
+
+
+def get_scope_info(request, *scopes):
+    """
+    读取范围版本信息, 同一请求内 ETag 与 Last-Modified 共用一次读取
+    :param request:
+    :param scopes:
+    :return:
+    """
+    cache = request.__dict__.setdefault('_conditional_scope_info', {})
+    if scopes not in cache:
+        cache[scopes] = response_cache.get_version_info(*scopes)
+    return cache[scopes]
+
+
+def feed_etag(request, *args, **kwargs):
+    if not is_safe(request):
+        return None
+    (version, _), = get_scope_info(request, 'feed')
+    return make_etag('feed', version, request.build_absolute_uri())
+
+
+def feed_last_modified(request, *args, **kwargs):
+    if not is_safe(request):
+        return None
+    return from_timestamp(modified for _, modified in get_scope_info(request, 'feed'))
+
+
+def get_article_updated(request):
+    """
+    查询文章最后修改时间, 文章不存在或参数错误时返回 None
+    :param request:
+    :return:
+    """
+    if '_conditional_article_updated' not in request.__dict__:
+        try:
+            article_id = int(request.GET['id'])
+        except (KeyError, ValueError):
+            updated = None
+        else:
+            updated = Article.objects.filter(
+                id=article_id, publish_status=False
+            ).values_list(
+                'datetime_update', flat=True
+            ).first()
+        request.__dict__['_conditional_article_updated'] = updated
+    return request.__dict__['_conditional_article_updated']
+
+
+def article_etag(request, *args, **kwargs):
+    if not is_safe(request):
+        return None
+    updated = get_article_updated(request)
+    if updated is None:
+        return None
+    return make_etag('article', request.GET['id'], updated.timestamp())
+
+
+def article_last_modified(request, *args, **kwargs):
+    if not is_safe(request):
+        return None
+    updated = get_article_updated(request)
+    if updated is None:
+        return None
+    return timezone.make_aware(updated) if timezone.is_naive(updated) else updated
+
+
+def get_comment_scopes(request):
+    try:
+        article_id = int(request.GET['id'])
+    except (KeyError, ValueError):
+        return None
+    return comment_scope(article_id), 'author'
+
+
+def comment_etag(request, *args, **kwargs):
+    scopes = get_comment_scopes(request)
+    if not is_safe(request) or scopes is None:
+        return None
+    versions = [version for version, _ in get_scope_info(request, *scopes)]
+    return make_etag('comment', *versions, request.build_absolute_uri())
+
+
+def comment_last_modified(request, *args, **kwargs):
+    scopes = get_comment_scopes(request)
+    if not is_safe(request) or scopes is None:
+        return None
+    return from_timestamp(modified for _, modified in get_scope_info(request, *scopes))
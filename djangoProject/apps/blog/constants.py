@@ -6,7 +6,107 @@ LIMIT_INFO = {
     "comment_limit": (10 * 60, 150)
 }
 REDIS_KEY = {
-    "limit_key": 'limit_{}_{}'
+    "limit_key": 'limit_{}_{}',
+    "count_key": 'count_{}',
+    "approximate_count_key": 'approximate_count_{}',
+    "response_key": 'response_{}_{}_{}',
+    "response_version_key": 'response_version_{}',
+    "response_modified_key": 'response_modified_{}',
+    "article_card_key": 'article_card_{}_{}',
+    "article_card_generation_key": 'article_card_generation_{}',
+    "author_key": 'author_{}',
+    "author_name_key": 'author_name_{}',
+    "comment_thread_key": 'comment_thread_{}',
+    "comment_thread_version_key": 'comment_thread_version_{}',
+    "comment_thread_metrics_key": 'comment_thread_metrics_{}',
+    "search_index_queue_key": 'search_index_queue_{}',
+    "search_index_lock_key": 'search_index_lock_{}',
+    "search_index_metrics_key": 'search_index_metrics_{}',
+    "search_index_rebuild_key": 'search_index_rebuild_{}',
+    "search_index_rebuild_written_key": 'search_index_rebuild_written_{}',
+    "search_cache_metrics_key": 'search_cache_metrics',
+    "search_author_task_key": 'search_author_task_{}',
+    "suggest_key": 'suggest_{}',
 }
 
+# 旧版固定索引名, 首次部署时读别名指向它
 ARTICLE_INDEX = "article8"
+# 搜索读写均通过别名, 重建时创建带版本号的新索引后原子切换
+ARTICLE_INDEX_ALIAS = "article_search"
+ARTICLE_INDEX_PREFIX = "article_v"
+
+# 分页计数: 精确计数按模型维护的过滤字段组合(字段名按字母序), 由信号增减
+COUNT_SIGNATURES = {
+    'blog.article': ((), ('publish_status',), ('user_id',)),
+    'blog.comment': (('article_id',),),
+}
+# 精确计数最长存活时间, 限制绕过信号的批量写入造成的偏差
+COUNT_CACHE_TIMEOUT = 60 * 60
+# 无计数器时的估算值存活时间及启用估算的行数下限
+APPROXIMATE_COUNT_TIMEOUT = 60
+APPROXIMATE_COUNT_THRESHOLD = 10000
+
+# 公开文章接口响应缓存时间, 以及重建锁的持有时间(毫秒)与等待轮询间隔(秒)
+RESPONSE_CACHE_TIMEOUT = 5 * 60
+RESPONSE_CACHE_LOCK_TIMEOUT = 3000
+RESPONSE_CACHE_LOCK_WAIT = 0.05
+
+# 文章卡片缓存: 卡片字段或格式变化时递增版本号
+ARTICLE_CARD_VERSION = 2
+ARTICLE_CARD_TIMEOUT = 24 * 60 * 60
+# 索引文档中的卡片不含作者信息, 查询时按 user_id 补全; 版本不一致的文档回退到卡片缓存
+SEARCH_CARD_VERSION = 2
+# 作者信息与作者名 -> user_id 缓存时间, 以及由搜索词匹配作者名时最多尝试的候选词数
+AUTHOR_TIMEOUT = 24 * 60 * 60
+AUTHOR_LOOKUP_MAX = 5
+
+# 评论列表缓存: 每篇文章缓存的页数与过期时间(秒), 生成序号的过期时间需长于缓存
+COMMENT_THREAD_PAGES = 3
+COMMENT_THREAD_TIMEOUT = 10 * 60
+COMMENT_THREAD_VERSION_TIMEOUT = 24 * 60 * 60
+# 命中率统计: 按比例抽样记录, 按天分键, 保留天数
+COMMENT_THREAD_METRICS_SAMPLE = 0.05
+COMMENT_THREAD_METRICS_DAYS = 7
+
+# 评论列表中每条评论预览的最新回复数, 完整回复由 replies 接口游标分页获取
+REPLY_PREVIEW_SIZE = 3
+
+# 文章摘要长度, 列表接口返回摘要而非正文
+ARTICLE_EXCERPT_LENGTH = 120
+
+# 批量获取文章时单次请求的最大 id 数
+ARTICLE_BATCH_MAX = 50
+
+# 搜索索引: 待索引文章 id 暂存于有序集合, 按间隔(秒)批量写入, 同一窗口内的多次修改只索引一次
+SEARCH_INDEX_DRAIN_INTERVAL = 2.0
+SEARCH_INDEX_BATCH_SIZE = 500
+SEARCH_INDEX_LOCK_TIMEOUT = 60
+
+# 改名后在后台将旧版文档的作者名替换为 user_id: es 切片数与每秒请求数(集群有压力时减半, 不低于下限),
+# 任务状态轮询间隔及退避上限(秒), 进度保留时间
+SEARCH_AUTHOR_SLICES = 'auto'
+SEARCH_AUTHOR_RPS = 500
+SEARCH_AUTHOR_MIN_RPS = 50
+SEARCH_AUTHOR_POLL_INTERVAL = 5
+SEARCH_AUTHOR_MAX_POLL_INTERVAL = 60
+SEARCH_AUTHOR_PROGRESS_TIMEOUT = 24 * 60 * 60
+
+# 搜索结果缓存时间, 索引写入后递增搜索版本号使其失效
+SEARCH_CACHE_TIMEOUT = 60
+
+# 搜索提示: 前缀最大长度与返回条数, 进程内缓存条数与时间, Redis 缓存时间
+SUGGEST_MAX_PREFIX = 20
+SUGGEST_SIZE = 8
+SUGGEST_LRU_SIZE = 2048
+SUGGEST_LOCAL_TIMEOUT = 30
+SUGGEST_CACHE_TIMEOUT = 5 * 60
+
+# 事务发件箱: 投递间隔(秒)与每批条数, 已投递未消费的消息超时(秒)后重新投递, 已消费消息保留天数
+OUTBOX_RELAY_INTERVAL = 1.0
+OUTBOX_RELAY_BATCH_SIZE = 200
+OUTBOX_REDELIVER_AFTER = 10 * 60
+OUTBOX_RETENTION_DAYS = 7
+# 最大投递次数, 超过后标记失败不再投递, 由 outbox_status --retry 人工重试
+OUTBOX_MAX_ATTEMPTS = 5
+# 延迟统计的时间窗口(秒)
+OUTBOX_METRICS_WINDOW = 60 * 60
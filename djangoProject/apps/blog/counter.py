@@ -0,0 +1,213 @@
+import hashlib
+
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.db.models import Model, QuerySet
+from django.db.models.expressions import Col
+from django.db.models.lookups import Exact
+from django.db.models.sql.where import AND
+from django.utils.functional import cached_property
+from blog.clients import LazyClient, LazyScript
+from blog.constants import REDIS_KEY, COUNT_SIGNATURES, COUNT_CACHE_TIMEOUT, APPROXIMATE_COUNT_TIMEOUT, \
+    APPROXIMATE_COUNT_THRESHOLD
+
+
+class CountCache:
+    """
+    分页总数缓存
+    已登记过滤字段组合的查询: Redis 中保存精确计数, 由 post_save/pre_delete 信号增减
+    其它查询: 使用 EXPLAIN 估算行数, 短时间缓存
+    """
+    # 计数器不存在时不创建, 避免从 0 开始累加出错误的值
+    INCR_SCRIPT = """
+    if redis.call('hexists', KEYS[1], ARGV[1]) == 1 then
+        return redis.call('hincrby', KEYS[1], ARGV[1], ARGV[2])
+    end
+    return nil
+    """
+    SET_SCRIPT = """
+    redis.call('hset', KEYS[1], ARGV[1], ARGV[2])
+    if redis.call('ttl', KEYS[1]) < 0 then
+        redis.call('expire', KEYS[1], ARGV[3])
+    end
+    return 1
+    """
+    redis = LazyClient('redis')
+    incr_script = LazyScript('redis', INCR_SCRIPT)
+    set_script = LazyScript('redis', SET_SCRIPT)
+
+    @staticmethod
+    def format_signature(conditions):
+        """
+        过滤条件转换为计数器字段名
+        :param conditions: [(字段, 值), ...]
+        :return:
+        """
+        if not conditions:
+            return 'all'
+        return '&'.join('{}={}'.format(field, value) for field, value in conditions)
+
+    @staticmethod
+    def get_signature(queryset):
+        """
+        解析查询集的过滤条件, 仅支持基表字段的等值 AND 条件
+        :param queryset:
+        :return: (模型标识, 计数器字段名) 或 None
+        """
+        query = queryset.query
+        model = queryset.model
+        where = query.where
+        if query.is_sliced or query.distinct or query.combinator or where.negated:
+            return None
+        if len(where.children) > 1 and where.connector != AND:
+            return None
+
+        conditions = {}
+        for child in where.children:
+            if not isinstance(child, Exact) or not isinstance(child.lhs, Col):
+                return None
+            if child.lhs.alias != query.base_table:
+                return None
+            value = child.rhs
+            if isinstance(value, Model):
+                value = value.pk
+            if hasattr(value, 'resolve_expression'):
+                return None
+            conditions[child.lhs.target.attname] = value
+
+        label = model._meta.label_lower
+        fields = tuple(sorted(conditions))
+        if fields not in COUNT_SIGNATURES.get(label, ()):
+            return None
+        return label, CountCache.format_signature([(field, conditions[field]) for field in fields])
+
+    @staticmethod
+    def get_instance_signature(instance, fields):
+        """
+        计算实例所属的计数器字段名
+        :param instance:
+        :param fields:
+        :return:
+        """
+        opts = instance._meta
+        return CountCache.format_signature([
+            (field, opts.get_field(field).get_prep_value(getattr(instance, field)))
+            for field in fields
+        ])
+
+    @staticmethod
+    def signature_fields(model):
+        """
+        模型参与计数的字段名集合
+        :param model:
+        :return:
+        """
+        fields = set()
+        for signature in COUNT_SIGNATURES.get(model._meta.label_lower, ()):
+            fields.update(signature)
+        return fields
+
+    @staticmethod
+    def estimate(queryset):
+        """
+        通过 EXPLAIN 估算行数, 仅 MySQL 可用
+        :param queryset:
+        :return:
+        """
+        connection = connections[queryset.db]
+        if connection.vendor != 'mysql':
+            return None
+        sql, params = queryset.order_by().values('pk').query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN ' + sql, params)
+            columns = [column[0] for column in cursor.description]
+            row = cursor.fetchone()
+        if row is None or row[columns.index('rows')] is None:
+            return None
+        filtered = row[columns.index('filtered')] if 'filtered' in columns else 100
+        return int(row[columns.index('rows')] * float(filtered or 100) / 100)
+
+    def approximate_count(self, queryset):
+        """
+        无计数器的查询: 行数较少时精确计数, 否则返回估算值
+        :param queryset:
+        :return:
+        """
+        sql, params = queryset.query.sql_with_params()
+        digest = hashlib.md5('{}{}'.format(sql, params).encode('utf-8')).hexdigest()
+        key = REDIS_KEY['approximate_count_key'].format(digest)
+        cached = self.redis.get(key)
+        if cached is not None:
+            return int(cached)
+
+        count = self.estimate(queryset)
+        if count is None or count < APPROXIMATE_COUNT_THRESHOLD:
+            count = queryset.count()
+        self.redis.set(key, count, ex=APPROXIMATE_COUNT_TIMEOUT)
+        return count
+
+    def count(self, queryset):
+        """
+        获得查询集总数
+        :param queryset:
+        :return:
+        """
+        signature = self.get_signature(queryset)
+        if signature is None:
+            return self.approximate_count(queryset)
+
+        label, field = signature
+        key = REDIS_KEY['count_key'].format(label)
+        cached = self.redis.hget(key, field)
+        if cached is not None:
+            return int(cached)
+
+        count = queryset.count()
+        self.set_script(keys=[key], args=[field, count, COUNT_CACHE_TIMEOUT])
+        return count
+
+    def incr_instance(self, instance, amount):
+        """
+        实例新增或删除时调整所属计数器
+        计数器字段立即计算, 提交后再调整, 回滚时不调整
+        :param instance:
+        :param amount:
+        :return:
+        """
+        label = instance._meta.label_lower
+        key = REDIS_KEY['count_key'].format(label)
+        signatures = [self.get_instance_signature(instance, fields) for fields in COUNT_SIGNATURES.get(label, ())]
+
+        def incr():
+            pipe = self.redis.pipeline()
+            for signature in signatures:
+                self.incr_script(keys=[key], args=[signature, amount], client=pipe)
+            pipe.execute()
+
+        transaction.on_commit(incr)
+
+    def invalidate(self, model):
+        """
+        实例可能跨计数器移动时清空该模型全部计数器, 提交后执行
+        提交前清空会被并发请求按未提交前的数据重新写入
+        :param model:
+        :return:
+        """
+        key = REDIS_KEY['count_key'].format(model._meta.label_lower)
+        transaction.on_commit(lambda: self.redis.delete(key))
+
+
+count_cache = CountCache()
+
+
+class CachedCountPaginator(Paginator):
+
+    @cached_property
+    def count(self):
+        """
+        查询集总数改由计数缓存提供
+        :return:
+        """
+        if isinstance(self.object_list, QuerySet):
+            return count_cache.count(self.object_list)
+        return super().count
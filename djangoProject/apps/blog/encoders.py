@@ -0,0 +1,140 @@
+import datetime
+import decimal
+import json
+import uuid
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from blog.errcode import ErrCode
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class RawJSON:
+    """
+    已编码的 JSON 片段, 编码响应时原样拼接
+    """
+    __slots__ = ('content',)
+
+    def __init__(self, content):
+        self.content = content
+
+
+class BaseEncoder:
+    """
+    响应编码器, encode 返回 UTF-8 字节
+    """
+
+    def encode(self, data):
+        raise NotImplementedError
+
+
+class StandardEncoder(BaseEncoder):
+    """
+    标准库 json 编码, 使用紧凑分隔符, 输出与 OrjsonEncoder 逐字节一致
+    切换编码器不会改变响应内容, 已缓存的响应与 ETag 无需清理
+    """
+    separators = (',', ':')
+
+    def encode(self, data):
+        fragments = {}
+
+        def default(obj):
+            if isinstance(obj, RawJSON):
+                placeholder = '\0' + uuid.uuid4().hex
+                fragments[json.dumps(placeholder).encode('utf-8')] = obj.content
+                return placeholder
+            if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+                return obj.isoformat()
+            if isinstance(obj, decimal.Decimal):
+                return float(obj)
+            raise TypeError('Object of type {} is not JSON serializable'.format(obj.__class__.__name__))
+
+        content = json.dumps(data, ensure_ascii=False, separators=self.separators, default=default).encode('utf-8')
+        for placeholder, fragment in fragments.items():
+            content = content.replace(placeholder, fragment, 1)
+        return content
+
+
+class OrjsonEncoder(BaseEncoder):
+    """
+    orjson 编码, 直接输出字节, 原生处理 datetime
+    """
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError("OrjsonEncoder requires orjson")
+        self.option = orjson.OPT_NON_STR_KEYS
+        self.fragment = getattr(orjson, 'Fragment', None)
+
+    def default(self, obj):
+        if isinstance(obj, RawJSON):
+            if self.fragment is not None:
+                return self.fragment(obj.content)
+            return orjson.loads(obj.content)
+        if isinstance(obj, decimal.Decimal):
+            return float(obj)
+        raise TypeError('Object of type {} is not JSON serializable'.format(obj.__class__.__name__))
+
+    def encode(self, data):
+        return orjson.dumps(data, default=self.default, option=self.option)
+
+
+def get_default_encoder_path():
+    if orjson is not None:
+        return 'blog.encoders.OrjsonEncoder'
+    return 'blog.encoders.StandardEncoder'
+
+
+class EncoderProxy:
+    """
+    按 settings.JSON_RESPONSE_ENCODER 延迟加载编码器
+    """
+
+    def __init__(self):
+        self._encoder = None
+
+    @property
+    def encoder(self):
+        if self._encoder is None:
+            path = getattr(settings, 'JSON_RESPONSE_ENCODER', None) or get_default_encoder_path()
+            self._encoder = import_string(path)()
+        return self._encoder
+
+    def encode(self, data):
+        return self.encoder.encode(data)
+
+
+response_encoder = EncoderProxy()
+
+
+class StaticResponses:
+    """
+    不带数据的错误码响应只编码一次
+    """
+
+    def __init__(self):
+        self.encoded = {}
+
+    def get(self, err_code):
+        content = self.encoded.get(err_code)
+        if content is None:
+            content = self.encoded[err_code] = response_encoder.encode(err_code.with_data())
+        return content
+
+
+static_responses = StaticResponses()
+
+
+def encode_response(data):
+    """
+    编码响应数据
+    :param data:
+    :return:
+    """
+    if isinstance(data, ErrCode):
+        return static_responses.get(data)
+    return response_encoder.encode(data)
@@ -1,119 +1,70 @@
+from collections import namedtuple
+
+
+class ErrCode(namedtuple('ErrCode', ['err_code', 'detail'])):
+    """
+    错误码模板, 不可变
+    每次响应通过 with_data 生成新的响应体, 避免并发请求共享可变字典
+    """
+    __slots__ = ()
+
+    def with_data(self, data=None):
+        """
+        生成本次请求的响应体
+        :param data:
+        :return:
+        """
+        return {
+            "err_code": self.err_code,
+            "data": {} if data is None else data,
+            "detail": self.detail
+        }
+
+
 #####################################
-SUCCESS = {
-    "err_code": 0,
-    "data": {},
-    "detail": " SUCCESS "
-}
-
-PARAM_ERROR = {
-    "err_code": -1,
-    "data": {},
-    "detail": " PARAM ERROR "
-}
-
-ABNORMAL_BEHAVIOR = {
-    "err_code": -2,
-    "data": {},
-    "detail": " WARNING ! ABNORMAL BEHAVIOR !"
-}
-
-AUTH_FAIL = {
-    "err_code": -3,
-    "data": {},
-    "detail": " auth fail "
-}
-
-NO_PERMISSION = {
-    "err_code": -4,
-    "data": {},
-    "detail": " no permission"
-}
-
-NO_METHOD = {
-    "err_code": -5,
-    "data": {},
-    "detail": "no method"
-}
-
-UNKNOWN_ERROR = {
-    "err_code": -6,
-    "data": {},
-    "detail": " unknown error"
-}
-
-NOT_FOUND = {
-    "err_code": -7,
-    "data": {},
-    "detail": " not found"
-}
+SUCCESS = ErrCode(0, " SUCCESS ")
+
+PARAM_ERROR = ErrCode(-1, " PARAM ERROR ")
+
+ABNORMAL_BEHAVIOR = ErrCode(-2, " WARNING ! ABNORMAL BEHAVIOR !")
+
+AUTH_FAIL = ErrCode(-3, " auth fail ")
+
+NO_PERMISSION = ErrCode(-4, " no permission")
+
+NO_METHOD = ErrCode(-5, "no method")
+
+UNKNOWN_ERROR = ErrCode(-6, " unknown error")
+
+NOT_FOUND = ErrCode(-7, " not found")
 
 # 用户相关
-LOG_SUCCESS = {
-    "err_code": 1001,
-    "data": {},
-    "detail": "log in success"
-}
-
-LOG_FAIL = {
-    "err_code": 1002,
-    "data": {},
-    "detail": "log in fail"
-}
-
-EXISTED_USER_NAME = {
-    "err_code": 1003,
-    "data": {},
-    "detail": " existed name or phone "
-}
-
-USER_INFO = {
-    "err_code": 1004,
-    "data": {},
-    "detail": " user info "
-}
-
-EMAIL_FORMAT_ERROR = {
-    "err_code": 1005,
-    "data": {},
-    "detail": " err email "
-}
-
-TOKEN = {
-    "err_code": 1006,
-    "data": {},
-    "detail": " token info "
-}
-
-WEB_SOCKET_TOKEN = {
-    "err_code": 1007,
-    "data": {},
-    "detail": " web socket token"
-}
-
-
-USER_ACTIVITY = {
-    "err_code": 1008,
-    "data": {},
-    "detail": " user activity "
-}
-
-
-MUST_LOG_IN = {
-    "err_code": 1009,
-    "data": {},
-    "detail": " user activity "
-}
+LOG_SUCCESS = ErrCode(1001, "log in success")
+
+LOG_FAIL = ErrCode(1002, "log in fail")
+
+EXISTED_USER_NAME = ErrCode(1003, " existed name or phone ")
+
+USER_INFO = ErrCode(1004, " user info ")
+
+EMAIL_FORMAT_ERROR = ErrCode(1005, " err email ")
+
+TOKEN = ErrCode(1006, " token info ")
+
+WEB_SOCKET_TOKEN = ErrCode(1007, " web socket token")
+
+
+USER_ACTIVITY = ErrCode(1008, " user activity ")
+
+
+MUST_LOG_IN = ErrCode(1009, " user activity ")
 
 # 文章相关
 
-ARTICLE_INFO = {
-    "err_code": 2001,
-    "data": {},
-    "detail": " article info "
-}
-
-COMMENT_INFO = {
-    "err_code": 2002,
-    "data": {},
-    "detail": " comment info "
-}
+ARTICLE_INFO = ErrCode(2001, " article info ")
+
+COMMENT_INFO = ErrCode(2002, " comment info ")
+
+ARTICLE_SUGGEST = ErrCode(2003, " article suggest ")
+
+REPLY_INFO = ErrCode(2004, " reply info ")
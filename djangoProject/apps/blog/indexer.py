@@ -0,0 +1,302 @@
+import time
+
+from blog.clients import LazyClient
+from blog.compiled_serializers import simple_article_user_serializer
+from blog.constants import REDIS_KEY, SEARCH_INDEX_BATCH_SIZE, SEARCH_INDEX_LOCK_TIMEOUT, SEARCH_CARD_VERSION, \
+    SEARCH_AUTHOR_PROGRESS_TIMEOUT
+from blog.models import Article
+from blog.search import search_backend, SearchBackendError
+from blog.utils import logger
+
+
+class SearchIndexQueue:
+    """
+    搜索索引队列: 文章变化时只记录 id, 由定时任务批量取出后批量写入搜索后端
+    有序集合以首次入队时间为分值, 窗口内同一文章的多次修改合并为一次索引
+    """
+    redis = LazyClient('redis')
+
+    def __init__(self, name='article', batch_size=SEARCH_INDEX_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.queue_key = REDIS_KEY['search_index_queue_key'].format(name)
+        self.lock_key = REDIS_KEY['search_index_lock_key'].format(name)
+        self.metrics_key = REDIS_KEY['search_index_metrics_key'].format(name)
+        self.rebuild_key = REDIS_KEY['search_index_rebuild_key'].format(name)
+        self.rebuild_written_key = REDIS_KEY['search_index_rebuild_written_key'].format(name)
+
+    def push(self, *article_ids):
+        """
+        文章 id 入队, 已在队列中的保留原入队时间
+        :param article_ids:
+        :return:
+        """
+        if article_ids:
+            now = time.time()
+            self.redis.zadd(self.queue_key, {article_id: now for article_id in article_ids}, nx=True)
+
+    def pop(self, count):
+        """
+        取出最早入队的一批文章
+        :param count:
+        :return: [(文章id, 入队时间), ...]
+        """
+        return [(int(article_id), score) for article_id, score in self.redis.zpopmin(self.queue_key, count)]
+
+    def requeue(self, items):
+        """
+        写入失败的文章按原入队时间放回队列
+        :param items:
+        :return:
+        """
+        if items:
+            self.redis.zadd(self.queue_key, {article_id: score for article_id, score in items}, nx=True)
+
+    @staticmethod
+    def build_sources(articles):
+        """
+        生成一批文章的索引文档, 文档中附带列表卡片, 搜索时无需回查数据库
+        作者只保存 user_id, 卡片中的作者信息在查询时补全, 改名不需要重新索引
+        :param articles:
+        :return: [(文章id, 文档), ...]
+        """
+        cards = {}
+        for card in simple_article_user_serializer.serialize_ids([article.id for article in articles]):
+            card.pop('user_info')
+            cards[card['id']] = card
+        sources = []
+        for article in articles:
+            source = {
+                "search_word": article.content + article.title,
+                "user_id": article.user_id,
+                "datetime_created": article.datetime_created,
+                "publish_status": article.publish_status,
+                "article_id": article.id,
+                "card": cards.get(article.id),
+                "card_version": SEARCH_CARD_VERSION,
+            }
+            # 只有已发布文章提供搜索提示, 作者名提示查询时由数据库提供
+            if article.publish_status:
+                source["suggest"] = {"input": [article.title]}
+            sources.append((article.id, source))
+        return sources
+
+    def start_rebuild(self, index):
+        """
+        重建期间同时写入新索引
+        :param index:
+        :return:
+        """
+        self.redis.delete(self.rebuild_written_key)
+        self.redis.set(self.rebuild_key, index)
+
+    def finish_rebuild(self):
+        self.redis.delete(self.rebuild_key, self.rebuild_written_key)
+
+    def replay_rebuild(self):
+        """
+        重建期间由队列双写过的文章重新入队
+        全量写入读取较早, 可能覆盖双写的新文档, 全量写入结束后再写一次最新数据
+        :return: 重新入队的文章数
+        """
+        article_ids = [int(article_id) for article_id in self.redis.smembers(self.rebuild_written_key)]
+        self.push(*article_ids)
+        return len(article_ids)
+
+    def get_extra_indices(self):
+        """
+        获得重建中需要同时写入的新索引
+        :return:
+        """
+        rebuild_index = self.redis.get(self.rebuild_key)
+        return () if rebuild_index is None else (rebuild_index,)
+
+    def build_documents(self, article_ids):
+        """
+        生成一批文章的文档, 已不存在的文章为 None, 由后端删除
+        :param article_ids:
+        :return:
+        """
+        articles = Article.objects.filter(
+            id__in=article_ids
+        ).only(
+            'id', 'title', 'content', 'datetime_created', 'publish_status', 'user_id'
+        ).in_bulk()
+        sources = dict(self.build_sources(list(articles.values())))
+        return {article_id: sources.get(article_id) for article_id in article_ids}
+
+    def drain(self, backend=None, max_batches=None):
+        """
+        分批取出队列并写入, 同一时间只有一个进程执行
+        :param backend: 默认使用配置的搜索后端
+        :param max_batches: 最多处理的批次数, 默认直到队列为空
+        :return: 本次写入的文章数
+        """
+        if not self.redis.set(self.lock_key, 1, nx=True, ex=SEARCH_INDEX_LOCK_TIMEOUT):
+            return 0
+        backend = backend or search_backend
+        indexed = 0
+        batches = 0
+        try:
+            while max_batches is None or batches < max_batches:
+                items = self.pop(self.batch_size)
+                if not items:
+                    break
+                batches += 1
+                indexed += self.write_batch(backend, items)
+                self.redis.expire(self.lock_key, SEARCH_INDEX_LOCK_TIMEOUT)
+        finally:
+            self.redis.delete(self.lock_key)
+        return indexed
+
+    def write_batch(self, backend, items):
+        """
+        写入一批文章并记录指标, 失败的文章放回队列
+        :param backend:
+        :param items:
+        :return: 写入成功的文章数
+        """
+        start = time.perf_counter()
+        article_ids = [article_id for article_id, _ in items]
+        extra_indices = self.get_extra_indices()
+        if extra_indices:
+            self.redis.sadd(self.rebuild_written_key, *article_ids)
+        try:
+            failed = backend.write_documents(self.build_documents(article_ids), extra_indices)
+        except SearchBackendError as e:
+            logger.error("搜索索引批量写入失败: {}".format(e))
+            self.requeue(items)
+            self.record(0, len(items), time.perf_counter() - start)
+            return 0
+        except Exception:
+            # 生成文档或未包装的连接错误: 整批已从队列取出, 放回后继续抛出
+            logger.exception("搜索索引批量写入异常, 已放回队列")
+            self.requeue(items)
+            self.record(0, len(items), time.perf_counter() - start)
+            raise
+
+        if failed:
+            logger.error("搜索索引部分写入失败: {}".format(sorted(failed)[:20]))
+            self.requeue([(article_id, score) for article_id, score in items if article_id in failed])
+        self.record(len(items) - len(failed), len(failed), time.perf_counter() - start)
+        return len(items) - len(failed)
+
+    def record(self, indexed, failed, cost):
+        """
+        累计写入指标
+        :param indexed:
+        :param failed:
+        :param cost: 本批耗时(秒)
+        :return:
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hincrby(self.metrics_key, 'indexed', indexed)
+        pipe.hincrby(self.metrics_key, 'failed', failed)
+        pipe.hincrby(self.metrics_key, 'batches', 1)
+        pipe.hincrbyfloat(self.metrics_key, 'seconds', cost)
+        pipe.hset(self.metrics_key, mapping={
+            'last_batch_size': indexed + failed,
+            'last_batch_seconds': cost,
+            'last_drain_at': time.time(),
+        })
+        pipe.execute()
+
+    def clear(self):
+        """
+        清空队列与指标
+        :return:
+        """
+        self.redis.delete(self.queue_key, self.lock_key, self.metrics_key)
+
+    def get_metrics(self):
+        """
+        获得吞吐与积压指标
+        :return:
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hgetall(self.metrics_key)
+        pipe.zcard(self.queue_key)
+        pipe.zrange(self.queue_key, 0, 0, withscores=True)
+        metrics, backlog, oldest = pipe.execute()
+        indexed = int(metrics.get('indexed', 0))
+        seconds = float(metrics.get('seconds', 0))
+        last_size = int(metrics.get('last_batch_size', 0))
+        last_seconds = float(metrics.get('last_batch_seconds', 0))
+        return {
+            "indexed": indexed,
+            "failed": int(metrics.get('failed', 0)),
+            "batches": int(metrics.get('batches', 0)),
+            "throughput": indexed / seconds if seconds else 0,
+            "last_batch_throughput": last_size / last_seconds if last_seconds else 0,
+            "last_drain_at": float(metrics['last_drain_at']) if 'last_drain_at' in metrics else None,
+            "backlog": backlog,
+            "oldest_age": time.time() - oldest[0][1] if oldest else 0,
+        }
+
+
+search_index_queue = SearchIndexQueue()
+
+
+class AuthorUpdateProgress:
+    """
+    改名后台任务进度: 每个作者一个哈希, 记录 es 任务 id、限速与各项计数
+    """
+    redis = LazyClient('redis')
+
+    @staticmethod
+    def get_key(user_id):
+        return REDIS_KEY['search_author_task_key'].format(user_id)
+
+    def start(self, user_id, task_id, old_author, requests_per_second):
+        """
+        记录新启动的任务, 覆盖该作者之前的进度
+        :param user_id:
+        :param task_id:
+        :param old_author:
+        :param requests_per_second:
+        :return:
+        """
+        key = self.get_key(user_id)
+        now = time.time()
+        pipe = self.redis.pipeline()
+        pipe.delete(key)
+        pipe.hset(key, mapping={
+            'task_id': task_id,
+            'old_author': old_author,
+            'status': 'running',
+            'rps': requests_per_second,
+            'started_at': now,
+            'updated_at': now,
+        })
+        pipe.expire(key, SEARCH_AUTHOR_PROGRESS_TIMEOUT)
+        pipe.execute()
+
+    def update(self, user_id, **fields):
+        """
+        更新进度
+        :param user_id:
+        :param fields:
+        :return:
+        """
+        key = self.get_key(user_id)
+        fields['updated_at'] = time.time()
+        pipe = self.redis.pipeline()
+        pipe.hset(key, mapping={name: '' if value is None else value for name, value in fields.items()})
+        pipe.expire(key, SEARCH_AUTHOR_PROGRESS_TIMEOUT)
+        pipe.execute()
+
+    def get(self, user_id):
+        return self.redis.hgetall(self.get_key(user_id))
+
+    def get_all(self):
+        """
+        获得全部未过期的进度
+        :return: [(用户id, 进度), ...]
+        """
+        prefix = self.get_key('')
+        return sorted(
+            (int(key[len(prefix):]), self.redis.hgetall(key))
+            for key in self.redis.scan_iter(match=prefix + '*', count=500)
+        )
+
+
+author_update_progress = AuthorUpdateProgress()
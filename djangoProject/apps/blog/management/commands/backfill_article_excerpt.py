@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from blog.models import Article
+
+
+class Command(BaseCommand):
+    help = "按 id 分批回填文章摘要与正文长度"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--all', action='store_true', help="重新计算全部文章, 默认只处理正文长度为 0 的文章")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = Article.objects.only('id', 'content').order_by('id')
+        if not options['all']:
+            queryset = queryset.filter(content_length=0)
+
+        last_id = 0
+        updated = 0
+        while True:
+            batch = list(queryset.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            for article in batch:
+                article.set_excerpt()
+            # bulk_update 不触发信号, 不会产生搜索索引任务
+            Article.objects.bulk_update(batch, ['excerpt', 'content_length'])
+            last_id = batch[-1].id
+            updated += len(batch)
+            self.stdout.write("updated {} (last id {})".format(updated, last_id))
@@ -0,0 +1,96 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from blog.models import Article, User
+from blog.serializers import SimpleArticleUserSerializer
+from blog.utils import TenPagination
+
+
+class Command(BaseCommand):
+    help = "对比公开文章列表页码分页与游标分页在不同深度的耗时"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', nargs='+', type=int, default=[1, 1000, 10000])
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help="在事务内临时生成的文章数, 结束后回滚"
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['seed']:
+                self.seed(options['seed'])
+            self.run(options['pages'], options['repeat'])
+            if options['seed']:
+                transaction.set_rollback(True)
+
+    @staticmethod
+    def seed(amount):
+        """
+        批量生成测试文章
+        :param amount:
+        :return:
+        """
+        user = User.objects.only('id').first()
+        if user is None:
+            raise CommandError("至少需要一个用户")
+        Article.objects.bulk_create(
+            (Article(user_id=user.id, title='bench {}'.format(i), content='bench', publish_status=True)
+             for i in range(amount)),
+            batch_size=2000
+        )
+
+    @staticmethod
+    def get_queryset():
+        return SimpleArticleUserSerializer.get_instance().filter(
+            publish_status=True
+        ).order_by(
+            '-datetime_created'
+        )
+
+    def timed(self, params, repeat):
+        """
+        按参数构造请求并计时, 返回中位数毫秒
+        :param params:
+        :param repeat:
+        :return:
+        """
+        factory = APIRequestFactory()
+        costs = []
+        for _ in range(repeat):
+            request = Request(factory.get('/api/article/all_article_info/', params))
+            paginator = TenPagination()
+            start = time.perf_counter()
+            page_list = paginator.paginate_queryset(self.get_queryset(), request)
+            SimpleArticleUserSerializer(instance=page_list, many=True).data
+            costs.append((time.perf_counter() - start) * 1000)
+        return statistics.median(costs)
+
+    def run(self, pages, repeat):
+        page_size = TenPagination.page_size
+        total = self.get_queryset().count()
+        self.stdout.write("published articles: {}".format(total))
+        self.stdout.write("{:>8} {:>14} {:>14}".format("page", "offset(ms)", "cursor(ms)"))
+        for page in pages:
+            offset = (page - 1) * page_size
+            if offset >= total:
+                self.stdout.write("{:>8} {:>14} {:>14}".format(page, "-", "-"))
+                continue
+
+            offset_cost = self.timed({'page': page}, repeat)
+            if offset:
+                # 游标取上一页最后一行, 与客户端逐页翻到此处得到的游标一致
+                boundary = Article.objects.filter(publish_status=True).order_by(
+                    '-datetime_created', '-id'
+                ).only('id', 'datetime_created')[offset - 1]
+                cursor = TenPagination.encode_cursor((boundary.datetime_created, boundary.id))
+                cursor_cost = self.timed({'cursor': cursor}, repeat)
+            else:
+                cursor_cost = self.timed({'pagination': 'cursor'}, repeat)
+
+            self.stdout.write("{:>8} {:>14.2f} {:>14.2f}".format(page, offset_cost, cursor_cost))
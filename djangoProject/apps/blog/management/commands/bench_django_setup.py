@@ -0,0 +1,71 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+SNIPPET = """
+import json, time
+start = time.perf_counter()
+import django
+django.setup()
+setup = time.perf_counter() - start
+for module in {modules!r}:
+    __import__(module)
+total = time.perf_counter() - start
+from blog.clients import clients
+print(json.dumps({{"setup": setup, "total": total, "created": [str(key) for key in clients.created]}}))
+"""
+
+
+class Command(BaseCommand):
+    help = "在新进程中测量 django.setup() 与导入路由的耗时, 并检查启动期间是否创建了外部服务客户端"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--module', action='append', dest='modules',
+                            help="setup 之后额外导入的模块, 默认 djangoProject.urls")
+        parser.add_argument('--top', type=int, default=0, help="输出 -X importtime 中累计耗时最高的模块数")
+
+    def run_once(self, modules, importtime=False):
+        command = [sys.executable]
+        if importtime:
+            command += ['-X', 'importtime']
+        command += ['-c', SNIPPET.format(modules=modules)]
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+        result = subprocess.run(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                universal_newlines=True)
+        if result.returncode != 0:
+            raise CommandError(result.stderr[-2000:])
+        return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+    def handle(self, *args, **options):
+        modules = options['modules'] or ['djangoProject.urls']
+        setups = []
+        totals = []
+        created = set()
+        for _ in range(options['repeat']):
+            result, _ = self.run_once(modules)
+            setups.append(result['setup'] * 1000)
+            totals.append(result['total'] * 1000)
+            created.update(result['created'])
+
+        self.stdout.write("{:<24} {:>10} {:>10} {:>10}".format("stage", "min(ms)", "median(ms)", "max(ms)"))
+        for name, costs in (('django.setup()', setups), ('setup + ' + ','.join(modules), totals)):
+            self.stdout.write("{:<24} {:>10.1f} {:>10.1f} {:>10.1f}".format(
+                name[:24], min(costs), statistics.median(costs), max(costs)
+            ))
+        self.stdout.write("clients created at startup: {}".format(sorted(created) or "none"))
+
+        if options['top']:
+            _, stderr = self.run_once(modules, importtime=True)
+            rows = []
+            for line in stderr.splitlines():
+                if not line.startswith('import time:') or 'cumulative' in line:
+                    continue
+                _, cumulative, name = line[len('import time:'):].split('|')
+                rows.append((int(cumulative), name.strip()))
+            for cumulative, name in sorted(rows, reverse=True)[:options['top']]:
+                self.stdout.write("{:>10.1f} ms  {}".format(cumulative / 1000, name))
@@ -0,0 +1,83 @@
+import datetime
+import decimal
+import time
+
+from django.core.management.base import BaseCommand
+from blog.encoders import StandardEncoder, OrjsonEncoder, RawJSON, orjson
+from blog.errcode import ARTICLE_INFO
+
+
+class Command(BaseCommand):
+    help = "使用模拟的公开文章列表数据对比响应编码器耗时"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=2000, help="每种编码器的编码次数")
+        parser.add_argument('--page-size', type=int, default=10)
+
+    @staticmethod
+    def build_card(index):
+        return {
+            "id": index,
+            "user_info": {"icon": "https://img.example.com/icon/{}.png".format(index), "username": "作者{}".format(index)},
+            "title": "文章标题 {} —— 关于 Django 与 Elasticsearch 的实践".format(index),
+            "category_name": "技术",
+            "attached_pictures": [
+                {"id": index * 10 + i, "image": "https://img.example.com/article/{}/{}.jpg".format(index, i)}
+                for i in range(3)
+            ],
+            "datetime_created": "2020年12月02日 16时:48分:{:02d}秒".format(index % 60),
+            "tags": ["python", "django", "后端"],
+        }
+
+    def build_payloads(self, page_size):
+        cards = [self.build_card(index) for index in range(page_size)]
+        standard = StandardEncoder()
+        return (
+            ('feed', {
+                "err_code": ARTICLE_INFO.err_code,
+                "data": {
+                    "count": 123456,
+                    "next": "http://api.example.com/api/article/all_article_info/?page=3",
+                    "previous": "http://api.example.com/api/article/all_article_info/?page=1",
+                    "results": cards,
+                },
+                "detail": ARTICLE_INFO.detail,
+            }),
+            ('feed_raw_cards', {
+                "err_code": ARTICLE_INFO.err_code,
+                "data": {
+                    "count": 123456,
+                    "next": None,
+                    "previous": None,
+                    "results": RawJSON(b'[' + b','.join(standard.encode(card) for card in cards) + b']'),
+                },
+                "detail": ARTICLE_INFO.detail,
+            }),
+            ('native_types', {
+                "err_code": ARTICLE_INFO.err_code,
+                "data": [
+                    {"datetime_created": datetime.datetime(2020, 12, 2, 16, 48, index), "amount": decimal.Decimal('9.90')}
+                    for index in range(page_size * 10)
+                ],
+                "detail": ARTICLE_INFO.detail,
+            }),
+        )
+
+    def handle(self, *args, **options):
+        encoders = [('standard', StandardEncoder())]
+        if orjson is not None:
+            encoders.append(('orjson', OrjsonEncoder()))
+        else:
+            self.stdout.write("orjson 未安装, 仅测试 StandardEncoder")
+
+        number = options['number']
+        self.stdout.write("{:<16} {:<10} {:>10} {:>10}".format("payload", "encoder", "us/op", "bytes"))
+        for payload_name, payload in self.build_payloads(options['page_size']):
+            for encoder_name, encoder in encoders:
+                start = time.perf_counter()
+                for _ in range(number):
+                    content = encoder.encode(payload)
+                cost = (time.perf_counter() - start) * 1000000 / number
+                self.stdout.write(
+                    "{:<16} {:<10} {:>10.1f} {:>10}".format(payload_name, encoder_name, cost, len(content))
+                )
@@ -0,0 +1,70 @@
+import os
+import statistics
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from blog.indexer import search_index_queue
+from blog.models import Article
+from blog.search.embedded import EmbeddedSearchBackend
+from blog.management.commands.rebuild_search_index import iter_batches
+
+
+class Command(BaseCommand):
+    help = "由数据库生成临时的进程内索引, 与 es 对比查询耗时及首页结果重合度"
+
+    def add_arguments(self, parser):
+        parser.add_argument('keywords', nargs='+')
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--no-es', action='store_true', help="只测试进程内后端")
+
+    @staticmethod
+    def timed(func, repeat):
+        costs = []
+        result = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            costs.append((time.perf_counter() - start) * 1000)
+        return statistics.median(costs), result
+
+    @staticmethod
+    def get_ids(result):
+        return [hit['_id'] for hit in result[0]['hits']['hits']]
+
+    def handle(self, *args, **options):
+        path = os.path.join(tempfile.mkdtemp(), 'article.idx')
+        embedded = EmbeddedSearchBackend(path=path)
+        start = time.perf_counter()
+        articles = Article.objects.only(
+            'id', 'title', 'content', 'datetime_created', 'publish_status', 'user_id'
+        ).order_by('id').iterator(chunk_size=2000)
+        total = embedded.rebuild(
+            item for batch in iter_batches(articles, 500) for item in search_index_queue.build_sources(batch)
+        )
+        self.stdout.write("embedded index: {} documents, {:.1f}s, snapshot {:.1f} KB".format(
+            total, time.perf_counter() - start, os.path.getsize(path) / 1024
+        ))
+
+        elastic = None
+        if not options['no_es']:
+            from blog.search.elastic import ElasticsearchBackend
+            elastic = ElasticsearchBackend()
+
+        self.stdout.write("{:<20} {:>10} {:>14} {:>10} {:>10}".format(
+            "keywords", "hits", "embedded(ms)", "es(ms)", "overlap"
+        ))
+        for keywords in options['keywords']:
+            embedded_cost, embedded_result = self.timed(
+                lambda: embedded.query_search(keywords, 1, 10), options['repeat']
+            )
+            es_cost, overlap = '-', '-'
+            if elastic is not None:
+                cost, es_result = self.timed(lambda: elastic.query_search(keywords, 1, 10), options['repeat'])
+                es_cost = '{:.2f}'.format(cost)
+                es_ids = set(self.get_ids(es_result))
+                if es_ids:
+                    overlap = '{:.0%}'.format(len(es_ids & set(self.get_ids(embedded_result))) / len(es_ids))
+            self.stdout.write("{:<20} {:>10} {:>14.2f} {:>10} {:>10}".format(
+                keywords, embedded_result[1], embedded_cost, es_cost, overlap
+            ))
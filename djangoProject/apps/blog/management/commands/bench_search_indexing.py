@@ -0,0 +1,125 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from elasticsearch import Elasticsearch
+from blog.indexer import SearchIndexQueue
+from blog.search.elastic import ElasticsearchBackend
+from blog.models import Article, User
+
+
+class FakeBulkHandler(BaseHTTPRequestHandler):
+    """
+    模拟 es bulk 接口: 按比例随机返回 429, 删除返回 404, 其余写入成功
+    """
+    fail_rate = 0.0
+    requests = 0
+    documents = 0
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+        lines = [line for line in body.split('\n') if line]
+        items = []
+        index = 0
+        while index < len(lines):
+            op_type, meta = next(iter(json.loads(lines[index]).items()))
+            index += 1 if op_type == 'delete' else 2
+            if op_type == 'delete':
+                status = 404
+            elif random.random() < self.fail_rate:
+                status = 429
+            else:
+                status = 201
+            item = {'_index': meta.get('_index'), '_id': str(meta['_id']), 'status': status}
+            if status == 429:
+                item['error'] = {'type': 'es_rejected_execution_exception'}
+            items.append({op_type: item})
+        FakeBulkHandler.requests += 1
+        FakeBulkHandler.documents += len(items)
+
+        content = json.dumps({
+            'took': 1, 'errors': any(item[next(iter(item))]['status'] >= 300 for item in items), 'items': items
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = "使用本地模拟 bulk 接口测试搜索索引队列的合并与批量写入吞吐"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--articles', type=int, default=2000, help="在事务内临时生成的文章数, 结束后回滚")
+        parser.add_argument('--edits', type=int, default=3, help="每篇文章重复入队次数")
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--fail-rate', type=float, default=0.0)
+
+    def handle(self, *args, **options):
+        FakeBulkHandler.fail_rate = options['fail_rate']
+        server = ThreadingHTTPServer(('127.0.0.1', 0), FakeBulkHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        backend = ElasticsearchBackend(client=Elasticsearch(['http://127.0.0.1:{}'.format(server.server_port)]))
+        queue = SearchIndexQueue(name='bench', batch_size=options['batch_size'])
+        queue.clear()
+        try:
+            with transaction.atomic():
+                article_ids = self.seed(options['articles'])
+                self.run(queue, backend, article_ids, options['edits'])
+                transaction.set_rollback(True)
+        finally:
+            queue.clear()
+            server.shutdown()
+
+    @staticmethod
+    def seed(amount):
+        """
+        批量生成测试文章
+        :param amount:
+        :return:
+        """
+        user = User.objects.only('id').first()
+        if user is None:
+            raise CommandError("至少需要一个用户")
+        Article.objects.bulk_create(
+            (Article(user_id=user.id, title='bench {}'.format(i), content='bench', publish_status=True)
+             for i in range(amount)),
+            batch_size=2000
+        )
+        return list(Article.objects.filter(title__startswith='bench ').values_list('id', flat=True))
+
+    def run(self, queue, backend, article_ids, edits):
+        for _ in range(edits):
+            for article_id in article_ids:
+                queue.push(article_id)
+        metrics = queue.get_metrics()
+        self.stdout.write("pushed: {}  backlog after coalescing: {}".format(
+            len(article_ids) * edits, metrics['backlog']
+        ))
+
+        start = time.perf_counter()
+        rounds = 0
+        indexed = 0
+        while queue.get_metrics()['backlog'] and rounds < 100:
+            indexed += queue.drain(backend=backend)
+            rounds += 1
+        cost = time.perf_counter() - start
+
+        metrics = queue.get_metrics()
+        self.stdout.write("drain rounds: {}  bulk requests: {}  documents sent: {}".format(
+            rounds, FakeBulkHandler.requests, FakeBulkHandler.documents
+        ))
+        self.stdout.write("indexed: {}  failed attempts: {}  backlog: {}".format(
+            indexed, metrics['failed'], metrics['backlog']
+        ))
+        self.stdout.write("elapsed: {:.2f}s  throughput: {:.1f} doc/s".format(
+            cost, indexed / cost if cost else 0
+        ))
@@ -0,0 +1,79 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from elasticsearch.exceptions import TransportError
+from blog.search import search_backend
+
+
+class Command(BaseCommand):
+    help = "对比搜索结果 from/size 分页与 search_after 游标分页在不同深度的耗时"
+
+    def add_arguments(self, parser):
+        parser.add_argument('keywords')
+        parser.add_argument('--pages', nargs='+', type=int, default=[1, 100, 1000])
+        parser.add_argument('--page-size', type=int, default=10)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    @staticmethod
+    def timed(func, repeat):
+        """
+        重复执行并计时, 返回中位数毫秒
+        :param func:
+        :param repeat:
+        :return:
+        """
+        costs = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            costs.append((time.perf_counter() - start) * 1000)
+        return statistics.median(costs)
+
+    @staticmethod
+    def seek_cursor(keywords, offset, step=1000):
+        """
+        以大页逐段前进, 获得第 offset 条结果处的游标, 与客户端逐页翻到此处得到的游标一致
+        :param keywords:
+        :param offset:
+        :param step:
+        :return:
+        """
+        cursor = None
+        remaining = offset
+        while remaining > 0:
+            size = min(step, remaining)
+            res, _, _ = search_backend.query_search_after(keywords, cursor, size)
+            hits = res['hits']['hits']
+            if len(hits) < size:
+                return None
+            cursor = search_backend.encode_search_cursor(hits[-1]['sort'])
+            remaining -= size
+        return cursor
+
+    def handle(self, *args, **options):
+        keywords = options['keywords']
+        page_size = options['page_size']
+        repeat = options['repeat']
+        _, total = search_backend.query_search(keywords, 1, 1)
+        self.stdout.write("matched documents: {}".format(total))
+        self.stdout.write("{:>8} {:>14} {:>14}".format("page", "from(ms)", "after(ms)"))
+        for page in options['pages']:
+            offset = (page - 1) * page_size
+            if offset >= total:
+                self.stdout.write("{:>8} {:>14} {:>14}".format(page, "-", "-"))
+                continue
+
+            try:
+                offset_cost = '{:.2f}'.format(self.timed(
+                    lambda: search_backend.query_search(keywords, page, page_size), repeat
+                ))
+            except TransportError:
+                # 超过 max_result_window
+                offset_cost = 'error'
+
+            cursor = self.seek_cursor(keywords, offset)
+            after_cost = self.timed(
+                lambda: search_backend.query_search_after(keywords, cursor, page_size), repeat
+            )
+            self.stdout.write("{:>8} {:>14} {:>14.2f}".format(page, offset_cost, after_cost))
@@ -0,0 +1,78 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from blog.compiled_serializers import simple_article_serializer, simple_article_user_serializer, \
+    article_excerpt_serializer, comment_serializer, reply_serializer
+from blog.models import Article, Comment, Reply
+from blog.serializers import SimpleArticleSerializer, SimpleArticleUserSerializer, ArticleExcerptSerializer, \
+    CommentSerializers, ReplySerializers
+from blog.encoders import encode_response
+
+
+class Command(BaseCommand):
+    help = "对比 DRF 序列化器与编译序列化器的单对象耗时, 并校验输出逐字节一致"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=200, help="每轮序列化的对象数")
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        size, repeat = options['size'], options['repeat']
+        cases = (
+            ('SimpleArticleSerializer', Article, SimpleArticleSerializer.get_instance,
+             SimpleArticleSerializer, simple_article_serializer),
+            ('ArticleExcerptSerializer', Article, ArticleExcerptSerializer.get_instance,
+             ArticleExcerptSerializer, article_excerpt_serializer),
+            ('SimpleArticleUserSerializer', Article, SimpleArticleUserSerializer.get_instance,
+             SimpleArticleUserSerializer, simple_article_user_serializer),
+            ('CommentSerializers', Comment, CommentSerializers.get_instance,
+             CommentSerializers, comment_serializer),
+            ('ReplySerializers', Reply, Reply.objects.all,
+             ReplySerializers, reply_serializer),
+        )
+        self.stdout.write("{:<30} {:>8} {:>14} {:>14}".format("serializer", "objects", "drf(us/obj)", "compiled(us/obj)"))
+        for name, model, get_instance, serializer_class, compiled in cases:
+            ids = list(model.objects.order_by('-id').values_list('id', flat=True)[:size])
+            if not ids:
+                self.stdout.write("{:<30} {:>8}".format(name, 0))
+                continue
+
+            def drf():
+                return serializer_class(instance=get_instance().filter(id__in=ids), many=True).data
+
+            def fast():
+                return compiled.serialize_ids(ids)
+
+            self.check_output(name, drf(), fast())
+            drf_cost = self.timed(drf, repeat) / len(ids)
+            fast_cost = self.timed(fast, repeat) / len(ids)
+            self.stdout.write("{:<30} {:>8} {:>14.1f} {:>14.1f}".format(name, len(ids), drf_cost, fast_cost))
+
+    @staticmethod
+    def timed(func, repeat):
+        """
+        多轮取最小耗时, 单位微秒
+        :param func:
+        :param repeat:
+        :return:
+        """
+        costs = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            costs.append((time.perf_counter() - start) * 1000000)
+        return min(costs)
+
+    @staticmethod
+    def check_output(name, expected, actual):
+        """
+        两种序列化结果按编码后的字节比较, 忽略列表顺序
+        :param name:
+        :param expected:
+        :param actual:
+        :return:
+        """
+        expected = sorted(encode_response(item) for item in expected)
+        actual = sorted(encode_response(item) for item in actual)
+        if expected != actual:
+            raise CommandError("{} 编译序列化输出与 DRF 不一致".format(name))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from blog.query_plan import get_endpoint_querysets, explain, find_plan_problems
+
+
+class Command(BaseCommand):
+    help = "检查各接口主查询的执行计划, 出现全表扫描或文件排序时失败"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, default=1)
+        parser.add_argument('--article-id', type=int, default=1)
+
+    def handle(self, *args, **options):
+        failed = []
+        for name, queryset in get_endpoint_querysets(options['user_id'], options['article_id']):
+            plan = explain(queryset)
+            problems = find_plan_problems(queryset, plan)
+            self.stdout.write("{} {}".format(name, "FAIL" if problems else "OK"))
+            if options['verbosity'] > 1 or problems:
+                for row in plan:
+                    self.stdout.write("    {}".format(row))
+            if problems:
+                failed.append("{}: {}".format(name, '; '.join(problems)))
+
+        if failed:
+            raise CommandError("\n".join(failed))
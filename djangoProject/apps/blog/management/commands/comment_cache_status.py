@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from blog.threads import comment_thread_cache
+
+
+class Command(BaseCommand):
+    help = "查看评论列表缓存各文章的命中率, 按读取次数倒序; 次数为按抽样比例换算的估计值"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=20, help="输出的文章数")
+        parser.add_argument('--days', type=int, default=1, help="统计最近几天, 最多保留天数")
+        parser.add_argument('--clear', action='store_true', help="输出后清空统计")
+
+    def handle(self, *args, **options):
+        metrics = comment_thread_cache.get_metrics(options['days'])
+        rows = sorted(metrics.items(), key=lambda item: item[1]['hit'] + item[1]['miss'], reverse=True)
+        self.stdout.write("{:>10} {:>10} {:>10} {:>8}".format("article", "hit", "miss", "ratio"))
+        for article_id, item in rows[:options['top']]:
+            self.stdout.write("{:>10} {:>10} {:>10} {:>8.2%}".format(
+                article_id, item['hit'], item['miss'], item['hit_ratio']
+            ))
+        hit = sum(item['hit'] for item in metrics.values())
+        miss = sum(item['miss'] for item in metrics.values())
+        self.stdout.write("{:>10} {:>10} {:>10} {:>8.2%}".format(
+            "total", hit, miss, hit / (hit + miss) if hit + miss else 0
+        ))
+        if options['clear']:
+            comment_thread_cache.clear_metrics()
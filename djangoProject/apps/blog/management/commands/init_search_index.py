@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from blog.search import search_backend
+from blog.search.elastic import ElasticsearchBackend, ensure_article_alias, get_alias_indices
+
+
+class Command(BaseCommand):
+    help = "初始化文章搜索索引: 确保读别名存在, 部署时在启动服务前执行一次"
+
+    def handle(self, *args, **options):
+        if not isinstance(search_backend.backend, ElasticsearchBackend):
+            self.stdout.write("search backend {} needs no initialization".format(
+                search_backend.backend.__class__.__name__
+            ))
+            return
+        ensure_article_alias()
+        self.stdout.write("alias points to {}".format(get_alias_indices()))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from blog.constants import OUTBOX_METRICS_WINDOW
+from blog.indexer import search_index_queue
+from blog.outbox import get_outbox_metrics, get_failed_messages, retry_failed
+
+
+def format_lag(lag):
+    return "-" if lag is None else "{:.2f}".format(lag.total_seconds())
+
+
+class Command(BaseCommand):
+    help = "查看发件箱各阶段的积压与延迟: 写入 -> 投递 -> 消费 -> 索引队列, 以及停止投递的失败消息"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--failed', type=int, default=20, help="列出的失败消息数")
+        parser.add_argument('--retry', type=int, nargs='*', help="重置失败消息重新投递, 不指定 id 时重置全部")
+
+    def handle(self, *args, **options):
+        if options['retry'] is not None:
+            count = retry_failed(options['retry'] or None)
+            self.stdout.write("reset {} failed messages".format(count))
+
+        metrics = get_outbox_metrics()
+        self.stdout.write("pending:               {} (oldest {:.1f}s)".format(
+            metrics['pending'], metrics['pending_oldest_age']
+        ))
+        self.stdout.write("in flight:             {} (oldest {:.1f}s)".format(
+            metrics['in_flight'], metrics['in_flight_oldest_age']
+        ))
+        self.stdout.write("failed:                {} (oldest {:.1f}s)".format(
+            metrics['failed'], metrics['failed_oldest_age']
+        ))
+        self.stdout.write("consumed in {}s:     {}".format(OUTBOX_METRICS_WINDOW, metrics['consumed']))
+        self.stdout.write("relay lag(s) avg/max:   {} / {}".format(
+            format_lag(metrics['relay_lag_avg']), format_lag(metrics['relay_lag_max'])
+        ))
+        self.stdout.write("consume lag(s) avg/max: {} / {}".format(
+            format_lag(metrics['consume_lag_avg']), format_lag(metrics['consume_lag_max'])
+        ))
+        index_metrics = search_index_queue.get_metrics()
+        self.stdout.write("index backlog:         {} (oldest {:.1f}s)".format(
+            index_metrics['backlog'], index_metrics['oldest_age']
+        ))
+
+        for message in get_failed_messages(options['failed']):
+            self.stdout.write("failed #{id} {topic} attempts={attempts} at {datetime_failed:%Y-%m-%d %H:%M:%S}: "
+                              "{error}".format(**message))
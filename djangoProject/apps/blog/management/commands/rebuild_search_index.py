@@ -0,0 +1,167 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Max, Min
+from elasticsearch.helpers import bulk
+from blog.cache import response_cache
+from blog.clients import clients
+from blog.indexer import search_index_queue
+from blog.models import Article
+from blog.search import search_backend
+from blog.search.elastic import ElasticsearchBackend, create_article_index, swap_article_alias, get_alias_indices
+
+
+def iter_batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Command(BaseCommand):
+    help = "重建文章搜索索引: 新建版本索引, 按 id 区间并行写入, 校验数量后原子切换读别名; " \
+           "文档结构或映射变化(如作者改为按 user_id 索引)后执行一次即完成迁移"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--range-size', type=int, default=20000, help="每个任务处理的 id 区间宽度")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="数据库 iterator 每次读取行数")
+        parser.add_argument('--bulk-size', type=int, default=500, help="每次 bulk 请求的文档数")
+        parser.add_argument('--replicas', type=int, default=1, help="写入完成后恢复的副本数")
+        parser.add_argument('--tolerance', type=int, default=0, help="允许的文档数差异")
+        parser.add_argument('--delete-old', action='store_true', help="切换后删除旧索引")
+
+    def handle(self, *args, **options):
+        backend = search_backend.backend
+        if not isinstance(backend, ElasticsearchBackend):
+            return self.rebuild_embedded(backend, options)
+
+        es = backend.client
+        # 写入期间关闭刷新与副本, 完成后恢复
+        new_index = create_article_index(refresh_interval='-1', number_of_replicas=0)
+        self.stdout.write("created index {}".format(new_index))
+        search_index_queue.start_rebuild(new_index)
+        try:
+            start = time.perf_counter()
+            indexed, failed = self.stream(new_index, options)
+            self.stdout.write("indexed {} documents ({} failed) in {:.1f}s".format(
+                indexed, failed, time.perf_counter() - start
+            ))
+            if failed:
+                raise CommandError("存在写入失败的文档")
+
+            es.indices.put_settings(index=new_index, body={
+                "index": {"refresh_interval": None, "number_of_replicas": options['replicas']}
+            })
+            # 写入期间的增量修改由队列双写, 较晚完成的全量分块可能用旧数据覆盖双写结果
+            # 双写过的文章重新入队, 与积压一起在切换前按最新数据写入
+            replayed = search_index_queue.replay_rebuild()
+            self.stdout.write("replayed {} documents written during rebuild".format(replayed))
+            search_index_queue.drain()
+            es.indices.refresh(index=new_index)
+            self.verify(es, new_index, options['tolerance'])
+
+            old_indices = swap_article_alias(new_index)
+        except BaseException:
+            # 只删除尚未切换的新索引; 切换请求超时但已生效时读别名已指向新索引, 不能删除
+            if new_index not in get_alias_indices():
+                es.indices.delete(index=new_index, ignore=404)
+            raise
+        finally:
+            search_index_queue.finish_rebuild()
+        self.stdout.write("alias switched from {} to {}".format(old_indices, new_index))
+        response_cache.bump('search')
+
+        if options['delete_old']:
+            for index in old_indices:
+                es.indices.delete(index=index, ignore=404)
+                self.stdout.write("deleted {}".format(index))
+
+    def rebuild_embedded(self, backend, options):
+        """
+        进程内后端没有别名, 生成完整的新索引后整体替换快照
+        :param backend:
+        :param options:
+        :return:
+        """
+        start = time.perf_counter()
+        articles = Article.objects.only(
+            'id', 'title', 'content', 'datetime_created', 'publish_status', 'user_id'
+        ).order_by('id').iterator(chunk_size=options['chunk_size'])
+        indexed = backend.rebuild(
+            item
+            for batch in iter_batches(articles, options['bulk_size'])
+            for item in search_index_queue.build_sources(batch)
+        )
+        self.stdout.write("indexed {} documents in {:.1f}s".format(indexed, time.perf_counter() - start))
+        response_cache.bump('search')
+
+    def stream(self, new_index, options):
+        """
+        按 id 区间切分任务并行写入
+        :param new_index:
+        :param options:
+        :return: (成功数, 失败数)
+        """
+        bounds = Article.objects.aggregate(min_id=Min('id'), max_id=Max('id'))
+        if bounds['min_id'] is None:
+            return 0, 0
+        ranges = [
+            (lower, lower + options['range_size'])
+            for lower in range(bounds['min_id'], bounds['max_id'] + 1, options['range_size'])
+        ]
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            results = list(executor.map(
+                lambda id_range: self.index_range(new_index, id_range, options['chunk_size'], options['bulk_size']),
+                ranges
+            ))
+        return sum(result[0] for result in results), sum(result[1] for result in results)
+
+    @staticmethod
+    def index_range(new_index, id_range, chunk_size, bulk_size):
+        """
+        写入一个 id 区间内的文章, 每个线程使用各自的数据库连接
+        :param new_index:
+        :param id_range:
+        :param chunk_size:
+        :param bulk_size:
+        :return: (成功数, 失败数)
+        """
+        lower, upper = id_range
+        try:
+            articles = Article.objects.filter(
+                id__gte=lower, id__lt=upper
+            ).only(
+                'id', 'title', 'content', 'datetime_created', 'publish_status', 'user_id'
+            ).order_by('id').iterator(chunk_size=chunk_size)
+            actions = (
+                {'_index': new_index, '_id': article_id, '_source': source}
+                for batch in iter_batches(articles, bulk_size)
+                for article_id, source in search_index_queue.build_sources(batch)
+            )
+            success, errors = bulk(
+                clients.get('es'), actions, chunk_size=bulk_size, raise_on_error=False
+            )
+            return success, len(errors)
+        finally:
+            connection.close()
+
+    def verify(self, es, new_index, tolerance):
+        """
+        校验新索引文档数与数据库文章数
+        :param es:
+        :param new_index:
+        :param tolerance:
+        :return:
+        """
+        expected = Article.objects.count()
+        actual = es.count(index=new_index)['count']
+        self.stdout.write("database: {}  index: {}".format(expected, actual))
+        if abs(expected - actual) > tolerance:
+            raise CommandError("文档数不一致: 数据库 {} 索引 {}".format(expected, actual))
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Subquery, IntegerField
+from django.db.models.functions import Coalesce
+from blog.cache import invalidate_comments
+from blog.models import Comment, Reply
+from blog.threads import comment_thread_cache
+
+
+class Command(BaseCommand):
+    help = "按评论 id 分批校正回复数, 只更新与实际回复数不一致的评论; 新增 reply_count 字段后部署时由迁移回填"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help="只统计不一致的评论, 不写入")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        checked = 0
+        fixed = 0
+        # 回复数在 UPDATE 语句内计算, 不会覆盖读取与写入之间并发的 F() 增减
+        actual_count = Coalesce(Subquery(
+            Reply.objects.filter(
+                comment_id=OuterRef('id')
+            ).order_by().values('comment_id').annotate(count=Count('id')).values('count')[:1],
+            output_field=IntegerField()
+        ), 0)
+        while True:
+            batch = list(Comment.objects.filter(
+                id__gt=last_id
+            ).order_by('id').values_list('id', 'article_id', 'reply_count')[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            actual = dict(Reply.objects.filter(
+                comment_id__in=[comment_id for comment_id, _, _ in batch]
+            ).order_by().values_list('comment_id').annotate(count=Count('id')))
+            stale = [
+                (comment_id, article_id)
+                for comment_id, article_id, reply_count in batch
+                if reply_count != actual.get(comment_id, 0)
+            ]
+            if stale and not options['dry_run']:
+                Comment.objects.filter(
+                    id__in=[comment_id for comment_id, _ in stale]
+                ).update(reply_count=actual_count)
+                # update 不触发信号, 按文章使评论缓存失效并重写已缓存的评论列表
+                for article_id in {article_id for _, article_id in stale}:
+                    invalidate_comments(article_id=article_id)
+                    comment_thread_cache.refresh(article_id, only_cached=True)
+            checked += len(batch)
+            fixed += len(stale)
+            self.stdout.write("checked {} stale {} (last id {})".format(checked, fixed, last_id))
@@ -0,0 +1,33 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from blog.cache import get_search_metrics
+from blog.indexer import search_index_queue, author_update_progress
+
+
+class Command(BaseCommand):
+    help = "查看搜索索引队列的积压与吞吐指标, 搜索结果缓存命中率, 以及改名后的作者文档转换进度"
+
+    def handle(self, *args, **options):
+        metrics = search_index_queue.get_metrics()
+        last_drain_at = metrics['last_drain_at']
+        self.stdout.write("backlog:               {}".format(metrics['backlog']))
+        self.stdout.write("oldest age(s):         {:.1f}".format(metrics['oldest_age']))
+        self.stdout.write("indexed / failed:      {} / {}".format(metrics['indexed'], metrics['failed']))
+        self.stdout.write("batches:               {}".format(metrics['batches']))
+        self.stdout.write("throughput(doc/s):     {:.1f}".format(metrics['throughput']))
+        self.stdout.write("last batch(doc/s):     {:.1f}".format(metrics['last_batch_throughput']))
+        self.stdout.write("last drain at:         {}".format(
+            datetime.datetime.fromtimestamp(last_drain_at) if last_drain_at else "-"
+        ))
+        cache_metrics = get_search_metrics()
+        self.stdout.write("cache hit / miss:      {} / {} ({:.1%})".format(
+            cache_metrics['hit'], cache_metrics['miss'], cache_metrics['hit_ratio']
+        ))
+        for user_id, progress in author_update_progress.get_all():
+            total = int(progress.get('total') or 0)
+            done = int(progress.get('updated') or 0) + int(progress.get('noops') or 0)
+            self.stdout.write("author {:<10} {:<8} {}/{} rps={} retries={} conflicts={} task={}".format(
+                user_id, progress.get('status'), done, total, progress.get('rps'),
+                progress.get('retries') or 0, progress.get('conflicts') or 0, progress.get('task_id')
+            ))
@@ -0,0 +1,69 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.test import APIRequestFactory, force_authenticate
+from blog.models import Article, User
+from blog.views.article import ArticleViewSets
+
+
+class Command(BaseCommand):
+    help = "大量 greenlet 并发请求 ArticleViewSets, 校验响应不会串到其它请求"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--greenlets', type=int, default=200, help="并发 greenlet 数")
+        parser.add_argument('--requests', type=int, default=5000, help="请求总数")
+
+    def handle(self, *args, **options):
+        # 与 gunicorn gevent worker 一致, 在发起请求前打补丁
+        from gevent import monkey
+        monkey.patch_all()
+        from gevent.pool import Pool
+
+        user = User.objects.only('id', 'is_active', 'username').first()
+        article_ids = list(Article.objects.filter(publish_status=False).values_list('id', flat=True)[:20])
+        if user is None or not article_ids:
+            raise CommandError("需要至少一个用户和一篇未发布文章")
+
+        factory = APIRequestFactory()
+        detail_view = ArticleViewSets.as_view({'post': 'get_article_info'})
+        list_view = ArticleViewSets.as_view({'get': 'list'})
+        cases = [
+            (detail_view, 'post', '/api/article/get_article_info/?id={}'.format(article_id))
+            for article_id in article_ids
+        ] + [
+            (list_view, 'get', '/api/article/?page={}'.format(page))
+            for page in range(1, 6)
+        ]
+
+        def call(case, nonce=None):
+            view, method, path = case
+            if nonce is not None:
+                # 每个请求地址不同, 绕过响应缓存走完整的组装流程
+                path = '{}&nonce={}'.format(path, nonce)
+            request = getattr(factory, method)(path)
+            force_authenticate(request, user=user)
+            body = json.loads(view(request).content)
+            # 翻页链接包含请求地址, 只比较错误码与结果数据
+            data = body['data']
+            if isinstance(data, dict) and 'results' in data:
+                data = data['results']
+            return body['err_code'], data
+
+        expected = [call(case) for case in cases]
+
+        def check(index):
+            position = index % len(cases)
+            return position, call(cases[position], nonce=index)
+
+        crossed = 0
+        pool = Pool(options['greenlets'])
+        for position, payload in pool.imap_unordered(check, range(options['requests'])):
+            if payload != expected[position]:
+                crossed += 1
+                self.stderr.write("响应不一致: {} -> {}".format(cases[position][2], payload))
+
+        if crossed:
+            raise CommandError("{} / {} 个响应与预期不一致".format(crossed, options['requests']))
+        self.stdout.write("{} 个请求, {} 个并发 greenlet, 响应全部一致".format(
+            options['requests'], options['greenlets']
+        ))
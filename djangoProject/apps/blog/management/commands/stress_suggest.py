@@ -0,0 +1,52 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.test import APIRequestFactory
+from blog.models import Article
+from blog.views.article import ArticleViewSets
+
+
+class Command(BaseCommand):
+    help = "大量 greenlet 并发请求搜索提示接口, 统计服务端耗时分位数"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--greenlets', type=int, default=200, help="并发 greenlet 数")
+        parser.add_argument('--requests', type=int, default=20000, help="请求总数")
+        parser.add_argument('--prefixes', type=int, default=500, help="由文章标题生成的不同前缀数")
+
+    def handle(self, *args, **options):
+        # 与 gunicorn gevent worker 一致, 在发起请求前打补丁
+        from gevent import monkey
+        monkey.patch_all()
+        from gevent.pool import Pool
+
+        titles = list(Article.objects.filter(publish_status=True).values_list('title', flat=True)[:options['prefixes']])
+        if not titles:
+            raise CommandError("需要至少一篇已发布文章")
+        # 模拟逐字输入: 每个标题取前 1~3 个字符
+        prefixes = [title[:length] for title in titles for length in (1, 2, 3) if title[:length]]
+
+        factory = APIRequestFactory()
+        view = ArticleViewSets.as_view({'get': 'suggest'})
+
+        def call(index):
+            request = factory.get('/api/article/suggest/', {'q': prefixes[index % len(prefixes)]})
+            start = time.perf_counter()
+            view(request)
+            return (time.perf_counter() - start) * 1000
+
+        pool = Pool(options['greenlets'])
+        start = time.perf_counter()
+        costs = sorted(pool.imap_unordered(call, range(options['requests'])))
+        elapsed = time.perf_counter() - start
+
+        def percentile(value):
+            return costs[min(len(costs) - 1, int(len(costs) * value))]
+
+        self.stdout.write("requests: {}  distinct prefixes: {}  throughput: {:.0f}/s".format(
+            len(costs), len(set(prefixes)), len(costs) / elapsed
+        ))
+        self.stdout.write("median: {:.2f}ms  p95: {:.2f}ms  p99: {:.2f}ms  max: {:.2f}ms".format(
+            statistics.median(costs), percentile(0.95), percentile(0.99), costs[-1]
+        ))
@@ -1,13 +1,12 @@
 from django.utils.deprecation import MiddlewareMixin
-from django_redis import get_redis_connection
+from blog.clients import LazyClient
 from blog.constants import LOG_IN_URL_PATH, REDIS_KEY, COMMENT_URL_PATH, \
     LIMIT_INFO
 from blog.utils import logger, custom_response
 
 
 class RequestLimit:
-    def __init__(self):
-        self.redis = get_redis_connection()
+    redis = LazyClient('redis')
 
     @staticmethod
     def get_client_ip(request):
@@ -9,7 +9,9 @@ from django.core.mail import send_mail
 from django.db import models
 from django.db.models import Q
 from django.utils import timezone
+from django.utils.html import strip_tags
 import hashids
+from blog.constants import ARTICLE_EXCERPT_LENGTH
 
 # Create your models here.
 
@@ -121,6 +123,11 @@ class Activity(models.Model):
     object_id = models.PositiveIntegerField()
     activity_content = GenericForeignKey()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'content_type'], name='activity_user_type_idx'),
+        ]
+
 
 class Category(models.Model):
     category = models.CharField(
@@ -182,10 +189,47 @@ class Article(models.Model):
         help_text="额外信息",
         null=True
     )
+    excerpt = models.CharField(
+        help_text="摘要",
+        max_length=200,
+        default='',
+        blank=True
+    )
+    content_length = models.PositiveIntegerField(
+        help_text="正文长度",
+        default=0
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['publish_status', 'datetime_created', 'id'], name='article_status_created_idx'),
+            models.Index(fields=['user', 'datetime_created', 'id'], name='article_user_created_idx'),
+            models.Index(fields=['datetime_created', 'id'], name='article_created_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    def set_excerpt(self):
+        """
+        由正文生成摘要与正文长度
+        :return:
+        """
+        content = self.content or ''
+        self.excerpt = ' '.join(strip_tags(content).split())[:ARTICLE_EXCERPT_LENGTH]
+        self.content_length = len(content)
+
+    def save(self, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'content' in update_fields:
+            self.set_excerpt()
+            if update_fields is not None:
+                update_fields = list(update_fields) + ['excerpt', 'content_length']
+        if update_fields is not None:
+            # auto_now 字段只有在 update_fields 中才会写入
+            kwargs['update_fields'] = list(update_fields) + ['datetime_update']
+        super(Article, self).save(**kwargs)
+
 
 class TagShip(models.Model):
     article = models.ForeignKey(
@@ -281,10 +325,18 @@ class Comment(models.Model):
         help_text="创建时间",
         auto_now_add=True
     )
+    # 回复数, 由回复的创建与删除信号以 F() 原子增减, reconcile_reply_count 命令校正
+    reply_count = models.PositiveIntegerField(
+        help_text="回复数",
+        default=0
+    )
     activities = GenericRelation(Activity, related_query_name="comment")
 
     class Meta:
         ordering = ["-datetime_created", ]
+        indexes = [
+            models.Index(fields=['article', 'datetime_created'], name='comment_article_created_idx'),
+        ]
 
 
 class ReplyManager(models.Manager):
@@ -327,6 +379,11 @@ class Reply(models.Model):
     )
     objects = ReplyManager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['comment', 'datetime_created', 'id'], name='reply_comment_created_idx'),
+        ]
+
 
 class VerifyCode(models.Model):
     phone = models.CharField(
@@ -394,3 +451,46 @@ class WebSocketTicket(models.Model):
 
     class Meta:
         db_table = "blog_websocket_ticket"
+
+
+class OutboxMessage(models.Model):
+    topic = models.CharField(
+        help_text="消息主题",
+        max_length=64
+    )
+    payload = models.JSONField(
+        help_text="消息内容"
+    )
+    datetime_created = models.DateTimeField(
+        help_text="创建时间",
+        auto_now_add=True
+    )
+    datetime_published = models.DateTimeField(
+        help_text="投递到队列的时间",
+        null=True
+    )
+    datetime_consumed = models.DateTimeField(
+        help_text="消费完成时间",
+        null=True
+    )
+    attempts = models.PositiveIntegerField(
+        help_text="投递次数",
+        default=0
+    )
+    datetime_failed = models.DateTimeField(
+        help_text="超过最大投递次数, 停止投递的时间",
+        null=True
+    )
+    error = models.CharField(
+        help_text="最近一次处理失败的原因",
+        max_length=255,
+        default='',
+        blank=True
+    )
+
+    class Meta:
+        db_table = "blog_outbox_message"
+        indexes = [
+            models.Index(fields=['datetime_published', 'id'], name='outbox_published_idx'),
+            models.Index(fields=['datetime_consumed'], name='outbox_consumed_idx'),
+        ]
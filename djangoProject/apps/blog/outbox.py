@@ -0,0 +1,154 @@
+import datetime
+
+from django.db import transaction, connection
+from django.db.models import Q, Avg, Max, Min, F, Count, DurationField, ExpressionWrapper
+from django.utils import timezone
+from blog.constants import OUTBOX_RELAY_BATCH_SIZE, OUTBOX_REDELIVER_AFTER, OUTBOX_RETENTION_DAYS, \
+    OUTBOX_METRICS_WINDOW, OUTBOX_MAX_ATTEMPTS
+from blog.models import OutboxMessage
+from blog.utils import logger
+
+
+def publish(topic, **payload):
+    """
+    写入发件箱, 与业务数据处于同一事务, 事务回滚时消息一并回滚
+    :param topic:
+    :param payload: 可 JSON 序列化的参数
+    :return:
+    """
+    return OutboxMessage.objects.create(topic=topic, payload=payload)
+
+
+def relay(send, batch_size=OUTBOX_RELAY_BATCH_SIZE):
+    """
+    取出一批已提交且未投递(或投递后长时间未消费)的消息, 整批投递后标记并累计投递次数
+    行锁跳过其他投递进程正在处理的消息, 投递次数用尽仍未消费的消息标记失败, 不再投递
+    :param send: 接收消息 id 列表的投递函数
+    :param batch_size:
+    :return: 投递条数
+    """
+    now = timezone.now()
+    redeliver_before = now - datetime.timedelta(seconds=OUTBOX_REDELIVER_AFTER)
+    failed = OutboxMessage.objects.filter(
+        datetime_consumed__isnull=True, datetime_failed__isnull=True,
+        attempts__gte=OUTBOX_MAX_ATTEMPTS, datetime_published__lt=redeliver_before
+    ).update(datetime_failed=now)
+    if failed:
+        logger.error("发件箱 {} 条消息超过最大投递次数 {}, 已停止投递".format(failed, OUTBOX_MAX_ATTEMPTS))
+
+    with transaction.atomic():
+        message_ids = list(OutboxMessage.objects.select_for_update(
+            skip_locked=connection.features.has_select_for_update_skip_locked
+        ).filter(
+            Q(datetime_published__isnull=True) |
+            Q(datetime_consumed__isnull=True, datetime_failed__isnull=True,
+              attempts__lt=OUTBOX_MAX_ATTEMPTS, datetime_published__lt=redeliver_before)
+        ).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not message_ids:
+            return 0
+        send(message_ids)
+        OutboxMessage.objects.filter(id__in=message_ids).update(datetime_published=now, attempts=F('attempts') + 1)
+    return len(message_ids)
+
+
+def consume(message_ids, handlers):
+    """
+    按 id 顺序处理消息, 已消费的跳过, 处理完成后标记
+    处理失败的消息保持未消费, 超时后由投递进程重新投递, 因此处理函数需可重复执行
+    :param message_ids:
+    :param handlers: {主题: 处理函数}
+    :return: 处理条数
+    """
+    consumed = 0
+    messages = OutboxMessage.objects.filter(
+        id__in=message_ids, datetime_consumed__isnull=True
+    ).order_by('id')
+    for message in messages:
+        try:
+            handlers[message.topic](**message.payload)
+        except Exception as e:
+            logger.error("发件箱消息处理失败 {} {} 第 {} 次: {}".format(message.id, message.topic, message.attempts, e))
+            OutboxMessage.objects.filter(id=message.id).update(error=repr(e)[:255])
+            continue
+        consumed += OutboxMessage.objects.filter(
+            id=message.id, datetime_consumed__isnull=True
+        ).update(datetime_consumed=timezone.now())
+    return consumed
+
+
+def purge(batch_size=1000):
+    """
+    删除超过保留期的已消费消息
+    :param batch_size:
+    :return:
+    """
+    before = timezone.now() - datetime.timedelta(days=OUTBOX_RETENTION_DAYS)
+    message_ids = list(OutboxMessage.objects.filter(
+        datetime_consumed__lt=before
+    ).values_list('id', flat=True)[:batch_size])
+    if message_ids:
+        OutboxMessage.objects.filter(id__in=message_ids).delete()
+    return len(message_ids)
+
+
+def retry_failed(message_ids=None):
+    """
+    重置失败消息的投递次数, 由投递进程重新投递
+    :param message_ids: 默认全部失败消息
+    :return: 重置条数
+    """
+    messages = OutboxMessage.objects.filter(datetime_failed__isnull=False, datetime_consumed__isnull=True)
+    if message_ids is not None:
+        messages = messages.filter(id__in=message_ids)
+    return messages.update(datetime_failed=None, datetime_published=None, attempts=0)
+
+
+def get_failed_messages(limit=20):
+    """
+    获得最近标记失败的消息
+    :param limit:
+    :return:
+    """
+    return list(OutboxMessage.objects.filter(
+        datetime_failed__isnull=False, datetime_consumed__isnull=True
+    ).order_by('-datetime_failed').values('id', 'topic', 'attempts', 'datetime_failed', 'error')[:limit])
+
+
+def get_outbox_metrics():
+    """
+    分阶段统计积压与延迟: 写入到投递, 投递到消费
+    :return:
+    """
+    now = timezone.now()
+    pending = OutboxMessage.objects.filter(
+        datetime_published__isnull=True
+    ).aggregate(count=Count('id'), oldest=Min('datetime_created'))
+    in_flight = OutboxMessage.objects.filter(
+        datetime_published__isnull=False, datetime_consumed__isnull=True, datetime_failed__isnull=True
+    ).aggregate(count=Count('id'), oldest=Min('datetime_published'))
+    failed = OutboxMessage.objects.filter(
+        datetime_failed__isnull=False, datetime_consumed__isnull=True
+    ).aggregate(count=Count('id'), oldest=Min('datetime_failed'))
+
+    relay_lag = ExpressionWrapper(F('datetime_published') - F('datetime_created'), output_field=DurationField())
+    consume_lag = ExpressionWrapper(F('datetime_consumed') - F('datetime_published'), output_field=DurationField())
+    recent = OutboxMessage.objects.filter(
+        datetime_consumed__gte=now - datetime.timedelta(seconds=OUTBOX_METRICS_WINDOW)
+    ).aggregate(
+        count=Count('id'),
+        relay_avg=Avg(relay_lag), relay_max=Max(relay_lag),
+        consume_avg=Avg(consume_lag), consume_max=Max(consume_lag),
+    )
+    return {
+        "pending": pending['count'],
+        "pending_oldest_age": (now - pending['oldest']).total_seconds() if pending['oldest'] else 0,
+        "in_flight": in_flight['count'],
+        "in_flight_oldest_age": (now - in_flight['oldest']).total_seconds() if in_flight['oldest'] else 0,
+        "failed": failed['count'],
+        "failed_oldest_age": (now - failed['oldest']).total_seconds() if failed['oldest'] else 0,
+        "consumed": recent['count'],
+        "relay_lag_avg": recent['relay_avg'],
+        "relay_lag_max": recent['relay_max'],
+        "consume_lag_avg": recent['consume_avg'],
+        "consume_lag_max": recent['consume_max'],
+    }
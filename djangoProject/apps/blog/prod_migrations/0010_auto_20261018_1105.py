@@ -0,0 +1,23 @@
+# Generated by Django 3.1.4 on 2026-10-18 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0009_auto_20261018_1020'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='content_length',
+            field=models.PositiveIntegerField(default=0, help_text='正文长度'),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='excerpt',
+            field=models.CharField(blank=True, default='', help_text='摘要', max_length=200),
+        ),
+    ]
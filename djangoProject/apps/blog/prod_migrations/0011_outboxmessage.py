@@ -0,0 +1,35 @@
+# Generated by Django 3.1.4 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0010_auto_20261018_1105'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('topic', models.CharField(help_text='消息主题', max_length=64)),
+                ('payload', models.JSONField(help_text='消息内容')),
+                ('datetime_created', models.DateTimeField(auto_now_add=True, help_text='创建时间')),
+                ('datetime_published', models.DateTimeField(help_text='投递到队列的时间', null=True)),
+                ('datetime_consumed', models.DateTimeField(help_text='消费完成时间', null=True)),
+            ],
+            options={
+                'db_table': 'blog_outbox_message',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='outboxmessage',
+            index=models.Index(fields=['datetime_published', 'id'], name='outbox_published_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='outboxmessage',
+            index=models.Index(fields=['datetime_consumed'], name='outbox_consumed_idx'),
+        ),
+    ]
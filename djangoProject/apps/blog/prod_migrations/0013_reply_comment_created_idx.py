@@ -0,0 +1,17 @@
+# Generated by Django 3.1.4 on 2026-10-18 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0012_comment_reply_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reply',
+            index=models.Index(fields=['comment', 'datetime_created', 'id'], name='reply_comment_created_idx'),
+        ),
+    ]
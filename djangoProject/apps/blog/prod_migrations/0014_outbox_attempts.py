@@ -0,0 +1,28 @@
+# Generated by Django 3.1.4 on 2026-10-18 17:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0013_reply_comment_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxmessage',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0, help_text='投递次数'),
+        ),
+        migrations.AddField(
+            model_name='outboxmessage',
+            name='datetime_failed',
+            field=models.DateTimeField(help_text='超过最大投递次数, 停止投递的时间', null=True),
+        ),
+        migrations.AddField(
+            model_name='outboxmessage',
+            name='error',
+            field=models.CharField(blank=True, default='', help_text='最近一次处理失败的原因', max_length=255),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 3.1.4 on 2026-10-18 17:40
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def backfill_reply_count(apps, schema_editor):
+    """
+    按评论 id 分批回填回复数, 回复数在 UPDATE 语句内计算
+    """
+    Comment = apps.get_model('blog', 'Comment')
+    Reply = apps.get_model('blog', 'Reply')
+    reply_count = Coalesce(models.Subquery(
+        Reply.objects.filter(
+            comment_id=models.OuterRef('id')
+        ).order_by().values('comment_id').annotate(count=models.Count('id')).values('count')[:1],
+        output_field=models.IntegerField()
+    ), 0)
+    last_id = 0
+    while True:
+        comment_ids = list(Comment.objects.filter(
+            id__gt=last_id
+        ).order_by('id').values_list('id', flat=True)[:1000])
+        if not comment_ids:
+            break
+        last_id = comment_ids[-1]
+        Comment.objects.filter(id__in=comment_ids).update(reply_count=reply_count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0014_outbox_attempts'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_reply_count, migrations.RunPython.noop),
+    ]
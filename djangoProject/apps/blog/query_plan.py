@@ -0,0 +1,93 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections
+from blog.models import Article, Comment, Activity
+
+
+class QueryPlanError(AssertionError):
+    pass
+
+
+def explain(queryset):
+    """
+    获得查询集执行计划
+    :param queryset:
+    :return: 每行一个字典
+    """
+    connection = connections[queryset.db]
+    sql, params = queryset.query.sql_with_params()
+    if connection.vendor == 'mysql':
+        statement = 'EXPLAIN ' + sql
+    elif connection.vendor == 'sqlite':
+        statement = 'EXPLAIN QUERY PLAN ' + sql
+    else:
+        raise QueryPlanError("不支持的数据库: {}".format(connection.vendor))
+    with connection.cursor() as cursor:
+        cursor.execute(statement, params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def find_plan_problems(queryset, plan):
+    """
+    检查执行计划中对主表的全表扫描与文件排序
+    :param queryset:
+    :param plan:
+    :return:
+    """
+    table = queryset.model._meta.db_table
+    problems = []
+    for row in plan:
+        if 'detail' in row:
+            detail = row['detail']
+            if detail.startswith('SCAN') and table in detail and 'USING' not in detail:
+                problems.append('full scan: {}'.format(detail))
+            if 'USE TEMP B-TREE FOR ORDER BY' in detail:
+                problems.append('filesort: {}'.format(detail))
+        else:
+            if row.get('table') == table and row.get('type') == 'ALL':
+                problems.append('full scan: {}'.format(table))
+            if 'Using filesort' in (row.get('Extra') or ''):
+                problems.append('filesort: {}'.format(row.get('table')))
+    return problems
+
+
+def assert_query_plan(queryset):
+    """
+    执行计划出现全表扫描或文件排序时抛出 QueryPlanError
+    :param queryset:
+    :return: 执行计划
+    """
+    plan = explain(queryset)
+    problems = find_plan_problems(queryset, plan)
+    if problems:
+        raise QueryPlanError('; '.join(problems))
+    return plan
+
+
+def get_endpoint_querysets(user_id=1, article_id=1, page_size=10):
+    """
+    各接口的主查询
+    :param user_id:
+    :param article_id:
+    :param page_size:
+    :return:
+    """
+    article_fields = ('id', 'datetime_created')
+    return [
+        ('article.list', Article.objects.only(*article_fields).order_by(
+            '-datetime_created'
+        )[:page_size]),
+        ('article.all_article_info', Article.objects.filter(publish_status=True).only(*article_fields).order_by(
+            '-datetime_created'
+        )[:page_size]),
+        ('article.all_article_info.cursor', Article.objects.filter(publish_status=True).only(*article_fields).order_by(
+            '-datetime_created', '-id'
+        )[:page_size + 1]),
+        ('article.user_articles', Article.objects.filter(user_id=user_id).only(*article_fields).order_by(
+            '-datetime_created'
+        )[:page_size]),
+        ('comment.list', Comment.objects.filter(article_id=article_id).only('id')[:page_size * 2]),
+        ('user.user_activity', Activity.objects.filter(
+            user_id=user_id, content_type=ContentType.objects.get_for_model(Article)
+        ).values_list('object_id', flat=True)[:page_size]),
+    ]
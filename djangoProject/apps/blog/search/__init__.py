@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.utils.module_loading import import_string
+from blog.clients import clients
+from blog.search.base import BaseSearchBackend, SearchBackendError, SearchBackendBusy
+
+DEFAULT_SEARCH_BACKEND = 'blog.search.elastic.ElasticsearchBackend'
+
+
+class SearchBackendProxy:
+    """
+    按 settings.SEARCH_BACKEND 延迟加载搜索后端, 导入时不连接 es
+    后端实例由客户端注册表按进程保存, fork 后重新创建
+    """
+
+    @staticmethod
+    def create_backend():
+        return import_string(getattr(settings, 'SEARCH_BACKEND', None) or DEFAULT_SEARCH_BACKEND)()
+
+    @property
+    def backend(self):
+        return clients.cached('search_backend', self.create_backend)
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+
+search_backend = SearchBackendProxy()
@@ -0,0 +1,136 @@
+import base64
+import binascii
+
+
+class SearchBackendError(Exception):
+    """
+    搜索后端写入或查询失败
+    """
+    pass
+
+
+class SearchBackendBusy(SearchBackendError):
+    """
+    搜索集群繁忙(es 返回 429), 调用方应稍后重试
+    """
+    pass
+
+
+class BaseSearchBackend:
+    """
+    搜索后端接口, 查询结果统一为 es 响应格式:
+    {"hits": {"total": {"value": 总数}, "hits": [{"_id": 文章id, "_source": {...}, "sort": [创建时间毫秒, 文章id]}]}}
+    """
+
+    def handle_search(self, article_id, search_word, publish_status, author):
+        """
+        文章设置搜索词
+        :param article_id:
+        :param search_word:
+        :param publish_status:
+        :param author:
+        :return:
+        """
+        raise NotImplementedError
+
+    def write_documents(self, sources, extra_indices=()):
+        """
+        批量写入文档
+        :param sources: {文章id: 文档}, 文档为 None 表示删除
+        :param extra_indices: 重建期间同时写入的索引, 仅 es 后端使用
+        :return: 写入失败的文章 id 集合
+        """
+        raise NotImplementedError
+
+    def update_author(self, user_id, old_author, requests_per_second=None):
+        """
+        在后台将按用户名索引作者的旧版文档转换为按 user_id 索引, 不等待完成
+        :param user_id:
+        :param old_author: 改名前的用户名
+        :param requests_per_second: 限速
+        :return: 后台任务 id, 没有需要处理的文档时为 None
+        """
+        raise NotImplementedError
+
+    def get_task(self, task_id):
+        """
+        查询后台任务进度
+        :param task_id:
+        :return: {"completed", "total", "updated", "noops", "conflicts", "retries", "failures", "error"}
+        """
+        raise NotImplementedError
+
+    def rethrottle_task(self, task_id, requests_per_second):
+        """
+        调整运行中后台任务的限速
+        :param task_id:
+        :param requests_per_second:
+        :return:
+        """
+        raise NotImplementedError
+
+    def query_search(self, search_word, page=1, page_size=10, user_ids=()):
+        """
+        文章查询搜索词
+        :param search_word:
+        :param page:
+        :param page_size:
+        :param user_ids: 用户名与搜索词匹配的作者, 其文章同样命中
+        :return: (结果, 总数)
+        """
+        raise NotImplementedError
+
+    def query_search_after(self, search_word, cursor=None, page_size=10, user_ids=()):
+        """
+        文章查询搜索词, 游标翻页
+        :param search_word:
+        :param cursor: 上一页返回的游标, 第一页为 None
+        :param page_size:
+        :param user_ids:
+        :return: (结果, 总数, 下一页游标)
+        """
+        raise NotImplementedError
+
+    def delete_search(self, article_id):
+        """
+        文章删除搜索词
+        :param article_id:
+        :return:
+        """
+        raise NotImplementedError
+
+    def suggest(self, prefix, size=10):
+        """
+        按前缀提示文章标题与作者名
+        :param prefix:
+        :param size:
+        :return: 提示文本列表
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def encode_search_cursor(sort_values):
+        """
+        游标编码 格式: 创建时间毫秒|文章id
+        :param sort_values:
+        :return:
+        """
+        raw = '{}|{}'.format(*sort_values)
+        return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def decode_search_cursor(cursor):
+        """
+        游标解码, 格式错误时抛出 ValueError
+        :param cursor:
+        :return:
+        """
+        try:
+            raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+            datetime_created, article_id = raw.split('|')
+            return [int(datetime_created), int(article_id)]
+        except (AttributeError, TypeError, UnicodeError, binascii.Error):
+            raise ValueError(cursor)
+
+    def get_next_cursor(self, hits, page_size):
+        return self.encode_search_cursor(hits[-1]['sort']) if len(hits) == page_size else None
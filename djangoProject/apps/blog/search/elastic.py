@@ -0,0 +1,257 @@
+import datetime
+
+from django.conf import settings
+from elasticsearch.exceptions import TransportError
+from elasticsearch.helpers import bulk
+from elasticsearch_dsl import Search, Document, Text, Boolean, Date, Keyword, Object, Integer, Long, Completion, Q
+from elasticsearch_dsl.connections import connections
+from blog.clients import clients
+from blog.constants import ARTICLE_INDEX, ARTICLE_INDEX_ALIAS, ARTICLE_INDEX_PREFIX, SEARCH_AUTHOR_SLICES
+from blog.search.base import BaseSearchBackend, SearchBackendError, SearchBackendBusy
+
+article_index = ARTICLE_INDEX_ALIAS
+
+
+class Article(Document):
+    search_word = Text(analyzer="ik_max_word")
+    # 旧版文档按用户名索引作者, 重建索引后不再写入
+    author = Text(fields={'raw': Keyword()})
+    # 作者只保存 id, 用户名在查询时补全, 改名无需更新文档
+    user_id = Long()
+    datetime_created = Date()
+    publish_status = Boolean()
+    # 排序用的文章 id, 避免对 _id 排序加载 fielddata
+    article_id = Long()
+    # 列表卡片, 只存储不索引, 搜索结果直接返回
+    card = Object(enabled=False)
+    card_version = Integer()
+    # 标题与作者名的搜索提示
+    suggest = Completion()
+
+    class Index:
+        name = article_index
+
+    def save(self, **kwargs):
+        self.datetime_created = datetime.datetime.now()
+        return super().save(**kwargs)
+
+
+def create_es_connection():
+    """
+    创建 es 客户端, 由客户端注册表在每个进程首次使用时调用
+    :return:
+    """
+    return connections.create_connection(
+        hosts=[settings.ES_URL],
+        http_auth=(settings.ES_USER, settings.ES_PASSWORD),
+        port=9200,
+        use_ssl=False
+    )
+
+
+def create_article_index(**index_settings):
+    """
+    按文档映射创建带版本号的文章索引
+    :param index_settings:
+    :return: 索引名
+    """
+    name = ARTICLE_INDEX_PREFIX + datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+    index = Article._index.clone(name=name)
+    if index_settings:
+        index.settings(**index_settings)
+    index.create(using=clients.get('es'))
+    return name
+
+
+def get_alias_indices():
+    """
+    获得读别名当前指向的索引
+    :return:
+    """
+    es = clients.get('es')
+    if not es.indices.exists_alias(name=article_index):
+        return []
+    return list(es.indices.get_alias(name=article_index).keys())
+
+
+def ensure_article_alias():
+    """
+    确保读别名存在: 已有旧版索引时直接指向它, 否则新建版本索引
+    部署时由 init_search_index 命令执行, 不在进程启动或导入时访问 es
+    :return:
+    """
+    es = clients.get('es')
+    if es.indices.exists_alias(name=article_index):
+        return
+    if es.indices.exists(index=ARTICLE_INDEX):
+        es.indices.put_alias(index=ARTICLE_INDEX, name=article_index)
+    else:
+        es.indices.put_alias(index=create_article_index(), name=article_index)
+
+
+def swap_article_alias(new_index):
+    """
+    原子地将读别名切换到新索引
+    :param new_index:
+    :return: 切换前指向的索引
+    """
+    old_indices = get_alias_indices()
+    actions = [{"remove": {"index": index, "alias": article_index}} for index in old_indices]
+    actions.append({"add": {"index": new_index, "alias": article_index}})
+    clients.get('es').indices.update_aliases(body={"actions": actions})
+    return old_indices
+
+
+class ElasticsearchBackend(BaseSearchBackend):
+
+    def __init__(self, client=None):
+        """
+        :param client: 指定 es 客户端, 默认使用注册表中当前进程的客户端
+        """
+        self._client = client
+        self.article = Article
+
+    @property
+    def client(self):
+        return self._client if self._client is not None else clients.get('es')
+
+    @staticmethod
+    def to_backend_error(error):
+        if error.status_code == 429:
+            return SearchBackendBusy(error)
+        return SearchBackendError(error)
+
+    def handle_search(self, article_id, search_word, publish_status, author):
+        article = self.article(
+            meta={'id': article_id},
+            author=author,
+            search_word=search_word,
+            publish_status=publish_status,
+        )
+        article.save(using=self.client)
+
+    def write_documents(self, sources, extra_indices=()):
+        indices = (article_index,) + tuple(extra_indices)
+        actions = []
+        for article_id, source in sources.items():
+            for index in indices:
+                if source is None:
+                    actions.append({'_op_type': 'delete', '_index': index, '_id': article_id})
+                else:
+                    actions.append({'_op_type': 'index', '_index': index, '_id': article_id, '_source': source})
+        try:
+            _, errors = bulk(self.client, actions, raise_on_error=False)
+        except TransportError as e:
+            raise SearchBackendError(e)
+
+        failed = set()
+        for error in errors:
+            op_type, info = next(iter(error.items()))
+            # 删除不存在的文档不算失败
+            if op_type == 'delete' and info.get('status') == 404:
+                continue
+            failed.add(int(info['_id']))
+        return failed
+
+    def update_author(self, user_id, old_author, requests_per_second=None):
+        body = {
+            # 按关键词子字段精确匹配, 避免 match_phrase 命中用户名相近的作者
+            "query": {
+                "bool": {
+                    "filter": [{"term": {"author.raw": old_author}}],
+                    "must_not": [{"exists": {"field": "user_id"}}],
+                }
+            },
+            "script": {
+                "source": "ctx._source.user_id = params.user_id; ctx._source.remove('author'); "
+                          "if (ctx._source.suggest != null) "
+                          "{ ctx._source.suggest.input.removeIf(text -> text == params.author) }",
+                "lang": "painless",
+                "params": {"user_id": user_id, "author": old_author},
+            },
+        }
+        try:
+            if not self.client.count(index=article_index, body={"query": body["query"]})['count']:
+                return None
+            res = self.client.update_by_query(
+                index=article_index,
+                body=body,
+                conflicts='proceed',
+                slices=SEARCH_AUTHOR_SLICES,
+                requests_per_second=requests_per_second or -1,
+                wait_for_completion=False,
+            )
+        except TransportError as e:
+            raise self.to_backend_error(e)
+        return res['task']
+
+    def get_task(self, task_id):
+        try:
+            res = self.client.tasks.get(task_id=task_id)
+        except TransportError as e:
+            raise self.to_backend_error(e)
+        status = res['task']['status']
+        retries = status.get('retries') or {}
+        return {
+            "completed": res.get('completed', False),
+            "total": status.get('total', 0),
+            "updated": status.get('updated', 0),
+            "noops": status.get('noops', 0),
+            "conflicts": status.get('version_conflicts', 0),
+            "retries": retries.get('bulk', 0) + retries.get('search', 0),
+            "failures": len((res.get('response') or {}).get('failures') or ()),
+            "error": (res.get('error') or {}).get('reason'),
+        }
+
+    def rethrottle_task(self, task_id, requests_per_second):
+        try:
+            self.client.update_by_query_rethrottle(task_id=task_id, requests_per_second=requests_per_second)
+        except TransportError as e:
+            raise self.to_backend_error(e)
+
+    def get_search(self, search_word, user_ids=()):
+        should = [Q("multi_match", query=search_word, fields=['author', 'search_word'])]
+        if user_ids:
+            should.append(Q("terms", user_id=list(user_ids)))
+        return Search(
+            using=self.client, index=article_index
+        ).query(
+            "bool", should=should, minimum_should_match=1
+        ).query(
+            "match_phrase", publish_status=True
+        ).sort(
+            {'datetime_created': 'desc'}, {'article_id': {'order': 'desc', 'unmapped_type': 'long'}}
+        ).source(
+            ['card', 'card_version', 'user_id']
+        ).extra(
+            track_total_hits=True
+        )
+
+    def query_search(self, search_word, page=1, page_size=10, user_ids=()):
+        search = self.get_search(search_word, user_ids)[(page - 1) * page_size: page * page_size]
+        res = search.execute()
+
+        return res.to_dict(), res.hits.total.value
+
+    def query_search_after(self, search_word, cursor=None, page_size=10, user_ids=()):
+        search = self.get_search(search_word, user_ids).extra(size=page_size)
+        if cursor is not None:
+            search = search.extra(search_after=self.decode_search_cursor(cursor))
+        res = search.execute().to_dict()
+
+        hits = res['hits']['hits']
+        return res, res['hits']['total']['value'], self.get_next_cursor(hits, page_size)
+
+    def delete_search(self, article_id):
+        search = self.article.get(id=article_id, using=self.client, ignore=404)
+        if search is not None:
+            search.delete(using=self.client)
+
+    def suggest(self, prefix, size=10):
+        res = Search(
+            using=self.client, index=article_index
+        ).suggest(
+            'article_suggest', prefix, completion={'field': 'suggest', 'size': size, 'skip_duplicates': True}
+        ).source(False).extra(size=0).execute()
+
+        return [option.text for option in res.suggest.article_suggest[0].options]
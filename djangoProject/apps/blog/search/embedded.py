@@ -0,0 +1,423 @@
+import calendar
+import datetime
+import fcntl
+import bisect
+import heapq
+import math
+import os
+import pickle
+import re
+import threading
+import unicodedata
+from array import array
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from blog.search.base import BaseSearchBackend
+
+CJK_RANGES = '぀-ヿ㐀-䶿一-鿿가-힯豈-﫿'
+CJK_PATTERN = re.compile('[{}]'.format(CJK_RANGES))
+TOKEN_PATTERN = re.compile('[{0}]+|[^\\W_{0}]+'.format(CJK_RANGES))
+
+
+def iter_runs(text):
+    """
+    按中日韩字符与其他文字切分, 统一全半角与大小写
+    :param text:
+    :return:
+    """
+    for match in TOKEN_PATTERN.finditer(unicodedata.normalize('NFKC', text).lower()):
+        word = match.group()
+        yield word, CJK_PATTERN.match(word) is not None
+
+
+def tokenize(text):
+    """
+    索引分词: 中日韩文字同时产生单字与二元组, 其他文字按词切分
+    :param text:
+    :return:
+    """
+    tokens = []
+    for word, is_cjk in iter_runs(text):
+        if is_cjk:
+            tokens.extend(word)
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word)
+    return tokens
+
+
+def tokenize_query(text):
+    """
+    查询分词: 中日韩文字只用二元组匹配, 单字查询才使用单字
+    :param text:
+    :return:
+    """
+    tokens = []
+    for word, is_cjk in iter_runs(text):
+        if is_cjk and len(word) > 1:
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word)
+    return tokens
+
+
+def to_millis(value):
+    """
+    时间转毫秒, 与 es 对不带时区时间的处理一致
+    :param value:
+    :return:
+    """
+    if value is None:
+        value = datetime.datetime.now()
+    return calendar.timegm(value.timetuple()) * 1000 + value.microsecond // 1000
+
+
+class InvertedIndex:
+    """
+    倒排索引: 每个词的倒排表为两个紧凑数组(文档序号, 词频)
+    删除与更新只标记旧文档, 删除数量较多时整体压缩
+    """
+    FIELDS = ('search_word',)
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self.article_ids = array('q')
+        self.created = array('q')
+        self.alive = bytearray()
+        self.published = bytearray()
+        self.user_ids = array('q')
+        self.user_docs = {}
+        self.cards = []
+        self.lengths = {field: array('I') for field in self.FIELDS}
+        self.total_lengths = dict.fromkeys(self.FIELDS, 0)
+        self.postings = {field: {} for field in self.FIELDS}
+        self.suggest_inputs = []
+        self.docs = {}
+        self.dead = 0
+        self.suggestions = None
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add_postings(self, field, docnum, terms):
+        postings = self.postings[field]
+        for term, frequency in terms.items():
+            entry = postings.get(term)
+            if entry is None:
+                entry = postings[term] = (array('I'), array('I'))
+            entry[0].append(docnum)
+            entry[1].append(frequency)
+
+    def add(self, article_id, source):
+        """
+        写入文档, 已存在时替换
+        :param article_id:
+        :param source: 与 es 文档字段一致
+        :return:
+        """
+        self.remove(article_id)
+        docnum = len(self.article_ids)
+        self.article_ids.append(article_id)
+        self.created.append(to_millis(source.get('datetime_created')))
+        self.alive.append(1)
+        self.published.append(1 if source.get('publish_status') else 0)
+        user_id = source.get('user_id') or 0
+        self.user_ids.append(user_id)
+        self.user_docs.setdefault(user_id, array('I')).append(docnum)
+        self.cards.append((source.get('card'), source.get('card_version')))
+        self.suggest_inputs.append(tuple((source.get('suggest') or {}).get('input') or ()))
+        for field in self.FIELDS:
+            terms = Counter(tokenize(source.get(field) or ''))
+            length = sum(terms.values())
+            self.lengths[field].append(length)
+            self.total_lengths[field] += length
+            self.add_postings(field, docnum, terms)
+        self.docs[article_id] = docnum
+        self.suggestions = None
+
+    def remove(self, article_id):
+        """
+        标记删除文档
+        :param article_id:
+        :return:
+        """
+        docnum = self.docs.pop(article_id, None)
+        if docnum is None:
+            return False
+        self.alive[docnum] = 0
+        self.cards[docnum] = None
+        self.suggest_inputs[docnum] = ()
+        self.suggestions = None
+        for field in self.FIELDS:
+            self.total_lengths[field] -= self.lengths[field][docnum]
+        self.dead += 1
+        return True
+
+    def compact(self, force=False):
+        """
+        删除标记超过存活文档四分之一时重新编号, 回收倒排表空间
+        :param force:
+        :return:
+        """
+        if not force and self.dead <= max(1000, len(self.docs) // 4):
+            return
+        mapping = {}
+        for docnum, alive in enumerate(self.alive):
+            if alive:
+                mapping[docnum] = len(mapping)
+        old_docs = sorted(mapping)
+        self.article_ids = array('q', (self.article_ids[docnum] for docnum in old_docs))
+        self.created = array('q', (self.created[docnum] for docnum in old_docs))
+        self.published = bytearray(self.published[docnum] for docnum in old_docs)
+        self.alive = bytearray(b'\x01' * len(old_docs))
+        self.user_ids = array('q', (self.user_ids[docnum] for docnum in old_docs))
+        self.user_docs = {}
+        for docnum, user_id in enumerate(self.user_ids):
+            self.user_docs.setdefault(user_id, array('I')).append(docnum)
+        self.cards = [self.cards[docnum] for docnum in old_docs]
+        self.suggest_inputs = [self.suggest_inputs[docnum] for docnum in old_docs]
+        for field in self.FIELDS:
+            self.lengths[field] = array('I', (self.lengths[field][docnum] for docnum in old_docs))
+            postings = {}
+            for term, (docnums, frequencies) in self.postings[field].items():
+                pairs = [(mapping[docnum], frequency) for docnum, frequency in zip(docnums, frequencies)
+                         if docnum in mapping]
+                if pairs:
+                    postings[term] = (array('I', (pair[0] for pair in pairs)), array('I', (pair[1] for pair in pairs)))
+            self.postings[field] = postings
+        self.docs = {article_id: docnum for docnum, article_id in enumerate(self.article_ids)}
+        self.dead = 0
+
+    def score(self, query, user_ids=()):
+        """
+        BM25 打分, 多字段取最高分, 只返回已发布文档
+        文档数与文档频率都包含未压缩的删除文档, 与 es 段合并前的行为一致
+        :param query:
+        :param user_ids: 这些作者的文章额外加 1 分, 与 es 的 terms 子句一致
+        :return: {文档序号: 分数}
+        """
+        terms = set(tokenize_query(query))
+        total = len(self.article_ids)
+        scores = {}
+        if not self.docs:
+            return scores
+        alive = self.alive
+        published = self.published
+        for field in self.FIELDS:
+            postings = self.postings[field]
+            lengths = self.lengths[field]
+            average_length = self.total_lengths[field] / len(self.docs) or 1
+            field_scores = defaultdict(float)
+            for term in terms:
+                entry = postings.get(term)
+                if entry is None:
+                    continue
+                docnums, frequencies = entry
+                idf = math.log(1 + (total - len(docnums) + 0.5) / (len(docnums) + 0.5))
+                for docnum, frequency in zip(docnums, frequencies):
+                    if alive[docnum] and published[docnum]:
+                        norm = frequency + self.K1 * (1 - self.B + self.B * lengths[docnum] / average_length)
+                        field_scores[docnum] += idf * frequency * (self.K1 + 1) / norm
+            for docnum, field_score in field_scores.items():
+                if docnum not in scores or field_score > scores[docnum]:
+                    scores[docnum] = field_score
+        for user_id in user_ids:
+            for docnum in self.user_docs.get(user_id, ()):
+                if alive[docnum] and published[docnum]:
+                    scores[docnum] = scores.get(docnum, 0) + 1.0
+        return scores
+
+    def search(self, query, offset=0, limit=10, search_after=None, by_score=False, user_ids=()):
+        """
+        查询, 默认与 es 后端一致按创建时间倒序, by_score 为真时按相关度排序
+        :param query:
+        :param offset:
+        :param limit:
+        :param search_after: [创建时间毫秒, 文章id]
+        :param by_score:
+        :param user_ids:
+        :return: (总数, es 格式的命中列表)
+        """
+        scores = self.score(query, user_ids)
+        created = self.created
+        article_ids = self.article_ids
+
+        def sort_key(docnum):
+            return created[docnum], article_ids[docnum]
+
+        if by_score:
+            candidates = scores
+            key = scores.__getitem__
+        elif search_after is not None:
+            boundary = tuple(search_after)
+            candidates = [docnum for docnum in scores if sort_key(docnum) < boundary]
+            key = sort_key
+        else:
+            candidates = scores
+            key = sort_key
+        top = heapq.nlargest(offset + limit, candidates, key=key)[offset:]
+
+        hits = []
+        for docnum in top:
+            card, card_version = self.cards[docnum]
+            hits.append({
+                '_id': str(article_ids[docnum]),
+                '_score': scores[docnum],
+                '_source': {'card': card, 'card_version': card_version, 'user_id': self.user_ids[docnum]},
+                'sort': [created[docnum], article_ids[docnum]],
+            })
+        return len(scores), hits
+
+    def suggest(self, prefix, size=10):
+        """
+        前缀提示: 所有提示文本规范化后排序, 二分查找前缀起点
+        :param prefix:
+        :param size:
+        :return:
+        """
+        if self.suggestions is None:
+            self.suggestions = sorted({
+                (unicodedata.normalize('NFKC', text).lower(), text)
+                for inputs in self.suggest_inputs for text in inputs if text
+            })
+        prefix = unicodedata.normalize('NFKC', prefix).lower()
+        results = []
+        position = bisect.bisect_left(self.suggestions, (prefix,))
+        for key, text in self.suggestions[position:]:
+            if not key.startswith(prefix) or len(results) == size:
+                break
+            if text not in results:
+                results.append(text)
+        return results
+
+    def save(self, path):
+        """
+        写入快照, 先写临时文件再替换, 读取方不会读到写了一半的文件
+        :param path:
+        :return:
+        """
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'wb') as f:
+            pickle.dump(dict(self.__dict__, suggestions=None), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        with open(path, 'rb') as f:
+            index.__dict__.update(pickle.load(f))
+        if len(index.suggest_inputs) < len(index.article_ids):
+            # 旧版快照没有提示数据
+            index.suggest_inputs = [()] * len(index.article_ids)
+        if len(index.user_ids) < len(index.article_ids):
+            # 旧版快照按用户名索引作者, 作者名搜索在重建索引后恢复
+            index.user_ids = array('q', bytes(8 * len(index.article_ids)))
+            index.__dict__.pop('authors', None)
+            for mapping in (index.postings, index.lengths, index.total_lengths):
+                mapping.pop('author', None)
+        return index
+
+
+class EmbeddedSearchBackend(BaseSearchBackend):
+    """
+    进程内搜索后端, 适用于没有 es 的测试环境与小规模部署
+    索引保存为磁盘快照, 写入时加文件锁, 各进程在快照修改后重新加载
+    """
+
+    def __init__(self, path=None):
+        self.path = str(path or settings.SEARCH_INDEX_PATH)
+        self.index = None
+        self.mtime = None
+        self.write_lock = threading.Lock()
+
+    def get_index(self):
+        """
+        获得索引, 快照文件有变化时重新加载
+        :return:
+        """
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if self.index is None or mtime != self.mtime:
+            self.index = InvertedIndex.load(self.path) if mtime is not None else InvertedIndex()
+            self.mtime = mtime
+        return self.index
+
+    @contextmanager
+    def writing(self, index=None):
+        """
+        写入上下文: 持有文件锁, 以最新快照为基础修改, 结束后保存
+        :param index: 整体替换时传入新索引
+        :return:
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self.write_lock, open(self.path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                index = index if index is not None else self.get_index()
+                yield index
+                index.compact()
+                index.save(self.path)
+                self.index = index
+                self.mtime = os.stat(self.path).st_mtime_ns
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def handle_search(self, article_id, search_word, publish_status, author):
+        with self.writing() as index:
+            index.add(article_id, {
+                'search_word': search_word,
+                'author': author,
+                'publish_status': publish_status,
+                'article_id': article_id,
+            })
+
+    def write_documents(self, sources, extra_indices=()):
+        with self.writing() as index:
+            for article_id, source in sources.items():
+                if source is None:
+                    index.remove(article_id)
+                else:
+                    index.add(article_id, source)
+        return set()
+
+    def rebuild(self, sources):
+        """
+        由全部文档重新生成索引并替换快照
+        :param sources: 可迭代的 (文章id, 文档)
+        :return: 文档数
+        """
+        index = InvertedIndex()
+        for article_id, source in sources:
+            index.add(article_id, source)
+        with self.writing(index):
+            pass
+        return len(index)
+
+    def update_author(self, user_id, old_author, requests_per_second=None):
+        # 旧版快照加载时已丢弃作者名数据, 没有需要转换的文档
+        return None
+
+    def query_search(self, search_word, page=1, page_size=10, user_ids=()):
+        total, hits = self.get_index().search(
+            search_word, offset=(page - 1) * page_size, limit=page_size, user_ids=user_ids
+        )
+        return {'hits': {'total': {'value': total}, 'hits': hits}}, total
+
+    def query_search_after(self, search_word, cursor=None, page_size=10, user_ids=()):
+        search_after = self.decode_search_cursor(cursor) if cursor is not None else None
+        total, hits = self.get_index().search(
+            search_word, limit=page_size, search_after=search_after, user_ids=user_ids
+        )
+        return {'hits': {'total': {'value': total}, 'hits': hits}}, total, self.get_next_cursor(hits, page_size)
+
+    def delete_search(self, article_id):
+        with self.writing() as index:
+            index.remove(article_id)
+
+    def suggest(self, prefix, size=10):
+        return self.get_index().suggest(prefix, size)
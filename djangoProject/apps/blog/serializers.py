@@ -1,9 +1,10 @@
 from django.core.exceptions import ObjectDoesNotExist
-from django.db.models import Prefetch, Count
+from django.db.models import Prefetch
 from rest_framework import serializers
 from rest_framework.utils import model_meta
+from blog.constants import REPLY_PREVIEW_SIZE
 from blog.models import User, Article, Category, Reply, Comment, ArticleImages, Tag
-from blog.tasks import set_attached_picture
+from blog.outbox import publish
 
 
 class BlogUserSerializers(serializers.ModelSerializer):
@@ -117,7 +118,7 @@ class CommentSerializers(serializers.ModelSerializer, UserSerializerMixin):
     user_info = serializers.SerializerMethodField(read_only=True)
     article_id = serializers.IntegerField(write_only=True)
     reply = serializers.SerializerMethodField(read_only=True)
-    reply_count = serializers.SerializerMethodField(read_only=True)
+    reply_count = serializers.IntegerField(read_only=True)
     datetime_created = serializers.DateTimeField(format='%Y年%m月%d日 %H时:%M分:%S秒', read_only=True)
 
     @classmethod
@@ -125,24 +126,16 @@ class CommentSerializers(serializers.ModelSerializer, UserSerializerMixin):
         return cls.Meta.model.objects.select_related('user').prefetch_related(
             Prefetch('replies', queryset=Reply.objects.only(
                 'to_user__icon', 'to_user__username', 'user__username', 'comment_id'
-            ))
-        ).annotate(
-            reply_count=Count(
-                'reply'
-            )
+            ).order_by('-datetime_created', '-id'))
         ).only(
-            'user__icon', 'user__username', 'datetime_created', 'article_id', 'user_id', 'content'
+            'user__icon', 'user__username', 'datetime_created', 'article_id', 'user_id', 'content', 'reply_count'
         )
 
-    @staticmethod
-    def get_reply_count(obj):
-        return obj.reply_count
-
     @staticmethod
     def get_reply(obj):
         return_list = []
         try:
-            for reply in obj.replies.all():
+            for reply in obj.replies.all()[:REPLY_PREVIEW_SIZE]:
                 return_list.append({
                     "to_user_id": reply.to_user.username,
                     "to_user_icon": reply.to_user.icon,
@@ -221,7 +214,10 @@ class ArticleSerializers(serializers.ModelSerializer, AttachedSerializersMixin,
         )
         instance.save()
         if self.initial_data.get('images', None) is not None:
-            set_attached_picture.delay(self.initial_data['images'], "article", instance.id)
+            publish(
+                'set_attached_picture',
+                images=self.initial_data['images'], attached_table="article", attached_id=instance.id
+            )
         if many_to_many:
             for field_name, value in many_to_many.items():
                 field = getattr(instance, field_name)
@@ -246,7 +242,10 @@ class ArticleSerializers(serializers.ModelSerializer, AttachedSerializersMixin,
                 setattr(instance, attr, value)
 
         if self.initial_data.get('images', None) is not None:
-            set_attached_picture.delay(self.initial_data['images'], "article", instance.id)
+            publish(
+                'set_attached_picture',
+                images=self.initial_data['images'], attached_table="article", attached_id=instance.id
+            )
 
         instance.save(update_fields=update_fields)
         for attr, value in m2m_fields:
@@ -278,6 +277,29 @@ class SimpleArticleSerializer(ArticleSerializers, TagMixin):
         ]
 
 
+class ArticleExcerptSerializer(ArticleSerializers, TagMixin):
+    tags = serializers.SerializerMethodField(read_only=True)
+
+    @classmethod
+    def get_instance(cls):
+        return cls.Meta.model.objects.select_related(
+            'category'
+        ).prefetch_related(
+            Prefetch('images', queryset=ArticleImages.objects.only(
+                'id', 'image', 'article_id'
+            )), Prefetch('tag')
+        ).only(
+            'id', 'title', 'datetime_created', 'excerpt', 'content_length', 'tag',
+            'datetime_update', 'category__category'
+        )
+
+    class Meta(ArticleMeta):
+        fields = [
+            'id', 'title', 'attached_pictures', 'datetime_created',
+            'category_name', 'excerpt', 'content_length', 'tags', 'datetime_update'
+        ]
+
+
 class SimpleArticleUserSerializer(ArticleSerializers, TagMixin):
     tags = serializers.SerializerMethodField(read_only=True)
 
@@ -1,42 +1,140 @@
-from django.db.models.signals import pre_save, pre_delete, post_save
+from django.db.models.signals import pre_save, pre_delete, post_save, post_delete, m2m_changed
+from django.db import transaction
+from django.db.models import F
 from django.dispatch import receiver
-from blog.models import Article, Comment, User, ReceiveMessage
-from blog.tasks import search_article, delete_attached_picture, synchronous_username
+from blog.cache import invalidate_article, invalidate_articles, invalidate_author, invalidate_comments, \
+    touch_article, invalidate_author_name
+from blog.counter import count_cache
+from blog.models import Article, Comment, User, ReceiveMessage, ArticleImages, TagShip, Category, Reply
+from blog.outbox import publish
+from blog.threads import comment_thread_cache
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
 
 
-@receiver(post_save, sender=Article)
-def post_search_article(**kwargs):
+@receiver(pre_delete, sender=Article)
+def delete_article_pictures(**kwargs):
     instance = kwargs['instance']
-    created = kwargs['created']
-    if created:
-        search_article.delay(
-            instance.id, instance.content, instance.title, None, instance.publish_status, instance.user.username
-        )
+    publish('delete_attached_picture', attached_table="article", attached_id=instance.id)
 
 
-@receiver(pre_save, sender=Article)
-def put_search_article(**kwargs):
+@receiver(pre_delete, sender=Comment)
+def delete_comment_replies(**kwargs):
+    instance = kwargs['instance']
+    publish('delete_reply', instance_id=instance.id)
+
+
+@receiver(post_save, sender=Article)
+@receiver(post_save, sender=Comment)
+def post_save_count(sender, **kwargs):
     instance = kwargs['instance']
     update_fields = kwargs['update_fields']
-    check = ['content', 'title']
-    if instance.id is not None and update_fields is not None and any([info in update_fields for info in check]):
-        search_article.delay(
-            instance.id, instance.content, instance.title, None, instance.publish_status, instance.user.username
-        )
+    if kwargs['created']:
+        count_cache.incr_instance(instance, 1)
+    elif update_fields is None or count_cache.signature_fields(sender) & {
+        sender._meta.get_field(field).attname for field in update_fields
+    }:
+        count_cache.invalidate(sender)
 
 
 @receiver(pre_delete, sender=Article)
-def delete_article_pictures(**kwargs):
+@receiver(pre_delete, sender=Comment)
+def pre_delete_count(**kwargs):
     instance = kwargs['instance']
-    delete_attached_picture.delay("article", instance.id)
+    count_cache.incr_instance(instance, -1)
 
 
-@receiver(pre_delete, sender=Comment)
-def delete_reply(**kwargs):
+@receiver(post_save, sender=Article)
+@receiver(post_delete, sender=Article)
+def article_response_cache(**kwargs):
+    instance = kwargs['instance']
+    invalidate_article(instance.id)
+
+
+@receiver(post_save, sender=ArticleImages)
+@receiver(post_delete, sender=ArticleImages)
+@receiver(post_save, sender=TagShip)
+@receiver(post_delete, sender=TagShip)
+def article_relation_response_cache(**kwargs):
+    instance = kwargs['instance']
+    touch_article(instance.article_id)
+    invalidate_article(instance.article_id)
+
+
+@receiver(m2m_changed, sender=TagShip)
+def article_tag_response_cache(**kwargs):
+    instance = kwargs['instance']
+    if kwargs['action'] in ('post_add', 'post_remove', 'post_clear'):
+        if isinstance(instance, Article):
+            article_ids = [instance.id]
+        else:
+            article_ids = kwargs['pk_set'] or ()
+        for article_id in article_ids:
+            touch_article(article_id)
+            invalidate_article(article_id)
+
+
+def refresh_comment_thread(article_id):
+    """
+    提交后按最新数据重写已缓存的评论列表
+    :param article_id:
+    :return:
+    """
+    if article_id is not None:
+        transaction.on_commit(lambda: comment_thread_cache.refresh(article_id, only_cached=True))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_response_cache(**kwargs):
+    instance = kwargs['instance']
+    refresh_comment_thread(invalidate_comments(article_id=instance.article_id))
+
+
+@receiver(post_save, sender=Reply)
+def post_save_reply_count(**kwargs):
+    instance = kwargs['instance']
+    if kwargs['created']:
+        Comment.objects.filter(
+            id=instance.comment_id
+        ).update(
+            reply_count=F('reply_count') + 1
+        )
+
+
+@receiver(post_delete, sender=Reply)
+def post_delete_reply_count(**kwargs):
+    # 包括删除评论后异步删除其全部回复, 此时评论已不存在, 更新不影响任何行
+    instance = kwargs['instance']
+    Comment.objects.filter(
+        id=instance.comment_id, reply_count__gt=0
+    ).update(
+        reply_count=F('reply_count') - 1
+    )
+
+
+@receiver(post_save, sender=Reply)
+@receiver(post_delete, sender=Reply)
+def reply_response_cache(**kwargs):
+    instance = kwargs['instance']
+    refresh_comment_thread(invalidate_comments(comment_id=instance.comment_id))
+
+
+@receiver(post_save, sender=User)
+def author_response_cache(**kwargs):
+    instance = kwargs['instance']
+    update_fields = kwargs['update_fields']
+    if kwargs['created']:
+        invalidate_author_name(instance.username)
+    elif update_fields is None or {'username', 'icon'} & set(update_fields):
+        invalidate_author(instance.id, instance.username)
+
+
+@receiver(post_save, sender=Category)
+def category_response_cache(**kwargs):
     instance = kwargs['instance']
-    delete_reply.delay(instance.id)
+    if not kwargs['created']:
+        invalidate_articles({'category_id': instance.id})
 
 
 @receiver(pre_save, sender=User)
@@ -45,10 +143,14 @@ def article_synchronous_username(**kwargs):
     update_fields = kwargs['update_fields']
     check = ['username']
     if instance.id is not None and update_fields is not None and any([info in update_fields for info in check]):
-        old_instance = User.objects.filter(
+        old_username = User.objects.filter(
             id=instance.id
-        ).only('username').first()
-        synchronous_username.delay(old_instance.username, instance.username)
+        ).values_list('username', flat=True).first()
+        if old_username is not None and old_username != instance.username:
+            publish(
+                'synchronous_username',
+                old_username=old_username, new_username=instance.username, user_id=instance.id
+            )
 
 
 @receiver(post_save, sender=ReceiveMessage)
@@ -0,0 +1,91 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from blog.authors import author_store
+from blog.cache import normalize_keywords
+from blog.clients import LazyClient
+from blog.constants import REDIS_KEY, SUGGEST_LRU_SIZE, SUGGEST_LOCAL_TIMEOUT, SUGGEST_CACHE_TIMEOUT, \
+    SUGGEST_MAX_PREFIX, SUGGEST_SIZE
+from blog.encoders import encode_response
+from blog.errcode import ARTICLE_SUGGEST
+from blog.search import search_backend
+
+
+class SuggestCache:
+    """
+    搜索提示缓存: 进程内 LRU 在前, Redis 在后, 均未命中时才查询搜索后端
+    提示允许短时间过期, 不随索引写入失效
+    """
+    redis = LazyClient('raw_redis')
+
+    def __init__(self, size=SUGGEST_LRU_SIZE, local_timeout=SUGGEST_LOCAL_TIMEOUT, timeout=SUGGEST_CACHE_TIMEOUT):
+        self.size = size
+        self.local_timeout = local_timeout
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_local(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, content = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return content
+
+    def set_local(self, key, content):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.local_timeout, content)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def get_or_build(self, prefix, builder):
+        """
+        读取提示响应
+        :param prefix: 规范化后的前缀
+        :param builder: 返回响应字节的函数
+        :return:
+        """
+        key = REDIS_KEY['suggest_key'].format(hashlib.md5(prefix.encode('utf-8')).hexdigest())
+        content = self.get_local(key)
+        if content is None:
+            content = self.redis.get(key)
+            if content is None:
+                content = builder()
+                self.redis.set(key, content, ex=self.timeout)
+            self.set_local(key, content)
+        return content
+
+
+suggest_cache = SuggestCache()
+
+
+def build_suggest(prefix):
+    """
+    生成搜索提示响应, 文章标题来自搜索后端, 作者名来自数据库
+    :param prefix:
+    :return:
+    """
+    suggestions = []
+    if prefix:
+        suggestions = list(dict.fromkeys(
+            search_backend.suggest(prefix, SUGGEST_SIZE) + author_store.suggest(prefix, SUGGEST_SIZE)
+        ))[:SUGGEST_SIZE]
+    return encode_response(ARTICLE_SUGGEST.with_data({"suggestions": suggestions}))
+
+
+def get_suggest(keywords):
+    """
+    获得搜索提示响应字节
+    :param keywords:
+    :return:
+    """
+    prefix = normalize_keywords(keywords)[:SUGGEST_MAX_PREFIX]
+    return suggest_cache.get_or_build(prefix, lambda: build_suggest(prefix))
@@ -3,8 +3,14 @@ from celery.schedules import crontab
 from django.db.models import Q
 from rest_framework import serializers
 from djangoProject.celery import app as current_app
-from blog.models import Reply, ArticleImages
-from blog.utils import es_search, logger, robot_send_alert
+from blog.cache import invalidate_article, touch_article, response_cache
+from blog.constants import SEARCH_INDEX_DRAIN_INTERVAL, OUTBOX_RELAY_INTERVAL, SEARCH_AUTHOR_RPS, \
+    SEARCH_AUTHOR_MIN_RPS, SEARCH_AUTHOR_POLL_INTERVAL, SEARCH_AUTHOR_MAX_POLL_INTERVAL
+from blog.indexer import search_index_queue, author_update_progress
+from blog.models import Reply, ArticleImages, User
+from blog.outbox import relay, consume, purge
+from blog.search import search_backend, SearchBackendError, SearchBackendBusy
+from blog.utils import logger, robot_send_alert
 
 
 class ArticleImagesSerializers(serializers.ModelSerializer):
@@ -32,7 +38,19 @@ def search_article(article_id, content, title, tag, publish_status, author):
     search_word = content + title
     if tag is not None:
         search_word += tag
-    es_search.handle_search(article_id, search_word, publish_status, author)
+    search_backend.handle_search(article_id, search_word, publish_status, author)
+
+
+@current_app.task(name='blog_signal.drain_search_index')
+def drain_search_index():
+    """
+    批量写入待索引文章, 有写入时使搜索结果缓存失效
+    :return:
+    """
+    indexed = search_index_queue.drain()
+    if indexed:
+        response_cache.bump('search')
+    return indexed
 
 
 @current_app.task(name='blog_signal.delete_attached_picture')
@@ -49,7 +67,7 @@ def delete_attached_picture(attached_table, attached_id):
                 'article_id': attached_id
             }
         )
-        es_search.delete_search(article_id=attached_id)
+        search_backend.delete_search(article_id=attached_id)
     else:
         logger.info(
             "删除附属图片传输数据错误"
@@ -69,15 +87,91 @@ def delete_reply(instance_id):
     ).delete()
 
 
+def get_backoff(attempt):
+    return min(SEARCH_AUTHOR_MAX_POLL_INTERVAL, SEARCH_AUTHOR_POLL_INTERVAL * 2 ** attempt)
+
+
 @current_app.task(name='blog_signal.synchronous_username')
-def synchronous_username(old_username, new_username):
+def synchronous_username(old_username, new_username, user_id=None, attempt=0):
     """
-    搜索引擎搜索内容同步用户名修改
+    改名后在 es 后台切片限速地将旧版文档(按用户名索引作者)转换为按 user_id 索引
+    只启动任务不等待完成, 进度由 poll_author_update 轮询; 集群繁忙时延迟重试
     :param old_username:
     :param new_username:
+    :param user_id: 升级前写入的消息没有 user_id, 按新用户名查询
+    :param attempt:
+    :return:
+    """
+    if user_id is None:
+        user_id = User.objects.filter(username=new_username).values_list('id', flat=True).first()
+        if user_id is None:
+            return None
+    try:
+        task_id = search_backend.update_author(user_id, old_username, SEARCH_AUTHOR_RPS)
+    except SearchBackendBusy:
+        countdown = get_backoff(attempt)
+        logger.info("搜索集群繁忙, {} 秒后重试作者 {} 的文档转换".format(countdown, user_id))
+        synchronous_username.apply_async(kwargs={
+            'old_username': old_username,
+            'new_username': new_username,
+            'user_id': user_id,
+            'attempt': attempt + 1,
+        }, countdown=countdown)
+        return None
+    if task_id is None:
+        return None
+    author_update_progress.start(user_id, task_id, old_username, SEARCH_AUTHOR_RPS)
+    poll_author_update.apply_async((user_id, task_id), countdown=SEARCH_AUTHOR_POLL_INTERVAL)
+    return task_id
+
+
+@current_app.task(name='blog_signal.poll_author_update')
+def poll_author_update(user_id, task_id, attempt=0):
+    """
+    轮询作者文档转换任务并记录进度
+    es 重试次数增加说明批次被拒绝, 此时减半限速并延长轮询间隔
+    :param user_id:
+    :param task_id:
+    :param attempt: 连续退避次数
     :return:
     """
-    es_search.update_search_by_author(old_username, new_username)
+    progress = author_update_progress.get(user_id)
+    if progress.get('task_id') != task_id or progress.get('status') != 'running':
+        # 进度已过期或被之后的改名覆盖
+        return None
+    try:
+        status = search_backend.get_task(task_id)
+    except SearchBackendError as e:
+        countdown = get_backoff(attempt + 1)
+        logger.info("查询作者文档转换任务失败, {} 秒后重试: {}".format(countdown, e))
+        poll_author_update.apply_async((user_id, task_id, attempt + 1), countdown=countdown)
+        return None
+
+    completed = status.pop('completed')
+    error = status.pop('error')
+    if completed:
+        result = 'failed' if error or status['failures'] else 'done'
+        author_update_progress.update(user_id, status=result, error=error, **status)
+        if result == 'failed':
+            logger.error("作者 {} 的文档转换失败: {}".format(user_id, error or status['failures']))
+        response_cache.bump('search')
+        return result
+
+    requests_per_second = float(progress['rps'])
+    if status['retries'] > int(progress.get('retries') or 0):
+        attempt += 1
+        if requests_per_second > SEARCH_AUTHOR_MIN_RPS:
+            requests_per_second = max(SEARCH_AUTHOR_MIN_RPS, requests_per_second / 2)
+            try:
+                search_backend.rethrottle_task(task_id, requests_per_second)
+            except SearchBackendError as e:
+                logger.info("调整作者文档转换限速失败: {}".format(e))
+                requests_per_second = float(progress['rps'])
+    else:
+        attempt = 0
+    author_update_progress.update(user_id, rps=requests_per_second, **status)
+    poll_author_update.apply_async((user_id, task_id, attempt), countdown=get_backoff(attempt))
+    return None
 
 
 @current_app.task(name='blog_signal.set_attached_picture')
@@ -147,6 +241,55 @@ def set_attached_picture(images, attached_table, attached_id):
                 old_instance, fields=['image']
             )
 
+    # 批量写入不触发信号, 需手动使缓存失效
+    touch_article(attached_id)
+    invalidate_article(attached_id)
+
+
+def push_search_index(article_ids):
+    """
+    文章 id 进入搜索索引队列, 重复入队会合并
+    :param article_ids:
+    :return:
+    """
+    search_index_queue.push(*article_ids)
+
+
+# 发件箱主题对应的处理函数, 消息可能重复投递, 处理函数需可重复执行
+OUTBOX_HANDLERS = {
+    'search_index': push_search_index,
+    'delete_attached_picture': delete_attached_picture,
+    'delete_reply': delete_reply,
+    'synchronous_username': synchronous_username,
+    'set_attached_picture': set_attached_picture,
+}
+
+
+@current_app.task(name='blog_signal.consume_outbox')
+def consume_outbox(message_ids):
+    """
+    处理一批发件箱消息
+    :param message_ids:
+    :return:
+    """
+    return consume(message_ids, OUTBOX_HANDLERS)
+
+
+@current_app.task(name='blog_signal.relay_outbox')
+def relay_outbox():
+    """
+    将已提交的发件箱消息按批投递到队列, 并清理过期消息
+    :return:
+    """
+    relayed = 0
+    while True:
+        count = relay(consume_outbox.delay)
+        relayed += count
+        if not count:
+            break
+    purge()
+    return relayed
+
 
 @current_app.task(name='blog_daily.morning_message')
 def morning_message():
@@ -176,3 +319,13 @@ def setup_periodic_tasks(sender, **kwargs):
         crontab(minute=9, hour=23),
         night_message(),
     )
+
+    sender.add_periodic_task(
+        SEARCH_INDEX_DRAIN_INTERVAL,
+        drain_search_index.s(),
+    )
+
+    sender.add_periodic_task(
+        OUTBOX_RELAY_INTERVAL,
+        relay_outbox.s(),
+    )
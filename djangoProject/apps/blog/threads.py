@@ -0,0 +1,218 @@
+import random
+import time
+import uuid
+from collections import OrderedDict
+
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+from blog.authors import author_store
+from blog.cache import ResponseCache, comment_thread_key
+from blog.clients import LazyClient, LazyScript
+from blog.compiled_serializers import comment_thread_serializer
+from blog.constants import REDIS_KEY, COMMENT_THREAD_PAGES, COMMENT_THREAD_TIMEOUT, COMMENT_THREAD_VERSION_TIMEOUT, \
+    RESPONSE_CACHE_LOCK_TIMEOUT, RESPONSE_CACHE_LOCK_WAIT, COMMENT_THREAD_METRICS_SAMPLE, COMMENT_THREAD_METRICS_DAYS
+from blog.counter import count_cache
+from blog.encoders import encode_response, RawJSON
+from blog.models import Comment
+from blog.utils import TwentyPagination
+
+
+class CommentThreadCache:
+    """
+    评论列表缓存: 每篇文章前几页评论(含回复预览与用户信息)预先编码后存入一个哈希
+    评论或回复变化时按最新数据重写(write-through)而不是删除, 连续评论不会造成集中回源
+    重写前递增生成序号, 并发重写时先读数据库的旧结果不会覆盖后读的新结果
+    页中的用户名与头像为占位, 读取时由 author_store 补全, 作者信息变化不影响缓存
+    未命中时由持有锁的请求生成, 其余请求等待结果
+    """
+    WRITE_SCRIPT = """
+    local current = redis.call('hget', KEYS[1], 'version')
+    if ARGV[3] == '1' and not current then
+        return 0
+    end
+    if current and tonumber(current) > tonumber(ARGV[1]) then
+        return 0
+    end
+    redis.call('del', KEYS[1])
+    redis.call('hset', KEYS[1], 'version', ARGV[1], unpack(ARGV, 4))
+    redis.call('expire', KEYS[1], ARGV[2])
+    return 1
+    """
+    redis = LazyClient('raw_redis')
+    write_script = LazyScript('raw_redis', WRITE_SCRIPT)
+    release_script = LazyScript('raw_redis', ResponseCache.RELEASE_SCRIPT)
+
+    def __init__(self, pages=COMMENT_THREAD_PAGES, page_size=TwentyPagination.page_size, timeout=COMMENT_THREAD_TIMEOUT,
+                 lock_timeout=RESPONSE_CACHE_LOCK_TIMEOUT):
+        self.pages = pages
+        self.page_size = page_size
+        self.timeout = timeout
+        self.lock_timeout = lock_timeout
+
+    @staticmethod
+    def get_key(article_id):
+        return comment_thread_key(article_id)
+
+    def build(self, article_id):
+        """
+        从数据库生成缓存的各页, 排序与评论列表接口一致
+        :param article_id:
+        :return: {字段: 值}, 包括 count 与 page_1 ... page_n
+        """
+        queryset = Comment.objects.filter(article_id=article_id)
+        comment_ids = list(queryset.values_list('id', flat=True)[:self.pages * self.page_size])
+        comments = comment_thread_serializer.serialize_ids(comment_ids)
+        fields = {'count': count_cache.count(queryset)}
+        for page in range(max(1, (len(comments) + self.page_size - 1) // self.page_size)):
+            items = comments[page * self.page_size: (page + 1) * self.page_size]
+            fields['page_{}'.format(page + 1)] = b'[' + b','.join(encode_response(item) for item in items) + b']'
+        return fields
+
+    def refresh(self, article_id, only_cached=False):
+        """
+        重新生成并写入一篇文章的缓存
+        :param article_id:
+        :param only_cached: 只重写已缓存的文章, 未被读取过的文章不生成
+        :return: 生成的字段, 未生成时为 None
+        """
+        key = self.get_key(article_id)
+        if only_cached and not self.redis.exists(key):
+            return None
+        version_key = REDIS_KEY['comment_thread_version_key'].format(article_id)
+        pipe = self.redis.pipeline()
+        pipe.incr(version_key)
+        pipe.expire(version_key, COMMENT_THREAD_VERSION_TIMEOUT)
+        version, _ = pipe.execute()
+
+        fields = self.build(article_id)
+        args = [version, self.timeout, int(only_cached)]
+        for name, value in fields.items():
+            args.extend((name, value))
+        self.write_script(keys=[key], args=args)
+        return fields
+
+    def get_page(self, article_id, page):
+        """
+        读取缓存的一页并补全作者信息
+        :param article_id:
+        :param page:
+        :return: (总数, 该页编码后的评论列表), 页码超出缓存范围、不存在或等待超时时为 None
+        """
+        cached = self.get_template(article_id, page)
+        if cached is None:
+            return None
+        count, content = cached
+        content, = author_store.fill([content])
+        return count, content
+
+    def get_template(self, article_id, page):
+        """
+        读取缓存的一页(作者信息为占位), 未缓存时由持有锁的请求生成全部缓存页, 其余请求等待结果
+        :param article_id:
+        :param page:
+        :return: (总数, 该页编码后的评论列表), 页码超出缓存范围、不存在或等待超时时为 None
+        """
+        if page > self.pages:
+            return None
+        key = self.get_key(article_id)
+        field = 'page_{}'.format(page)
+        count, content = self.redis.hmget(key, 'count', field)
+        if count is not None:
+            self.record(article_id, 'hit')
+            return (int(count), content) if content is not None else None
+
+        self.record(article_id, 'miss')
+        lock_key = key + '_lock'
+        token = uuid.uuid4().hex
+        if self.redis.set(lock_key, token, nx=True, px=self.lock_timeout):
+            try:
+                fields = self.refresh(article_id)
+            finally:
+                self.release_script(keys=[lock_key], args=[token])
+            return (fields['count'], fields[field]) if field in fields else None
+
+        deadline = time.monotonic() + self.lock_timeout / 1000
+        while time.monotonic() < deadline:
+            time.sleep(RESPONSE_CACHE_LOCK_WAIT)
+            count, content = self.redis.hmget(key, 'count', field)
+            if count is not None:
+                return (int(count), content) if content is not None else None
+        # 等待超时由调用方直接查询数据库
+        return None
+
+    @staticmethod
+    def get_metrics_key(days_ago=0):
+        return REDIS_KEY['comment_thread_metrics_key'].format(
+            time.strftime('%Y%m%d', time.localtime(time.time() - days_ago * 24 * 60 * 60))
+        )
+
+    def record(self, article_id, result):
+        """
+        抽样记录命中与未命中, 读取路径上大部分请求不写 redis
+        统计按天分键并设置过期时间, 不会无限增长
+        :param article_id:
+        :param result: hit 或 miss
+        :return:
+        """
+        if random.random() >= COMMENT_THREAD_METRICS_SAMPLE:
+            return
+        key = self.get_metrics_key()
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hincrby(key, '{}_{}'.format(article_id, result), 1)
+        pipe.expire(key, COMMENT_THREAD_METRICS_DAYS * 24 * 60 * 60)
+        pipe.execute()
+
+    def get_metrics(self, days=1):
+        """
+        按文章统计最近几天的命中率, 次数为按抽样比例换算的估计值
+        :param days:
+        :return: {文章id: {"hit": 命中数, "miss": 未命中数, "hit_ratio": 命中率}}
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        for days_ago in range(min(days, COMMENT_THREAD_METRICS_DAYS)):
+            pipe.hgetall(self.get_metrics_key(days_ago))
+        metrics = {}
+        for counts in pipe.execute():
+            for name, value in counts.items():
+                article_id, result = name.decode('utf-8').rsplit('_', 1)
+                item = metrics.setdefault(int(article_id), {'hit': 0, 'miss': 0})
+                item[result] += int(value)
+        for item in metrics.values():
+            total = item['hit'] + item['miss']
+            item['hit_ratio'] = item['hit'] / total if total else 0
+            item['hit'] = round(item['hit'] / COMMENT_THREAD_METRICS_SAMPLE)
+            item['miss'] = round(item['miss'] / COMMENT_THREAD_METRICS_SAMPLE)
+        return metrics
+
+    def clear_metrics(self):
+        self.redis.delete(*[self.get_metrics_key(days_ago) for days_ago in range(COMMENT_THREAD_METRICS_DAYS)])
+
+    def get_paginated_data(self, request, page, count, content):
+        """
+        组合与 TwentyPagination 相同结构的分页数据, 翻页链接按当前请求生成
+        :param request:
+        :param page:
+        :param count:
+        :param content:
+        :return:
+        """
+        url = request.build_absolute_uri()
+        num_pages = max(1, (count + self.page_size - 1) // self.page_size)
+        if page < num_pages:
+            next_link = replace_query_param(url, 'page', page + 1)
+        else:
+            next_link = None
+        if page == 1:
+            previous_link = None
+        elif page == 2:
+            previous_link = remove_query_param(url, 'page')
+        else:
+            previous_link = replace_query_param(url, 'page', page - 1)
+        return OrderedDict([
+            ('count', count),
+            ('next', next_link),
+            ('previous', previous_link),
+            ('results', RawJSON(content))
+        ])
+
+
+comment_thread_cache = CommentThreadCache()
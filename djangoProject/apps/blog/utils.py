@@ -1,3 +1,5 @@
+import base64
+import binascii
 import json
 import logging
 import random
@@ -7,22 +9,23 @@ from collections import OrderedDict
 
 import requests
 from django.db.models import Q
-from elasticsearch_dsl import Search, Document, Text, Boolean, Date, Keyword, UpdateByQuery
-from elasticsearch_dsl.connections import connections
 from django.conf import settings
 from django.http import HttpResponse
 from django.utils import timezone
 from django_redis.pool import ConnectionFactory
-from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.exceptions import AuthenticationFailed, NotFound
 from rest_framework.pagination import PageNumberPagination
 from aliyunsdkcore.request import RpcRequest
 from aliyunsdkcore.client import AcsClient
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.views import exception_handler
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.exceptions import InvalidToken
+from blog.clients import LazyClient
 from blog.errcode import AUTH_FAIL, NO_PERMISSION, NO_METHOD, UNKNOWN_ERROR, NOT_FOUND
 from blog.models import VerifyCode, User
-from blog.constants import ARTICLE_INDEX
+from blog.counter import CachedCountPaginator
+from blog.encoders import encode_response
 
 logger = logging.getLogger(__name__)
 
@@ -102,24 +105,167 @@ class PaginationMixin:
         ])
 
 
-class TenPagination(PageNumberPagination, PaginationMixin):
+class KeysetPaginationMixin:
+    """
+    游标分页: 按 (datetime_created, id) 倒序翻页, 避免深分页 OFFSET 线性变慢
+    请求携带 cursor 参数或 pagination=cursor 时启用, 否则仍走页码分页
+    """
+    cursor_query_param = 'cursor'
+    mode_query_param = 'pagination'
+    keyset_fields = ('datetime_created', 'id')
+    keyset_mode = False
+    invalid_cursor_message = 'Invalid cursor'
+
+    def keyset_requested(self, request):
+        """
+        判断本次请求是否使用游标分页
+        :param request:
+        :return:
+        """
+        return request.query_params.get(self.mode_query_param) == 'cursor' or \
+            self.cursor_query_param in request.query_params
+
+    @staticmethod
+    def encode_cursor(values, reverse=False):
+        """
+        游标编码 格式: 方向|时间|id
+        :param values:
+        :param reverse:
+        :return:
+        """
+        datetime_created, instance_id = values
+        raw = '{}|{}|{}'.format(int(reverse), datetime_created.isoformat(), instance_id)
+        return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, request):
+        """
+        游标解码
+        :param request:
+        :return: (reverse, datetime_created, id) 或 None
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8')
+            reverse, datetime_created, instance_id = raw.split('|')
+            return (
+                bool(int(reverse)),
+                datetime.datetime.fromisoformat(datetime_created),
+                int(instance_id)
+            )
+        except (TypeError, ValueError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_keyset_link(self, item, reverse):
+        """
+        生成翻页链接
+        :param item:
+        :param reverse:
+        :return:
+        """
+        values = [getattr(item, field) for field in self.keyset_fields]
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, self.encode_cursor(values, reverse)
+        )
+
+    def paginate_keyset(self, queryset, request):
+        """
+        游标分页 只查询 page_size + 1 行判断是否有下一页, 不做 COUNT
+        :param queryset:
+        :param request:
+        :return:
+        """
+        date_field, id_field = self.keyset_fields
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        reverse = cursor[0] if cursor is not None else False
+
+        if reverse:
+            queryset = queryset.order_by(date_field, id_field)
+        else:
+            queryset = queryset.order_by('-' + date_field, '-' + id_field)
+
+        if cursor is not None:
+            _, datetime_created, instance_id = cursor
+            compare = 'gt' if reverse else 'lt'
+            queryset = queryset.filter(
+                Q(**{'{}__{}'.format(date_field, compare): datetime_created}) |
+                Q(**{date_field: datetime_created, '{}__{}'.format(id_field, compare): instance_id})
+            )
+
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+
+        self.next_link = None
+        self.previous_link = None
+        if results:
+            if has_more or reverse:
+                self.next_link = self.get_keyset_link(results[-1], reverse=False)
+            if cursor is not None and (has_more or not reverse):
+                self.previous_link = self.get_keyset_link(results[0], reverse=True)
+        return results
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset_mode = self.keyset_requested(request)
+        if not self.keyset_mode:
+            return super().paginate_queryset(queryset, request, view=view)
+
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        return self.paginate_keyset(queryset, request)
+
+    def get_paginated_data(self, data):
+        """
+        游标分页不返回 count
+        :param data:
+        :return:
+        """
+        if not self.keyset_mode:
+            return super().get_paginated_data(data)
+
+        return OrderedDict([
+            ('next', self.next_link),
+            ('previous', self.previous_link),
+            ('results', data)
+        ])
+
+
+class TenPagination(KeysetPaginationMixin, PageNumberPagination, PaginationMixin):
     page_size = 10
+    django_paginator_class = CachedCountPaginator
 
 
 class TwentyPagination(PageNumberPagination, PaginationMixin):
     page_size = 20
+    django_paginator_class = CachedCountPaginator
+
+
+class ReplyPagination(KeysetPaginationMixin, PageNumberPagination, PaginationMixin):
+    """
+    回复只使用游标分页, 回复很多的评论翻页无需 COUNT 与 OFFSET
+    """
+    page_size = 20
+
+    def keyset_requested(self, request):
+        return True
 
 
 def custom_response(data, status, *args, **kwargs):
     """
-    设置自定义响应
+    设置自定义响应, data 可以是错误码模板、响应体或已编码的字节
     :param data:
     :param status:
     :param args:
     :param kwargs:
     :return:
     """
-    return HttpResponse(json.dumps(data, ensure_ascii=False), status=status, *args, **kwargs)
+    if not isinstance(data, bytes):
+        data = encode_response(data)
+    return HttpResponse(data, status=status, *args, **kwargs)
 
 
 def custom_exception_handler(exception, context):
@@ -141,11 +287,10 @@ def custom_exception_handler(exception, context):
                 NO_PERMISSION, 200
             )
         elif response.data['status_code'] == 401:
-            AUTH_FAIL['data'] = {
-                'info': response.data.get('detail')
-            }
             return custom_response(
-                AUTH_FAIL, 200
+                AUTH_FAIL.with_data({
+                    'info': response.data.get('detail')
+                }), 200
             )
         elif response.data['status_code'] == 405:
             return custom_response(
@@ -185,13 +330,19 @@ class CustomAuth(JWTAuthentication):
         return user
 
 
+def create_acs_client():
+    """
+    创建阿里云短信客户端, 由客户端注册表在首次发送时调用
+    :return:
+    """
+    return AcsClient(settings.ALIYUN_SMS_ACCESS_ID, settings.ALIYUN_SMS_ACCESS_KEY, SendSMS.REGION)
+
+
 class SendSMS:
     REGION = "cn-hangzhou"
     PRODUCT_NAME = "Dysmsapi"
     DOMAIN = "dysmsapi.aliyuncs.com"
-
-    def __init__(self):
-        self.acs_client = AcsClient(settings.ALIYUN_SMS_ACCESS_ID, settings.ALIYUN_SMS_ACCESS_KEY, self.REGION)
+    acs_client = LazyClient('sms')
 
     def send_sms(self, template_param=None, **kwargs):
         """
@@ -262,109 +413,6 @@ class SendSMS:
 
 send_sms = SendSMS()
 
-connections.create_connection(
-    hosts=[settings.ES_URL],
-    http_auth=(settings.ES_USER, settings.ES_PASSWORD),
-    port=9200,
-    use_ssl=False
-)
-article_index = ARTICLE_INDEX
-
-
-class Article(Document):
-    search_word = Text(analyzer="ik_max_word")
-    author = Text(fields={'raw': Keyword()})
-    datetime_created = Date()
-    publish_status = Boolean()
-
-    class Index:
-        name = article_index
-
-    def save(self, **kwargs):
-        self.datetime_created = datetime.datetime.now()
-        return super().save(**kwargs)
-
-
-class SearchByEs:
-
-    def __init__(self):
-        Article.init()
-        self.article = Article
-
-    def handle_search(self, article_id, search_word, publish_status, author):
-        """
-        文章设置搜索词
-        :param article_id:
-        :param search_word:
-        :param publish_status:
-        :param author:
-        :return:
-        """
-        article = self.article(
-            meta={'id': article_id},
-            author=author,
-            search_word=search_word,
-            publish_status=publish_status,
-        )
-        article.save()
-
-    @staticmethod
-    def update_search_by_author(old_author, new_author):
-        """
-        文章批量更新搜索词
-        :param old_author:
-        :param new_author:
-        :return:
-        """
-        ubq = UpdateByQuery(index=article_index).query(
-            "match_phrase", author=old_author
-        ).script(
-            source="ctx._source.author = params.author",
-            lang='painless',
-            params={
-                'author': new_author
-            }
-        )
-        ubq.execute()
-
-    @staticmethod
-    def query_search(search_word, page=1, page_size=10):
-        """
-        文章查询搜索词
-        :param search_word:
-        :param page:
-        :param page_size:
-        :return:
-        """
-        search = Search(
-            index=article_index
-        ).query(
-            "multi_match", query=search_word, fields=['author', 'search_word']
-        ).query(
-            "match_phrase", publish_status=True
-        ).sort(
-            '-datetime_created'
-        ).source(
-            '_id'
-        )[(page - 1) * page_size: page * page_size]
-        res_count = search.count()
-        res = search.execute()
-
-        return res.to_dict(), res_count
-
-    def delete_search(self, article_id):
-        """
-        文章删除搜索词
-        :param article_id:
-        :return:
-        """
-        search = self.article.get(id=article_id, ignore=404)
-        if search is not None:
-            search.delete()
-
-
-es_search = SearchByEs()
-
 
 def robot_send_alert(title, content):
     alert_url = settings.ROBOT_HOOK_URL
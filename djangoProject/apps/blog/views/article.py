@@ -1,12 +1,28 @@
+from functools import partial
+
+from django.db import transaction
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.viewsets import GenericViewSet
-from blog.errcode import ARTICLE_INFO, PARAM_ERROR, SUCCESS, COMMENT_INFO, MUST_LOG_IN
+from blog.authors import author_store
+from blog.cache import response_cache, article_scope, normalize_keywords, search_key
+from blog.cards import article_card_store
+from blog.conditional import feed_etag, feed_last_modified, article_etag, article_last_modified, comment_etag, \
+    comment_last_modified
+from blog.compiled_serializers import article_excerpt_serializer, comment_serializer, reply_serializer
+from blog.constants import ARTICLE_BATCH_MAX, SEARCH_CACHE_TIMEOUT, REDIS_KEY
+from blog.encoders import encode_response, RawJSON
+from blog.errcode import ARTICLE_INFO, PARAM_ERROR, SUCCESS, COMMENT_INFO, MUST_LOG_IN, REPLY_INFO
 from blog.models import Article, Comment, Reply
+from blog.search import search_backend
 from blog.serializers import ArticleSerializers, CategorySerializers, CommentSerializers, ReplySerializers, \
-    SimpleArticleSerializer, CommonArticleSerializer, SimpleArticleUserSerializer
-from blog.utils import es_search, custom_response, TenPagination, TwentyPagination, CustomAuth, query_combination, \
-    QueryException
+    SimpleArticleSerializer, CommonArticleSerializer
+from blog.suggest import get_suggest
+from blog.threads import comment_thread_cache
+from blog.utils import custom_response, TenPagination, TwentyPagination, ReplyPagination, CustomAuth, \
+    query_combination, QueryException
 
 
 class ArticleViewSets(GenericViewSet):
@@ -55,15 +71,13 @@ class ArticleViewSets(GenericViewSet):
         :return:
         """
         page = self.paginator
-        instances = SimpleArticleSerializer.get_instance().order_by('-datetime_created').all()
+        instances = self.queryset.only('id', 'datetime_created').order_by('-datetime_created')
         page_list = page.paginate_queryset(instances, request, view=self)
-        serializers = SimpleArticleSerializer(
-            instance=page_list,
-            many=True
+        data = page.get_paginated_data(
+            article_excerpt_serializer.serialize_ids([instance.id for instance in page_list])
         )
-        ARTICLE_INFO['data'] = page.get_paginated_data(serializers.data)
 
-        return custom_response(ARTICLE_INFO, 200)
+        return custom_response(ARTICLE_INFO.with_data(data), 200)
 
     def create(self, request):
         """
@@ -76,7 +90,8 @@ class ArticleViewSets(GenericViewSet):
             data=request.data,
         )
         serializer.is_valid(raise_exception=True)
-        serializer.save(**context)
+        with transaction.atomic():
+            serializer.save(**context)
 
         return custom_response(SUCCESS, 200)
 
@@ -104,7 +119,8 @@ class ArticleViewSets(GenericViewSet):
             serializer.is_valid(
                 raise_exception=True
             )
-            serializer.save(**context)
+            with transaction.atomic():
+                serializer.save(**context)
 
         return custom_response(SUCCESS, 200)
 
@@ -123,7 +139,8 @@ class ArticleViewSets(GenericViewSet):
         except Article.DoesNotExist:
             return custom_response(PARAM_ERROR, 200)
         else:
-            article.delete()
+            with transaction.atomic():
+                article.delete()
 
         return custom_response(SUCCESS, 200)
 
@@ -138,60 +155,127 @@ class ArticleViewSets(GenericViewSet):
         :return:
         """
         try:
-            search_keywords = request.data['search_keywords']
-            page = int(request.data['page'])
-        except (KeyError, ValueError):
+            search_keywords = normalize_keywords(request.data['search_keywords'])
+            if 'cursor' in request.data or request.data.get('pagination') == 'cursor':
+                # 游标翻页, 第一页游标为空
+                cursor = request.data.get('cursor') or None
+                if cursor is not None:
+                    search_backend.decode_search_cursor(cursor)
+                page = 'cursor_{}'.format(cursor)
+                builder = partial(self.build_search_article_after, search_keywords, cursor)
+            else:
+                page = int(request.data['page'])
+                builder = partial(self.build_search_article, search_keywords, page)
+        except (KeyError, ValueError, TypeError):
             return custom_response(PARAM_ERROR, 200)
         else:
-            res_dict, res_count = es_search.query_search(search_keywords, page, 10)
-            article_id_list = []
-            for res in res_dict['hits']['hits']:
-                article_id_list.append(res['_id'])
-
-            articles = SimpleArticleUserSerializer.get_instance().filter(
-                id__in=article_id_list
-            ).all()
-            serializers = SimpleArticleUserSerializer(
-                instance=articles,
-                many=True,
+            content = response_cache.get_or_build(
+                search_key(search_keywords, page),
+                builder,
+                timeout=SEARCH_CACHE_TIMEOUT,
+                metrics_key=REDIS_KEY['search_cache_metrics_key']
             )
 
-            ARTICLE_INFO['data'] = {
-                "results": serializers.data,
-                "count": res_count
-            }
+        return custom_response(content, 200)
 
-        return custom_response(ARTICLE_INFO, 200)
+    @action(detail=False,
+            methods=['GET'],
+            permission_classes=[AllowAny | IsAuthenticated],
+            authentication_classes=[CustomAuth])
+    def suggest(self, request):
+        """
+        搜索提示
+        :param request:
+        :return:
+        """
+        try:
+            keywords = request.query_params['q']
+        except KeyError:
+            return custom_response(PARAM_ERROR, 200)
+
+        return custom_response(get_suggest(keywords), 200)
+
+    @staticmethod
+    def build_search_article(search_keywords, page):
+        """
+        生成搜索结果响应
+        :param search_keywords:
+        :param page:
+        :return:
+        """
+        res_dict, res_count = search_backend.query_search(
+            search_keywords, page, 10, author_store.find_ids(search_keywords)
+        )
+        data = {
+            "results": article_card_store.get_search_page(res_dict['hits']['hits']),
+            "count": res_count
+        }
+
+        return encode_response(ARTICLE_INFO.with_data(data))
+
+    @staticmethod
+    def build_search_article_after(search_keywords, cursor):
+        """
+        生成游标翻页的搜索结果响应
+        :param search_keywords:
+        :param cursor:
+        :return:
+        """
+        res_dict, res_count, next_cursor = search_backend.query_search_after(
+            search_keywords, cursor, 10, author_store.find_ids(search_keywords)
+        )
+        data = {
+            "results": article_card_store.get_search_page(res_dict['hits']['hits']),
+            "count": res_count,
+            "next": next_cursor
+        }
+
+        return encode_response(ARTICLE_INFO.with_data(data))
 
     @action(detail=False,
             methods=['GET'],
             permission_classes=[AllowAny | IsAuthenticated],
             authentication_classes=[CustomAuth])
+    @method_decorator(condition(etag_func=feed_etag, last_modified_func=feed_last_modified))
     def all_article_info(self, request):
         """
         查看所有文章
         :param request:
         :return:
         """
+        content = response_cache.get_or_build(
+            response_cache.get_key('feed', request),
+            lambda: self.build_all_article_info(request)
+        )
+
+        return custom_response(content, 200)
+
+    def build_all_article_info(self, request):
+        """
+        生成所有文章列表响应
+        :param request:
+        :return:
+        """
         page = self.paginator
-        instances = SimpleArticleUserSerializer.get_instance().filter(
+        instances = self.queryset.filter(
             publish_status=True
+        ).only(
+            'id', 'datetime_created'
         ).order_by(
             '-datetime_created'
-        ).all()
+        )
         page_list = page.paginate_queryset(instances, request, view=self)
-        serializers = SimpleArticleUserSerializer(
-            instance=page_list,
-            many=True
+        data = page.get_paginated_data(
+            article_card_store.get_page([instance.id for instance in page_list])
         )
-        ARTICLE_INFO['data'] = page.get_paginated_data(serializers.data)
 
-        return custom_response(ARTICLE_INFO, 200)
+        return encode_response(ARTICLE_INFO.with_data(data))
 
     @action(detail=False,
-            methods=['POST'],
+            methods=['GET', 'POST'],
             permission_classes=[AllowAny | IsAuthenticated],
             authentication_classes=[CustomAuth])
+    @method_decorator(condition(etag_func=article_etag, last_modified_func=article_last_modified))
     def get_article_info(self, request):
         """
         查看一篇文章
@@ -200,15 +284,73 @@ class ArticleViewSets(GenericViewSet):
         """
         try:
             article_id = int(request.query_params['id'])
+        except (KeyError, ValueError, AttributeError):
+            return custom_response(PARAM_ERROR, 200)
+        else:
+            content = response_cache.get_or_build(
+                response_cache.get_key(article_scope(article_id), request),
+                lambda: self.build_article_info(article_id)
+            )
+
+        return custom_response(content, 200)
+
+    @staticmethod
+    def build_article_info(article_id):
+        """
+        生成文章详情响应
+        :param article_id:
+        :return:
+        """
+        try:
             serializer = SimpleArticleSerializer(
                 instance=SimpleArticleSerializer.get_instance().get(
                     id=article_id, publish_status=False))
-        except (KeyError, ValueError, AttributeError, Article.DoesNotExist):
-            return custom_response(PARAM_ERROR, 200)
+        except Article.DoesNotExist:
+            return encode_response(PARAM_ERROR)
         else:
-            ARTICLE_INFO['data'] = serializer.data
+            data = serializer.data
 
-        return custom_response(ARTICLE_INFO, 200)
+        return encode_response(ARTICLE_INFO.with_data(data))
+
+    @action(detail=False,
+            methods=['POST'],
+            permission_classes=[AllowAny | IsAuthenticated],
+            authentication_classes=[CustomAuth])
+    def batch_article_info(self, request):
+        """
+        批量查看文章, 按请求顺序返回, 不存在的文章以 null 占位并列入 not_found
+        :param request:
+        :return:
+        """
+        try:
+            if hasattr(request.data, 'getlist'):
+                article_ids = [int(article_id) for article_id in request.data.getlist('ids')]
+            else:
+                ids = request.data['ids']
+                # JSON 字符串也可迭代, "12" 会被拆成 1 和 2
+                if not isinstance(ids, (list, tuple)):
+                    return custom_response(PARAM_ERROR, 200)
+                article_ids = [int(article_id) for article_id in ids]
+        except (KeyError, ValueError, TypeError):
+            return custom_response(PARAM_ERROR, 200)
+        if not article_ids or len(article_ids) > ARTICLE_BATCH_MAX:
+            return custom_response(PARAM_ERROR, 200)
+
+        published = set(
+            self.queryset.filter(
+                id__in=set(article_ids),
+                publish_status=True
+            ).values_list('id', flat=True)
+        )
+        fetch_ids = [article_id for article_id in dict.fromkeys(article_ids) if article_id in published]
+        cards = dict(zip(fetch_ids, article_card_store.get_many(fetch_ids)))
+        results = [cards.get(article_id) for article_id in article_ids]
+        data = {
+            "results": RawJSON(b'[' + b','.join(b'null' if card is None else card for card in results) + b']'),
+            "not_found": [article_id for article_id, card in zip(article_ids, results) if card is None]
+        }
+
+        return custom_response(ARTICLE_INFO.with_data(data), 200)
 
     @action(detail=False,
             methods=['POST'],
@@ -218,22 +360,22 @@ class ArticleViewSets(GenericViewSet):
         page = self.paginator
         try:
             filter_objects = query_combination(request.data)
-            instances = SimpleArticleUserSerializer.get_instance().filter(
+            instances = self.queryset.filter(
                 filter_objects
+            ).only(
+                'id', 'datetime_created'
             ).order_by(
                 '-datetime_created'
-            ).all()
+            )
         except (QueryException, ValueError):
             return custom_response(PARAM_ERROR, 200)
         else:
             page_list = page.paginate_queryset(instances, request, view=self)
-            serializers = SimpleArticleUserSerializer(
-                instance=page_list,
-                many=True
+            data = page.get_paginated_data(
+                article_card_store.get_page([instance.id for instance in page_list])
             )
-            ARTICLE_INFO['data'] = page.get_paginated_data(serializers.data)
 
-        return custom_response(ARTICLE_INFO, 200)
+        return custom_response(ARTICLE_INFO.with_data(data), 200)
 
 
 class CommentViewSets(GenericViewSet):
@@ -243,6 +385,7 @@ class CommentViewSets(GenericViewSet):
     serializer_class = CommentSerializers
     pagination_class = TwentyPagination
 
+    @method_decorator(condition(etag_func=comment_etag, last_modified_func=comment_last_modified))
     def list(self, request):
         """
         获得一篇文章的所有评论
@@ -250,23 +393,72 @@ class CommentViewSets(GenericViewSet):
         :return:
         """
         try:
-            article_id = request.query_params['id']
+            article_id = int(request.query_params['id'])
         except (KeyError, ValueError):
             return custom_response(PARAM_ERROR, 200)
         else:
+            cached = self.get_cached_comments(request, article_id)
+            if cached is not None:
+                return custom_response(COMMENT_INFO.with_data(cached), 200)
+
             page = self.paginator
-            instances = self.serializer_class.get_instance().filter(
+            instances = self.queryset.filter(
                 article_id=article_id
-            ).all()
+            ).only('id')
             page_list = page.paginate_queryset(instances, request, view=self)
-            serializers = self.serializer_class(
-                instance=page_list,
-                many=True
+
+            data = page.get_paginated_data(
+                comment_serializer.serialize_ids([instance.id for instance in page_list])
             )
 
-            COMMENT_INFO['data'] = page.get_paginated_data(serializers.data)
+        return custom_response(COMMENT_INFO.with_data(data), 200)
 
-        return custom_response(COMMENT_INFO, 200)
+    @staticmethod
+    def get_cached_comments(request, article_id):
+        """
+        前几页评论从评论列表缓存读取, 其他页码返回 None 由数据库分页
+        :param request:
+        :param article_id:
+        :return:
+        """
+        try:
+            page = int(request.query_params.get('page', 1))
+        except ValueError:
+            return None
+        if page < 1:
+            return None
+        cached = comment_thread_cache.get_page(article_id, page)
+        if cached is None:
+            return None
+        count, content = cached
+        return comment_thread_cache.get_paginated_data(request, page, count, content)
+
+    @action(detail=False,
+            methods=['GET'],
+            permission_classes=[AllowAny | IsAuthenticated],
+            authentication_classes=[CustomAuth])
+    def replies(self, request):
+        """
+        获得一条评论的全部回复, 由新到旧游标分页
+        :param request:
+        :return:
+        """
+        try:
+            comment_id = int(request.query_params['id'])
+        except (KeyError, ValueError):
+            return custom_response(PARAM_ERROR, 200)
+        else:
+            page = ReplyPagination()
+            instances = Reply.objects.select_related(None).filter(
+                comment_id=comment_id
+            ).only('id', 'datetime_created')
+            page_list = page.paginate_queryset(instances, request, view=self)
+
+            data = page.get_paginated_data(
+                reply_serializer.serialize_ids([instance.id for instance in page_list])
+            )
+
+        return custom_response(REPLY_INFO.with_data(data), 200)
 
     def create(self, request):
         """
@@ -298,7 +490,8 @@ class CommentViewSets(GenericViewSet):
         else:
             serializer = ReplySerializers(data=request.data)
             serializer.is_valid(raise_exception=True)
-            serializer.save(user=request.user)
+            with transaction.atomic():
+                serializer.save(user=request.user)
 
         return custom_response(SUCCESS, 200)
 
@@ -317,10 +510,11 @@ class CommentViewSets(GenericViewSet):
         except (KeyError, ValueError, AttributeError):
             return custom_response(PARAM_ERROR, 200)
         else:
-            self.queryset.filter(
-                id=comment_id,
-                user=request.user
-            ).delete()
+            with transaction.atomic():
+                self.queryset.filter(
+                    id=comment_id,
+                    user=request.user
+                ).delete()
 
         return custom_response(SUCCESS, 200)
 
@@ -339,9 +533,10 @@ class CommentViewSets(GenericViewSet):
         except (KeyError, ValueError, AttributeError):
             return custom_response(PARAM_ERROR, 200)
         else:
-            Reply.objects.filter(
-                id=reply_id,
-                user=request.user
-            ).delete()
+            with transaction.atomic():
+                Reply.objects.filter(
+                    id=reply_id,
+                    user=request.user
+                ).delete()
 
         return custom_response(SUCCESS, 200)
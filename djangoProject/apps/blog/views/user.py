@@ -2,7 +2,7 @@ import uuid
 from django.contrib.auth import authenticate
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ObjectDoesNotExist
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from django.utils import timezone
 from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError
@@ -37,9 +37,9 @@ class UserViewSets(GenericViewSet):
                 'username', 'email', 'display_account', 'icon'
             ).get(request.user.id)
         )
-        USER_INFO['data'] = serializer.data
+        data = serializer.data
 
-        return custom_response(USER_INFO, 200)
+        return custom_response(USER_INFO.with_data(data), 200)
 
     @action(detail=False,
             methods=['POST'],
@@ -71,12 +71,12 @@ class UserViewSets(GenericViewSet):
             return custom_response(PARAM_ERROR, 200)
         else:
             token = RefreshToken.for_user(blog_user)
-            TOKEN['data'] = {
+            data = {
                 'access_token': "Bearer " + str(token.access_token),
                 'refresh': "Bearer " + str(token)
             }
 
-            return custom_response(TOKEN, 200)
+            return custom_response(TOKEN.with_data(data), 200)
 
     @action(detail=False,
             methods=['POST'],
@@ -94,7 +94,8 @@ class UserViewSets(GenericViewSet):
                 if re.match(self.email_format, email):
                     blog_user = self.serializer_class(request.user, data=request.data, partial=True)
                     blog_user.is_valid(raise_exception=True)
-                    blog_user.save()
+                    with transaction.atomic():
+                        blog_user.save()
                 else:
 
                     return custom_response(EMAIL_FORMAT_ERROR, 200)
@@ -126,12 +127,12 @@ class UserViewSets(GenericViewSet):
             token = RefreshToken.for_user(
                 blog_user
             )
-            TOKEN['data'] = {
+            data = {
                 'access_token': "Bearer " + str(token.access_token),
                 'refresh': "Bearer " + str(token)
             }
 
-        return custom_response(TOKEN, 200)
+        return custom_response(TOKEN.with_data(data), 200)
 
     @action(detail=False,
             methods=['POST'],
@@ -169,11 +170,11 @@ class UserViewSets(GenericViewSet):
                     'ticket'
                 ]
             )
-        WEB_SOCKET_TOKEN['data'] = {
+        data = {
             'ticket': str(ticket.ticket)
         }
 
-        return custom_response(WEB_SOCKET_TOKEN, 200)
+        return custom_response(WEB_SOCKET_TOKEN.with_data(data), 200)
 
     @action(detail=False,
             methods=['GET', 'POST', 'DELETE'],
@@ -264,12 +265,12 @@ class UserViewSets(GenericViewSet):
                     instance=instance,
                     many=True
                 )
-                USER_ACTIVITY['data'] = {
+                data = {
                     "result": serializers.data,
                     "result_count": object_count
                 }
 
-            return custom_response(USER_ACTIVITY, 200)
+            return custom_response(USER_ACTIVITY.with_data(data), 200)
         elif request.method == "DELETE":
             data = request.data
             try:
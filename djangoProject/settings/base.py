@@ -271,6 +271,14 @@ APPEND_SLASH = False
 
 DJANGO_REDIS_CONNECTION_FACTORY = "blog.utils.DecodeConnectionFactory"
 
+# 响应 JSON 编码器, 为空时已安装 orjson 则使用 blog.encoders.OrjsonEncoder, 否则使用 StandardEncoder
+JSON_RESPONSE_ENCODER = None
+
+# 搜索后端, 没有 es 的环境可使用进程内后端 blog.search.embedded.EmbeddedSearchBackend
+SEARCH_BACKEND = 'blog.search.elastic.ElasticsearchBackend'
+# 进程内后端的索引快照路径
+SEARCH_INDEX_PATH = BASE_DIR / 'search_index' / 'article.idx'
+
 CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'